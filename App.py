@@ -6,11 +6,10 @@ Usage: run with streamlit, no need for runtime API
 import os
 import random
 import re
-import time
 
-import pandas as pd
 import streamlit as st
 
+from ingest import read_dataset, IngestLimitExceeded
 from main import create_session, set_model, set_data, get_chat_response
 from server import render_image
 
@@ -33,25 +32,6 @@ st.sidebar.markdown('## Settings')
 st.title("Son's Data Chat")
 
 
-def response_generator(answer):
-    '''Streamed response emulator with animated typing effect, used by UI render'''
-    answer = str(answer)
-    # resp = random.choice(
-    #     [
-    #         'Hello there! How can I assist you today?',
-    #         'Hi, human! Is there anything I can help you with?',
-    #         'Do you need help?',
-    #     ]
-    # )
-    words = answer.split()
-    word_count = len(words)
-    for word in words:
-        yield word + ' '
-        time.sleep(0.08 if word_count < 50 else word_count / 100000)
-    time.sleep(1)
-    yield ''
-
-
 # Maintain session token for stateful connection with core module
 if 'token' not in st.session_state:
     st.session_state.token = create_session(use_streamlit=True)
@@ -76,8 +56,7 @@ llm = st.sidebar.selectbox(
 # @st.cache_data(hash_funcs={'io.BytesIO': lambda f: f.name + len(f.getvalue())})
 def get_data(f):
     extension = os.path.splitext(f.name)[1][1:].lower()
-    df = pd.read_csv(f) if extension == 'csv' else pd.read_excel(f)
-    return df
+    return read_dataset(f, extension)
 
 # Data Source panel
 with st.expander('**Data Source**', icon=':material/database:', expanded=True):
@@ -108,6 +87,8 @@ with st.expander('**Data Source**', icon=':material/database:', expanded=True):
         with st.spinner('Reading data...'):
             try:
                 df = get_data(selected_file)
+            except IngestLimitExceeded as e:
+                st.exception(e)
             except (ValueError, UnicodeDecodeError):
                 st.exception(
                     'Cannot read data. Make sure you upload a valid CSV or XLSX file.'
@@ -129,13 +110,13 @@ with st.expander('**Data Source**', icon=':material/database:', expanded=True):
         set_data([df], token)
 
 
-def write_response(answer, fresh=False):
+def write_response(answer):
     '''Render LLM response based on format.'''
     if isinstance(answer, str):
         # if answer.lower().endswith('.png') or answer.lower().endswith('.jpg'):
-        if re.search(r'\.(png|jpe?g)$', answer, re.IGNORECASE):
+        if re.search(r'\.(png|jpe?g|webp)$', answer, re.IGNORECASE):
             return st.image(answer)
-        return st.write(response_generator(answer) if fresh else answer)
+        return st.write(answer)
     return st.write(answer)
 
 # Conversation panel
@@ -162,7 +143,7 @@ with st.expander('**Conversation**', icon=':material/chat:', expanded=True):
             del st.session_state.last_answer
             with messages.chat_message('assistant'):
                 print('Answer', last_answer, type(last_answer))
-                render = write_response(last_answer, fresh=True)
+                render = write_response(last_answer)
                 st.session_state.messages.append(
                     {'role': 'assistant', 'content': last_answer}
                 )
@@ -0,0 +1,208 @@
+"""
+Files generated for clients, i.e. charts saved by the LLM engine and uploaded media, and their cleanup
+
+    - Charts are saved in a folder per session, then renamed after the hash of their content,
+      so identical charts share one file and URLs never change content, allowing clients to cache them for good
+    - Charts are optionally re-encoded to WebP, downscaled to a bounded resolution, when Pillow is installed
+    - A background reaper deletes the oldest files over the disk budget of each folder, and files past their TTL,
+      in the dataset store too, whose files are touched on use
+
+Usage: Point the engine to chart_dir() of the session, store_chart() what it returns, and start() the reaper.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from dataset_store import DATASET_DIR
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+
+PUBLIC_DIR = os.environ.get('PUBLIC_DIR', os.path.join(root_path, 'public'))
+MEDIA_DIR = os.environ.get('MEDIA_DIR', os.path.join(root_path, 'media'))
+
+# Re-encode charts to 'webp' or keep them as 'png', and maximum width and height of re-encoded charts
+CHART_FORMAT = os.environ.get('CHART_FORMAT', 'png').lower()
+CHART_MAX_SIDE = int(os.environ.get('CHART_MAX_SIDE', 1600))
+CHART_QUALITY = int(os.environ.get('CHART_QUALITY', 90))
+
+# Disk budgets of charts and uploaded media, and seconds files are kept, forever if 0
+CHART_MAX_BYTES = int(os.environ.get('CHART_MAX_MB', 512)) * 1024 * 1024
+MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_MB', 4096)) * 1024 * 1024
+ARTIFACT_TTL = float(os.environ.get('ARTIFACT_TTL', 24 * 60 * 60))
+# Disk budget of stored datasets, one file per distinct upload and head selection, and seconds they are kept unused
+DATASET_MAX_BYTES = int(os.environ.get('DATASET_MAX_MB', 8192)) * 1024 * 1024
+DATASET_TTL = float(os.environ.get('DATASET_TTL', 7 * 24 * 60 * 60))
+# Seconds between reaper runs, and minimum age of files it deletes, so clients can fetch new files first
+REAP_INTERVAL = float(os.environ.get('REAP_INTERVAL', 60))
+REAP_MIN_AGE = float(os.environ.get('REAP_MIN_AGE', 5 * 60))
+
+
+def chart_dir(token: str) -> str:
+    """Folder of charts of a session, named after a hash of its token so public URLs don't reveal the token."""
+    return os.path.join(PUBLIC_DIR, hashlib.sha1(token.encode()).hexdigest()[:16])
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        while block := file.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def encode_webp(source: str, path: str):
+    """Write image source as WebP to path, downscaled to fit CHART_MAX_SIDE, atomically."""
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with Image.open(source) as image:
+        image.thumbnail((CHART_MAX_SIDE, CHART_MAX_SIDE))
+        image.save(temp_path, 'WEBP', quality=CHART_QUALITY)
+    os.replace(temp_path, path)
+
+
+def store_chart(path: str) -> str:
+    """ Rename a chart saved by the engine after its content hash, re-encoding it if configured
+
+        Parameters
+        path (str): Chart just saved, in the folder of the session
+
+        Returns
+        Path of the stored chart, an existing one if the same chart was stored before
+    """
+    key = hash_file(path)
+    webp = CHART_FORMAT == 'webp' and Image is not None
+    extension = '.webp' if webp else os.path.splitext(path)[1].lower()
+    stored = os.path.join(os.path.dirname(path), key + extension)
+    if os.path.isfile(stored):
+        # Refresh recency for the reaper
+        os.utime(stored)
+        os.remove(path)
+        return stored
+    if webp:
+        try:
+            encode_webp(path, stored)
+            os.remove(path)
+            return stored
+        except (OSError, ValueError) as e:
+            print('Keeping chart as WebP encoding failed:', repr(e))
+            stored = os.path.join(os.path.dirname(path), key + os.path.splitext(path)[1].lower())
+    os.replace(path, stored)
+    return stored
+
+
+class ArtifactDirectory:
+    """Folder of generated files, including subfolders, kept under a disk budget and TTL"""
+
+    def __init__(self, directory: str, max_bytes: int | None = None, ttl: float | None = None,
+                 min_age: float = REAP_MIN_AGE):
+        """ Instantiate new folder
+
+            Parameters
+            directory (str): Folder to clean up
+            max_bytes (int): Maximum total size of files, unbounded if None
+            ttl (float): Seconds since last modification after which files are deleted, never if None
+            min_age (float): Seconds since last modification before which files are never deleted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl or None
+        self.min_age = min_age
+        self.evictions: dict[str, int] = {'expired': 0, 'budget': 0}
+
+    def files(self) -> list[tuple[float, int, str]]:
+        """Return (modification time, size, path) of files, oldest first."""
+        files = []
+        for folder, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return sorted(files)
+
+    def reap(self):
+        """Delete expired files, then the oldest ones until under budget, and remove emptied subfolders."""
+        now = time.time()
+        files = self.files()
+        total = sum(size for _, size, _ in files)
+        for modified, size, path in files:
+            age = now - modified
+            if age < self.min_age:
+                break
+            if self.ttl is not None and age > self.ttl:
+                reason = 'expired'
+            elif self.max_bytes is not None and total > self.max_bytes:
+                reason = 'budget'
+            else:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions[reason] += 1
+        for folder, subfolders, names in os.walk(self.directory, topdown=False):
+            if folder != self.directory and not subfolders and not names:
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        files = self.files()
+        return {
+            'size': len(files),
+            'bytes': sum(size for _, size, _ in files),
+            'max_bytes': self.max_bytes,
+            'evictions': dict(self.evictions),
+        }
+
+
+class Reaper:
+    """Background thread cleaning up artifact folders periodically"""
+
+    def __init__(self, directories: list[ArtifactDirectory], interval: float = REAP_INTERVAL):
+        self.directories = directories
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.reap()
+
+    def reap(self):
+        for directory in self.directories:
+            try:
+                directory.reap()
+            except Exception as e:
+                print('Artifact reaper error', directory.directory, repr(e))
+
+    def start(self):
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name='artifact-reaper', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread = None
+
+    def stats(self) -> dict:
+        return {os.path.basename(directory.directory): directory.stats() for directory in self.directories}
+
+
+charts = ArtifactDirectory(PUBLIC_DIR, CHART_MAX_BYTES, ARTIFACT_TTL)
+media = ArtifactDirectory(MEDIA_DIR, MEDIA_MAX_BYTES, ARTIFACT_TTL)
+datasets = ArtifactDirectory(DATASET_DIR, DATASET_MAX_BYTES, DATASET_TTL)
+reaper = Reaper([charts, media, datasets])
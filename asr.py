@@ -1,18 +1,32 @@
+import bisect
+import hashlib
 import os
+import queue
 import random
 import string
-import textwrap
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import List
+from typing import Callable, Iterator
 
+import numpy as np
 import whisper
-from faster_whisper import WhisperModel
+from faster_whisper import BatchedInferencePipeline, WhisperModel
 from faster_whisper.transcribe import Segment, TranscriptionInfo
-from pydantic import BaseModel
-from whisper.audio import SAMPLE_RATE
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+from pydantic import BaseModel, ConfigDict, Field
+from whisper.audio import SAMPLE_RATE, N_SAMPLES
 from whisper.tokenizer import LANGUAGES
 
+from asr_batch import BatchScheduler, ASR_BATCH_SIZE
+from audio import DecodedAudio, probe_duration
+from cache import LRUCache, DiskCache
+from dataset_store import hash_bytes
+from subtitles import export
+from transcript import Transcript, TranscriptBuilder
+from metrics import span, record_span, asr_tokens, asr_cost
+
 
 class ASREngine(str, Enum):
     whisper = 'whisper'
@@ -23,17 +37,98 @@ class ASREngine(str, Enum):
 engine = ASREngine.faster_whisper
 
 model_sizes = ["tiny", "base", "small", "medium", "turbo", "large"]
-whisper_models = {}
-faster_whisper_models = {}
-for size in model_sizes:
-    if engine == ASREngine.whisper:
-        whisper_models[size] = whisper.load_model(size)
-    else:
-        faster_whisper_models[size] = WhisperModel(size, device="cuda", compute_type="float16")
-
 preprocess_model_size = 'base'
-whisper_model = whisper_models[preprocess_model_size] if engine == ASREngine.whisper else whisper.load_model(
-    preprocess_model_size)
+
+# Approximate resident memory of each model in MB at float16 precision; int8 takes about half
+model_memory = {'tiny': 75, 'base': 145, 'small': 480, 'medium': 1500, 'turbo': 1600, 'large': 3100}
+
+# Models are loaded on first use and kept in a bounded LRU cache, configurable from environment
+# ASR_DEVICE: 'auto' (CUDA if available, else CPU), 'cuda' or 'cpu'
+# ASR_MAX_MODELS / ASR_MAX_MODEL_MB: count and memory budgets of loaded models
+# ASR_WARMUP: comma separated model sizes to load at import, e.g. 'base,small'
+ASR_DEVICE = os.environ.get('ASR_DEVICE', 'auto')
+ASR_MAX_MODELS = int(os.environ.get('ASR_MAX_MODELS', 2))
+ASR_MAX_MODEL_MB = int(os.environ['ASR_MAX_MODEL_MB']) if os.environ.get('ASR_MAX_MODEL_MB') else None
+ASR_WARMUP = [size.strip() for size in os.environ.get('ASR_WARMUP', '').split(',') if size.strip()]
+
+# Long media is split into windows transcribed in parallel, configurable from environment
+# ASR_CHUNK_SECONDS: target window length, cut at the closest pause in speech found by VAD
+# ASR_CHUNK_OVERLAP: seconds of audio shared by neighbouring windows when no pause is found to cut at
+# ASR_CHUNK_WORKERS: windows decoded at once, also the number of parallel decoders of each faster-whisper model
+ASR_CHUNK_SECONDS = float(os.environ.get('ASR_CHUNK_SECONDS', 120))
+ASR_CHUNK_OVERLAP = float(os.environ.get('ASR_CHUNK_OVERLAP', 2))
+ASR_CHUNK_WORKERS = int(os.environ.get('ASR_CHUNK_WORKERS', 2))
+
+# Decoded results are kept on disk, keyed by audio content and decoding options
+# TRANSCRIPT_DIR / TRANSCRIPT_CACHE_MB: folder and size budget of cached results
+TRANSCRIPT_DIR = os.environ.get('TRANSCRIPT_DIR', os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                                'data', 'transcripts'))
+TRANSCRIPT_CACHE_MB = int(os.environ.get('TRANSCRIPT_CACHE_MB', 512))
+
+# Length of audio transcribed when limit is 'head'
+HEAD_SECONDS = 60
+
+
+def select_device() -> (str, str):
+    """Return device and compute type to load models with, falling back to CPU/int8 without CUDA."""
+    device = ASR_DEVICE
+    if device == 'auto':
+        try:
+            import ctranslate2
+            device = 'cuda' if ctranslate2.get_cuda_device_count() > 0 else 'cpu'
+        except ImportError:
+            import torch
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    return device, 'float16' if device == 'cuda' else 'int8'
+
+
+device, compute_type = select_device()
+
+models = LRUCache(max_items=ASR_MAX_MODELS,
+                  max_bytes=ASR_MAX_MODEL_MB * 1024 * 1024 if ASR_MAX_MODEL_MB else None,
+                  on_evict=lambda key, model, reason: print('Unloaded ASR model', key, reason))
+model_locks: dict[tuple, threading.Lock] = {}
+model_locks_lock = threading.Lock()
+
+
+def get_model(size: str, model_engine: ASREngine = engine):
+    """Return the model of given size and engine, loading it on first use."""
+    if size not in model_sizes:
+        raise ValueError(f'Unknown model size {size}')
+    key = (model_engine.value, size)
+    model = models.get(key)
+    if model is not None:
+        return model
+    # Serialize loading per model so concurrent requests don't load the same weights twice
+    with model_locks_lock:
+        lock = model_locks.setdefault(key, threading.Lock())
+    with lock:
+        model = models.peek(key)
+        if model is None:
+            print(f'Loading {model_engine} {size} model on {device} ({compute_type})')
+            if model_engine == ASREngine.whisper:
+                model = whisper.load_model(size, device=device)
+            else:
+                model = WhisperModel(size, device=device, compute_type=compute_type, num_workers=ASR_CHUNK_WORKERS)
+            mb = model_memory[size] if compute_type == 'float16' or model_engine == ASREngine.whisper \
+                else model_memory[size] // 2
+            models.put(key, model, mb * 1024 * 1024)
+        return model
+
+
+def get_preprocess_model():
+    """Return the Whisper model used for language detection."""
+    return get_model(preprocess_model_size, ASREngine.whisper)
+
+
+def warm_up(sizes: list[str]):
+    """Preload models of given sizes, e.g. at server start."""
+    for model_size in sizes:
+        get_model(model_size)
+
+
+if ASR_WARMUP:
+    warm_up(ASR_WARMUP)
 
 word_timestamps = True
 
@@ -46,7 +141,10 @@ class DecodeConfig(BaseModel):
 
 
 class DecodeResult(BaseModel):
-    segments: List[Segment | dict] | None = None
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # Decoded segments in columnar form, serialized page by page with page() rather than with the model
+    transcript: Transcript | None = Field(default=None, exclude=True)
     lang: str = 'en'
     language: str = 'English'
     info: TranscriptionInfo | None = None
@@ -58,13 +156,170 @@ class DecodeResult(BaseModel):
     tokens: int | None = None
     cost: float | None = None
     estimated_cost: float | None = None
+    cached: bool = False
+
+    @property
+    def segments(self) -> Transcript | None:
+        """Segments, iterable as dicts"""
+        return self.transcript
+
+    def page(self, offset: int = 0, limit: int | None = None) -> dict:
+        """Return result as dict with a page of segments, and their total number to fetch the next pages."""
+        result = self.model_dump()
+        result['segments'] = self.transcript.page(offset, limit) if self.transcript is not None else None
+        result['total_segments'] = len(self.transcript) if self.transcript is not None else 0
+        result['offset'] = offset
+        return result
+
+    def to_bytes(self) -> bytes:
+        return self.transcript.to_bytes(self.model_dump())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'DecodeResult':
+        transcript, meta = Transcript.from_bytes(data)
+        return cls(transcript=transcript, **meta)
+
+
+chunk_executor = ThreadPoolExecutor(max_workers=ASR_CHUNK_WORKERS, thread_name_prefix='asr-chunk')
+
+
+def find_pauses(audio: np.ndarray) -> list[int]:
+    """Return sample positions in the middle of pauses between speech, as detected by VAD."""
+    speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+    return [(previous['end'] + following['start']) // 2 for previous, following in zip(speech, speech[1:])]
+
+
+def plan_chunks(length: int, pauses: list[int], chunk_seconds: float = ASR_CHUNK_SECONDS,
+                overlap_seconds: float = ASR_CHUNK_OVERLAP) -> list[tuple[int, int, int, int]]:
+    """ Split audio into windows to transcribe separately
+
+        Each window is cut at the last pause in its second half, or hard cut at the target length
+        with some overlap when there is none, so words are not split between windows.
+
+        Parameters
+        length (int): Number of audio samples
+        pauses (list): Sorted sample positions where cutting is safe
+        chunk_seconds (float): Target window length
+        overlap_seconds (float): Audio added to both sides of hard cuts
+
+        Returns
+        List of (start, end, audio start, audio end) in samples, where start and end delimit the part
+        a window owns and audio start and end the samples to decode
+    """
+    size = int(chunk_seconds * SAMPLE_RATE)
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    cuts = [(0, False)]
+    start = 0
+    while length - start > size:
+        end = start + size
+        i = bisect.bisect_right(pauses, end) - 1
+        if i >= 0 and pauses[i] >= start + size // 2:
+            cuts.append((pauses[i], False))
+        else:
+            cuts.append((end, True))
+        start = cuts[-1][0]
+    cuts.append((length, False))
+    return [(start, end, max(0, start - overlap) if hard_start else start, min(length, end + overlap) if hard_end else end)
+            for (start, hard_start), (end, hard_end) in zip(cuts, cuts[1:])]
+
+
+def shift_segment(segment, offset: float):
+    """Move timestamps of a segment and its words, from either engine, by offset seconds."""
+    if isinstance(segment, dict):
+        segment['start'] += offset
+        segment['end'] += offset
+        for word in segment.get('words') or []:
+            word['start'] += offset
+            word['end'] += offset
+    else:
+        segment.start += offset
+        segment.end += offset
+        for word in segment.words or []:
+            word.start += offset
+            word.end += offset
+    return segment
+
+
+def segment_value(segment, name: str):
+    return segment[name] if isinstance(segment, dict) else getattr(segment, name)
+
+
+# Whisper decodes audio in windows of 30 seconds, which is the unit of batches
+BATCH_WINDOW_SECONDS = 30
+
+
+def plan_windows(audio: np.ndarray) -> list[tuple[int, int]]:
+    """Group speech found by VAD into windows of at most 30 seconds, skipping silence between windows."""
+    speech = get_speech_timestamps(audio, VadOptions(max_speech_duration_s=BATCH_WINDOW_SECONDS,
+                                                     min_silence_duration_ms=160))
+    size = BATCH_WINDOW_SECONDS * SAMPLE_RATE
+    windows = []
+    for region in speech:
+        if windows and region['end'] - windows[-1][0] <= size:
+            windows[-1] = (windows[-1][0], region['end'])
+        else:
+            windows.append((region['start'], region['end']))
+    return windows
+
+
+def decode_batch(key: tuple, windows: list[np.ndarray], offsets: list[float]) -> list[list[Segment]]:
+    """Decode windows of several jobs in one batch with faster-whisper batched pipeline."""
+    size, task, lang, prompt, words = key
+    starts = np.cumsum([0] + [len(window) for window in windows[:-1]])
+    # The pipeline slices the audio with clips, so they are in samples
+    clips = [{'start': int(start), 'end': int(start + len(window))} for start, window in zip(starts, windows)]
+    pipeline = BatchedInferencePipeline(get_model(size))
+    segments, _ = pipeline.transcribe(np.concatenate(windows),
+                                      language=lang,
+                                      task=task,
+                                      beam_size=5,
+                                      word_timestamps=words,
+                                      without_timestamps=False,
+                                      initial_prompt=prompt,
+                                      clip_timestamps=clips,
+                                      batch_size=len(windows)
+                                      )
+    results = [[] for _ in windows]
+    for segment in segments:
+        # Segments never span clips, so their middle tells which window they belong to
+        i = bisect.bisect_right(starts, (segment.start + segment.end) / 2 * SAMPLE_RATE) - 1
+        results[i].append(shift_segment(segment, offsets[i] - starts[i] / SAMPLE_RATE))
+    return results
+
+
+# Shared by all requests so concurrent transcriptions with the same options are decoded in batches
+scheduler = BatchScheduler(decode_batch)
+
+
+def get_batch_stats():
+    return scheduler.stats()
+
+
+transcripts = DiskCache(TRANSCRIPT_DIR, TRANSCRIPT_CACHE_MB * 1024 * 1024, '.npz')
+
+
+def get_transcript_cache_stats():
+    return transcripts.stats()
 
 
-def crop_audio(path):
-    # load audio and pad/trim it to fit 60 seconds
-    audio = whisper.load_audio(path)
-    audio = whisper.pad_or_trim(audio, 60 * SAMPLE_RATE)
-    return audio
+def resolve_model_size(task: str, performance: str) -> str:
+    """Return the model size used for a task at given performance level."""
+    if task == 'translate':
+        return 'base' if performance == 'fastest' else 'small' if performance == 'fast' else 'large' if performance == 'accurate' else 'medium'
+    return 'tiny' if performance == 'fastest' else 'base' if performance == 'fast' else 'large' if performance == 'accurate' else 'turbo'
+
+
+def transcript_key(audio_hash: str, size: str, task: str, limit: str, prompt: str) -> str:
+    options = repr((engine.value, size, task, limit, prompt))
+    return f'{audio_hash}-{hashlib.sha1(options.encode()).hexdigest()}'
+
+
+def crop_result(result: DecodeResult, seconds: float) -> DecodeResult:
+    """Return the part of a full transcript starting within the first seconds, as if decoded from the head only."""
+    transcript = result.transcript.head(seconds)
+    tokens = transcript.tokens
+    return result.model_copy(update={'transcript': transcript, 'limited': True, 'tokens': tokens,
+                                     'cost': tokens * 6 / 1_000_000, 'estimated_cost': seconds * 0.006})
 
 
 def generate_id() -> str:
@@ -78,6 +333,8 @@ class Media:
     path: str
     duration: float | None = None
     result: DecodeResult | None = None
+    audio: DecodedAudio
+    hash: str
 
     def __init__(self, filename, path):
 
@@ -86,22 +343,37 @@ class Media:
         extension = os.path.splitext(filename)[1][1:].lower()
         self.type = 'audio' if extension in ['wav', 'mp3'] else 'video'
 
-        # load audio and pad/trim it to fit 30 seconds
-        audio = whisper.load_audio(path)
-        self.duration = audio.shape[0] / SAMPLE_RATE
+        # decode the whole file once in the background, language detection only waits for the first 30 seconds
+        with open(path, 'rb') as file:
+            self.hash = hash_bytes(file)
+        self.audio = DecodedAudio(path)
+        self.audio.start()
+        with span('audio_load'):
+            audio = np.array(self.audio.read(0, N_SAMPLES))
+        self.duration = probe_duration(path)
+        if self.duration is None:
+            self.duration = len(self.audio.read()) / SAMPLE_RATE
         audio = whisper.pad_or_trim(audio)
 
-        # make log-Mel spectrogram and move to the same device as the model
-        mel = whisper.log_mel_spectrogram(audio, n_mels=whisper_model.dims.n_mels).to(whisper_model.device)
+        with span('language_detection'):
+            # make log-Mel spectrogram and move to the same device as the model
+            whisper_model = get_preprocess_model()
+            mel = whisper.log_mel_spectrogram(audio, n_mels=whisper_model.dims.n_mels).to(whisper_model.device)
 
-        # detect the spoken language
-        _, probs = whisper_model.detect_language(mel)
+            # detect the spoken language
+            _, probs = whisper_model.detect_language(mel)
         lang = max(probs, key=probs.get)
         lang = str(lang)
         self.result = DecodeResult(lang=lang, language=LANGUAGES[lang].title(),
                                    duration=self.duration, estimated_cost=self.duration * 0.006)
 
-    def transcribe(self, config: DecodeConfig):
+    def transcribe(self, config: DecodeConfig, on_segment: Callable[[Segment | dict], None] | None = None):
+        """ Transcribe or translate the media, in parallel windows for long media
+
+            Parameters
+            config (DecodeConfig): Decoding options
+            on_segment (callable): Called with each segment in order as soon as it is decoded
+        """
         task = config.task
         translate = task == 'translate'
         performance = config.performance
@@ -109,71 +381,160 @@ class Media:
         prompt = config.prompt
         duration = self.result.duration
         lang = self.result.lang
-        path = self.path
+        size = resolve_model_size(task, performance)
 
-        audio = crop_audio(path) if limited else whisper.load_audio(path)
+        cached = self.get_cached_result(size, config)
+        if cached is not None:
+            print(f'Using cached {'translation' if translate else 'transcript'} of {self.filename}')
+            if on_segment:
+                for segment in cached.segments or []:
+                    on_segment(segment)
+            self.result = cached
+            return self
 
-        if translate:
-            size = 'base' if performance == 'fastest' else 'small' if performance == 'fast' else 'large' if performance == 'accurate' else 'medium'
-        else:
-            size = 'tiny' if performance == 'fastest' else 'base' if performance == 'fast' else 'large' if performance == 'accurate' else 'turbo'
+        with span('audio_load'):
+            audio = self.audio.read(0, HEAD_SECONDS * SAMPLE_RATE) if limited else self.audio.read()
 
         print(f'{'Translating' if translate else 'Transcribing'} {self.filename} with {engine} {size} model')
 
+        def decode(samples: np.ndarray) -> Iterator[Segment | dict]:
+            if engine == ASREngine.faster_whisper and ASR_BATCH_SIZE > 1:
+                key = (size, task, lang, prompt, word_timestamps and not translate)
+                return scheduler.submit(key, samples, plan_windows(samples), SAMPLE_RATE).stream()
+            model = get_model(size)
+            if engine == ASREngine.faster_whisper:
+                decoded, _ = model.transcribe(samples,
+                                              # language=lang,
+                                              task=task,
+                                              beam_size=5,
+                                              # batch_size=8,
+                                              word_timestamps=word_timestamps and not translate,
+                                              vad_filter=True,
+                                              initial_prompt=prompt
+                                              )
+                return decoded
+            result = model.transcribe(samples,
+                                      task=task,
+                                      # language=lang,
+                                      # no_speech_threshold=0.4,
+                                      # verbose=True,
+                                      word_timestamps=word_timestamps and not translate,
+                                      initial_prompt=prompt
+                                      )
+            return iter(result['segments'])
+
         start = time.time()
-        if engine == ASREngine.faster_whisper:
-            segments, _ = faster_whisper_models[size].transcribe(audio,
-                                                                 # language=lang,
-                                                                 task=task,
-                                                                 beam_size=5,
-                                                                 # batch_size=8,
-                                                                 word_timestamps=word_timestamps and not translate,
-                                                                 vad_filter=True,
-                                                                 initial_prompt=prompt
-                                                                 )
-            segments = list(segments)
-            tokens = sum(len(segment.tokens) for segment in segments)
-        else:
-            result = whisper_models[size].transcribe(audio,
-                                                     task=task,
-                                                     # language=lang,
-                                                     # no_speech_threshold=0.4,
-                                                     # verbose=True,
-                                                     word_timestamps=word_timestamps and not translate,
-                                                     initial_prompt=prompt
-                                                     )
-            segments = result['segments']
-            tokens = sum(len(segment['tokens']) for segment in segments)
+        # Only values of segments are kept, in columns, as segment objects take much more memory
+        builder = TranscriptBuilder()
+        count = 0
+        for segment in self.decode_chunks(audio, decode):
+            if isinstance(segment, dict):
+                segment['id'] = count
+                segment['text'] = segment['text'].strip()
+            else:
+                segment.id = count
+                segment.text = segment.text.strip()
+            builder.append(segment)
+            count += 1
+            if on_segment:
+                on_segment(segment)
+        transcript = builder.build()
+        tokens = transcript.tokens
         end = time.time()
-        for segment in segments:
-            segment.text = segment.text.strip()
         cost = tokens * 6 / 1_000_000
-        self.result = DecodeResult(segments=segments, lang=lang, language=LANGUAGES[lang].title(),
+        record_span('transcribe', end - start)
+        asr_tokens.inc(tokens, model=size)
+        asr_cost.inc(cost, model=size)
+        self.result = DecodeResult(transcript=transcript, lang=lang, language=LANGUAGES[lang].title(),
                                    duration=duration, task=task,
                                    decoded=True, limited=limited,
                                    tokens=tokens, cost=cost,
-                                   estimated_cost=60 * 0.006 if limited else self.result.estimated_cost,
+                                   estimated_cost=HEAD_SECONDS * 0.006 if limited else self.result.estimated_cost,
                                    decode_time=end - start)
+        transcripts.put(transcript_key(self.hash, size, task, config.limit, prompt),
+                        self.result.to_bytes())
         return self
 
-    def export_srt(self):
-        def repr_srt_time(seconds):
-            m, s = divmod(seconds, 60)
-            h, m = divmod(m, 60)
-            ms = round(s % 1000)
-            h = round(h)
-            m = round(m)
-            s = round(s)
-            return f'{h:02d}:{m:02d}:{s:02d},{ms:03d}'
-
-        segments = self.result.segments
-        srt = ''
-        for i, segment in enumerate(segments):
-            srt += textwrap.dedent(f'''\
-                                    {i + 1}
-                                    {repr_srt_time(segment.start)} --> {repr_srt_time(segment.end)}
-                                    {segment.text.strip()}
-                                    
-                                    ''')
-        filename = self.filename.split('.')[0] + '.srt'
-        return srt, filename
+    def get_cached_result(self, size: str, config: DecodeConfig) -> DecodeResult | None:
+        """Return a cached result of the same audio and options, cropping a full one for head requests."""
+        start = time.time()
+        data = transcripts.get(transcript_key(self.hash, size, config.task, config.limit, config.prompt))
+        result = None
+        if data is not None:
+            result = DecodeResult.from_bytes(data)
+        elif config.limit == 'head':
+            data = transcripts.get(transcript_key(self.hash, size, config.task, 'full', config.prompt))
+            if data is not None:
+                result = crop_result(DecodeResult.from_bytes(data), HEAD_SECONDS)
+        if result is None:
+            return None
+        # Nothing was paid for this result
+        return result.model_copy(update={'cached': True, 'cost': 0, 'decode_time': time.time() - start})
+
+    @staticmethod
+    def decode_chunks(audio: np.ndarray, decode: Callable[[np.ndarray], Iterator]) -> Iterator[Segment | dict]:
+        """ Decode audio window by window on the chunk executor, yielding segments in order as they come
+
+            Timestamps are shifted to the whole audio, and segments decoded from overlapping audio
+            are only kept by the window owning their midpoint.
+        """
+        length = len(audio)
+        chunks = plan_chunks(length, find_pauses(audio) if length > ASR_CHUNK_SECONDS * SAMPLE_RATE else [])
+        if len(chunks) == 1:
+            yield from decode(audio)
+            return
+        print(f'Decoding {length / SAMPLE_RATE:.0f} seconds of audio in {len(chunks)} windows')
+        outputs = [queue.Queue() for _ in chunks]
+        cancelled = threading.Event()
+
+        def work(chunk, output):
+            start, end, audio_start, audio_end = chunk
+            offset = audio_start / SAMPLE_RATE
+            try:
+                for segment in decode(audio[audio_start:audio_end]):
+                    if cancelled.is_set():
+                        break
+                    middle = (segment_value(segment, 'start') + segment_value(segment, 'end')) / 2 + offset
+                    if start / SAMPLE_RATE <= middle < end / SAMPLE_RATE:
+                        output.put(shift_segment(segment, offset))
+                output.put(None)
+            except BaseException as e:
+                output.put(e)
+
+        futures = [chunk_executor.submit(work, chunk, output) for chunk, output in zip(chunks, outputs)]
+        try:
+            for output in outputs:
+                while (segment := output.get()) is not None:
+                    if isinstance(segment, BaseException):
+                        raise segment
+                    yield segment
+        finally:
+            # Stop remaining windows when the consumer fails or goes away
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+
+    def release(self):
+        """Delete the decoded audio and drop decoded results, keeping the uploaded media file."""
+        self.result = None
+        self.audio.close()
+
+    def close(self):
+        """Delete the uploaded media file and its decoded audio, and drop decoded results."""
+        self.release()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def export_subtitles(self, format: str = 'srt', max_chars: int | None = None,
+                         max_cps: float | None = None) -> (Iterator[str], str):
+        """ Stream subtitles of the decoded result
+
+            Parameters as for subtitles.export()
+
+            Returns
+            Iterator of subtitle text and file name
+        """
+        if not self.result or not self.result.decoded:
+            raise ValueError('Media is not transcribed yet')
+        filename = self.filename.split('.')[0] + '.' + format
+        return export(self.result.segments, format, max_chars, max_cps), filename
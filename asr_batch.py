@@ -0,0 +1,236 @@
+"""
+Batched ASR inference shared by all transcription requests
+
+    - Each transcription job is split into windows of audio that Whisper decodes at once
+    - Windows of pending jobs with the same model size, task, language and prompt are decoded together in batches
+    - A batch starts when full, or when its oldest window has waited long enough, trading latency for throughput
+    - Every job has an ID and a future, and streams its segments in order as its batches complete
+    - Queue depth and batch occupancy are reported to tune batch size and wait time
+
+Usage: Create one BatchScheduler with a batch decoding function, then submit() jobs and consume job.stream().
+"""
+
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Hashable
+
+import numpy as np
+
+from cache import LRUCache
+from metrics import Histogram, register, record_span
+
+# Maximum windows decoded in one batch, and maximum time a window waits for the batch to fill up
+ASR_BATCH_SIZE = int(os.environ.get('ASR_BATCH_SIZE', 8))
+ASR_BATCH_WAIT = float(os.environ.get('ASR_BATCH_WAIT_MS', 50)) / 1000
+
+batch_windows = register(Histogram('datachat_asr_batch_windows', 'Number of audio windows decoded per batch',
+                                   buckets=(1, 2, 4, 8, 16, 32, 64)))
+
+# Decodes windows of audio in one batch: (key, windows, offsets in seconds of each window in its job)
+# -> list of segments of each window, with timestamps relative to its job audio
+BatchDecoder = Callable[[Hashable, list[np.ndarray], list[float]], list[list]]
+
+
+class TranscriptionJob:
+    """Audio to transcribe, split into windows that are queued for batches independently"""
+
+    def __init__(self, key: Hashable, audio: np.ndarray, windows: list[tuple[int, int]], sample_rate: int):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.audio = audio
+        self.windows = windows
+        self.sample_rate = sample_rate
+        self.status = 'queued'
+        self.submitted = time.monotonic()
+        self.done_windows = 0
+        self.results: dict[int, list] = {}  # decoded windows waiting for earlier ones
+        self.next_window = 0
+        self.segments = []
+        self.output = queue.Queue()
+        self.future = Future()
+        self.lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    def progress(self) -> float:
+        return self.done_windows / len(self.windows) if self.windows else 1
+
+    def complete(self, index: int, segments: list):
+        """Store decoded segments of a window, releasing those of all windows decoded in order so far."""
+        with self.lock:
+            if self.done:
+                return
+            self.status = 'running'
+            self.done_windows += 1
+            self.results[index] = segments
+            while self.next_window in self.results:
+                for segment in self.results.pop(self.next_window):
+                    self.segments.append(segment)
+                    self.output.put(segment)
+                self.next_window += 1
+            if self.next_window == len(self.windows):
+                self.status = 'done'
+                self.audio = None
+                self.output.put(None)
+                self.future.set_result(self.segments)
+
+    def fail(self, e: BaseException):
+        with self.lock:
+            if self.done:
+                return
+            self.status = 'failed'
+            self.audio = None
+            self.output.put(e)
+            self.future.set_exception(e)
+
+    def cancel(self):
+        """Drop windows not decoded yet, e.g. when the caller went away."""
+        with self.lock:
+            if self.done:
+                return
+            self.status = 'cancelled'
+            self.audio = None
+            self.future.cancel()
+            self.output.put(None)
+
+    def stream(self):
+        """Yield segments in order as their batches complete, cancelling the job if the consumer stops early."""
+        try:
+            while (segment := self.output.get()) is not None:
+                if isinstance(segment, BaseException):
+                    raise segment
+                yield segment
+        finally:
+            self.cancel()
+
+
+class BatchScheduler:
+    """Single decoding thread taking batches of windows from per key FIFO queues"""
+
+    def __init__(self, decode_batch: BatchDecoder, max_batch: int = ASR_BATCH_SIZE, max_wait: float = ASR_BATCH_WAIT):
+        """ Instantiate new scheduler
+
+            Parameters
+            decode_batch (callable): Decodes a batch of windows sharing the same key
+            max_batch (int): Maximum number of windows per batch
+            max_wait (float): Seconds the oldest queued window may wait for its batch to fill up
+        """
+        self.decode_batch = decode_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queues: dict[Hashable, deque] = {}  # key -> (job, window index, queued time)
+        self.condition = threading.Condition()
+        self.thread: threading.Thread | None = None
+        self.jobs = LRUCache(max_items=1000)
+        self.batches = 0
+        self.batched_windows = 0
+        self.total_wait = 0.0
+
+    def submit(self, key: Hashable, audio: np.ndarray, windows: list[tuple[int, int]],
+               sample_rate: int) -> TranscriptionJob:
+        """ Queue audio for transcription
+
+            Parameters
+            key (hashable): Decoding options, only windows with equal keys are batched together
+            audio (ndarray): Samples to transcribe
+            windows (list): (start, end) samples of each window to decode, in order
+            sample_rate (int): Sample rate of audio, to convert window offsets to seconds
+
+            Returns
+            Job with an ID, a future of all segments, and a stream of segments
+        """
+        job = TranscriptionJob(key, audio, windows, sample_rate)
+        self.jobs.put(job.id, job)
+        if not windows:
+            job.status = 'done'
+            job.output.put(None)
+            job.future.set_result([])
+            return job
+        with self.condition:
+            pending = self.queues.setdefault(key, deque())
+            for index in range(len(windows)):
+                pending.append((job, index, job.submitted))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='asr-batch', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return job
+
+    def get_job(self, job_id: str) -> TranscriptionJob | None:
+        return self.jobs.get(job_id)
+
+    def next_batch(self) -> (Hashable, list):
+        """Wait for the queue whose oldest window is due, then take up to a full batch from it."""
+        with self.condition:
+            while True:
+                for key in list(self.queues):
+                    pending = self.queues[key]
+                    while pending and pending[0][0].done:
+                        pending.popleft()
+                    if not pending:
+                        del self.queues[key]
+                if not self.queues:
+                    self.condition.wait()
+                    continue
+                key, pending = min(self.queues.items(), key=lambda item: item[1][0][2])
+                wait = pending[0][2] + self.max_wait - time.monotonic()
+                if len(pending) >= self.max_batch or wait <= 0:
+                    batch = []
+                    while pending and len(batch) < self.max_batch:
+                        item = pending.popleft()
+                        if not item[0].done:
+                            batch.append(item)
+                    return key, batch
+                self.condition.wait(wait)
+
+    def run(self):
+        while True:
+            key, batch = self.next_batch()
+            # Jobs cancelled meanwhile drop their audio and need no decoding
+            batch = [item for item in batch if item[0].audio is not None]
+            if not batch:
+                continue
+            now = time.monotonic()
+            for _, _, queued in batch:
+                self.total_wait += now - queued
+                record_span('asr_queue_wait', now - queued)
+            self.batches += 1
+            self.batched_windows += len(batch)
+            batch_windows.observe(len(batch))
+            windows = []
+            offsets = []
+            for job, index, _ in batch:
+                start, end = job.windows[index]
+                audio = job.audio
+                windows.append(audio[start:end] if audio is not None else np.zeros(end - start, dtype=np.float32))
+                offsets.append(start / job.sample_rate)
+            try:
+                results = self.decode_batch(key, windows, offsets)
+            except Exception as e:
+                print('ASR batch error', repr(e))
+                for job, _, _ in batch:
+                    job.fail(e)
+                continue
+            for (job, index, _), segments in zip(batch, results):
+                job.complete(index, segments)
+
+    def stats(self) -> dict:
+        with self.condition:
+            depth = {str(key): len(pending) for key, pending in self.queues.items()}
+        return {
+            'queue_depth': sum(depth.values()),
+            'queues': depth,
+            'max_batch': self.max_batch,
+            'max_wait': self.max_wait,
+            'batches': self.batches,
+            'windows': self.batched_windows,
+            'occupancy': self.batched_windows / (self.batches * self.max_batch) if self.batches else None,
+            'mean_wait': self.total_wait / self.batched_windows if self.batched_windows else None,
+        }
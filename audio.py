@@ -0,0 +1,121 @@
+"""
+Single-pass decoding of uploaded media into 16 kHz mono PCM, shared by all processing of the media
+
+    - ffmpeg decodes the file once in the background, streaming samples through a pipe into a raw float32 file
+    - Readers wait only for the samples they need, so language detection starts after the first 30 seconds
+    - Decoded samples are memory-mapped rather than loaded, and reused by every transcription of the media
+    - Duration is probed from the container without decoding
+
+Usage: Create DecodedAudio for a media file, start() it, then read() sample ranges as needed and close() when done.
+"""
+
+import os
+import subprocess
+import threading
+import uuid
+
+import numpy as np
+
+# Sample rate expected by Whisper models
+SAMPLE_RATE = 16000
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+# Decoded audio is kept out of the publicly mounted media folder
+AUDIO_DIR = os.environ.get('AUDIO_DIR', os.path.join(root_path, 'data', 'audio'))
+
+READ_BYTES = 1024 * 1024
+
+
+def probe_duration(path: str) -> float | None:
+    """Return duration of a media file in seconds from its container, or None if unknown."""
+    try:
+        output = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                                 '-of', 'default=noprint_wrappers=1:nokey=1', path],
+                                capture_output=True, check=True, text=True).stdout
+        return float(output.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+class DecodedAudio:
+    """PCM samples of a media file, decoded once and memory-mapped from disk"""
+
+    def __init__(self, source: str, path: str | None = None):
+        """ Instantiate decoded audio, without decoding yet
+
+            Parameters
+            source (str): Path of the media file
+            path (str): Path of the decoded float32 samples, unique to this instance in AUDIO_DIR if None
+        """
+        self.source = source
+        # Workers restoring the same session decode the same media, each to a file of its own
+        self.path = path or os.path.join(AUDIO_DIR, f'{os.path.splitext(os.path.basename(source))[0]}.'
+                                                    f'{os.getpid()}.{uuid.uuid4().hex[:8]}.pcm')
+        self.samples = 0
+        self.finished = False
+        self.error: Exception | None = None
+        self.process: subprocess.Popen | None = None
+        self.condition = threading.Condition()
+
+    def start(self):
+        """Start decoding the whole file with ffmpeg in the background."""
+        command = ['ffmpeg', '-nostdin', '-threads', '0', '-i', self.source,
+                   '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(SAMPLE_RATE), '-']
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        threading.Thread(target=self.write, args=(self.process.stdout,), name='audio-decode', daemon=True).start()
+
+    def write(self, stream):
+        """Convert 16-bit samples from the stream to float32 and append them to the file as they come."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            with open(self.path, 'wb') as out:
+                remainder = b''
+                while chunk := stream.read(READ_BYTES):
+                    chunk = remainder + chunk
+                    # Reads from a pipe may end in the middle of a sample
+                    size = len(chunk) - len(chunk) % 2
+                    chunk, remainder = chunk[:size], chunk[size:]
+                    samples = np.frombuffer(chunk, np.int16).astype(np.float32) / 32768.0
+                    out.write(samples.tobytes())
+                    out.flush()
+                    with self.condition:
+                        self.samples += len(samples)
+                        self.condition.notify_all()
+            if self.process is not None and self.process.wait() != 0 and not self.samples:
+                raise RuntimeError(f'Failed to decode audio of {os.path.basename(self.source)}')
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def read(self, start: int = 0, end: int | None = None) -> np.ndarray:
+        """ Return samples of a range, waiting until they are decoded
+
+            Parameters
+            start (int): First sample
+            end (int): Sample after the last one, or until the end of audio if None
+
+            Returns
+            Read-only memory-mapped samples, shorter than requested if the audio ends earlier
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.finished or (end is not None and self.samples >= end))
+            if self.error is not None:
+                raise self.error
+            available = self.samples
+        end = available if end is None else min(end, available)
+        if end <= start:
+            return np.zeros(0, dtype=np.float32)
+        return np.memmap(self.path, dtype=np.float32, mode='r', shape=(available,))[start:end]
+
+    def close(self):
+        """Stop decoding if still running and delete the decoded samples."""
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            with self.condition:
+                self.condition.wait_for(lambda: self.finished, timeout=5)
+        if os.path.isfile(self.path):
+            os.remove(self.path)
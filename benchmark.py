@@ -0,0 +1,475 @@
+"""
+Offline benchmark and load test of the API server, with stand-in LLM and ASR backends
+
+    - StandInLLM plugs into sessions in place of OpenAI/Bamboo, answering with canned pandas code after a set latency
+    - StandInASR replaces Whisper models, emitting synthetic segments at a set real-time factor
+    - Scenarios drive server.api in process with concurrent virtual users: session creation,
+      CSV and XLSX uploads of growing size, queries (new, cached and simple ones answered without the LLM)
+      and transcriptions (the latter needing ffmpeg)
+    - Reports p50/p95/p99 latency, throughput and peak RSS of each scenario, including worker processes,
+      and compares them with a stored baseline to catch regressions, saved with the number of CPUs it ran on
+
+Usage: python benchmark.py [--requests 20] [--concurrency 4] [--save-baseline], exits with status 1 on regression.
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import wave
+from typing import Awaitable, Callable
+
+import numpy as np
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+
+BASELINE_PATH = os.path.join(root_path, 'benchmark_baseline.json')
+# Relative slowdown of p95 latency or throughput tolerated before reporting a regression
+TOLERANCE = 0.25
+ROW_SIZES = (1000, 10000, 100000)
+# XLSX files take much longer to generate and parse, so they stop at a smaller size
+XLSX_ROW_SIZES = (1000, 10000)
+
+# Answers of the stand-in LLM, chosen by the first keyword found in the prompt
+CANNED_CODE = {
+    'count': 'df = dfs[0]\nresult = {"type": "number", "value": len(df)}\n',
+    'average': 'df = dfs[0]\nresult = {"type": "number", "value": float(df["value"].mean())}\n',
+    'describe': 'df = dfs[0]\nresult = {"type": "dataframe", "value": df.describe()}\n',
+    'group': 'df = dfs[0]\nresult = {"type": "dataframe", "value": df.groupby("category", observed=True).sum(numeric_only=True)}\n',
+    'rows': 'df = dfs[0]\nresult = {"type": "dataframe", "value": df.head(1000)}\n',
+    'plot': 'import matplotlib.pyplot as plt\n'
+            'df = dfs[0]\n'
+            'df.groupby("category", observed=True)["value"].mean().plot(kind="bar")\n'
+            'plt.savefig("temp_chart.png")\n'
+            'plt.close()\n'
+            'result = {"type": "plot", "value": "temp_chart.png"}\n',
+}
+QUERY_KINDS = ['count', 'average', 'describe', 'group', 'rows', 'plot']
+# Simple questions answered from the data profile without the LLM
+SIMPLE_PROMPTS = ['How many rows are there?', 'What is the average value?', 'describe the data',
+                  'value counts of category', 'show the first 10 rows', 'max amount']
+
+
+def configure_environment(directory: str):
+    """Keep all files written by the server in a scratch folder, before the server modules are imported."""
+    for name, folder in [('DATASET_DIR', 'datasets'), ('TRANSCRIPT_DIR', 'transcripts'), ('AUDIO_DIR', 'audio'),
+                         ('PUBLIC_DIR', 'public'), ('MEDIA_DIR', 'media')]:
+        os.environ[name] = os.path.join(directory, folder)
+        os.makedirs(os.environ[name], exist_ok=True)
+    os.environ['SESSION_DB'] = os.path.join(directory, 'sessions.db')
+    # The engine's own response cache lives in the workspace, and answers from past runs would skew timings
+    os.environ['PANDASAI_WORKSPACE'] = directory
+    # The stand-in ASR model has no batched pipeline
+    os.environ['ASR_BATCH_SIZE'] = '1'
+    # Clients of the real LLMs are created at import and need keys, though never called
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ.setdefault('PANDASAI_API_KEY', 'benchmark')
+
+
+def make_standin_llm(latency: float):
+    from pandasai.llm.base import LLM
+
+    class StandInLLM(LLM):
+        """Deterministic LLM answering with canned code after a fixed latency"""
+
+        def __init__(self):
+            self.calls = 0
+
+        def call(self, instruction, context=None) -> str:
+            self.last_prompt = instruction.to_string()
+            self.calls += 1
+            time.sleep(latency)
+            # Match keywords of the user query only, the prompt template mentions some of them
+            query = str(context.memory.get_last_message()).lower() if context is not None else self.last_prompt
+            return next((code for keyword, code in CANNED_CODE.items() if keyword in query), CANNED_CODE['count'])
+
+        @property
+        def type(self) -> str:
+            return 'standin'
+
+    return StandInLLM()
+
+
+class StandInASR:
+    """Whisper model stand-in, returning one segment of words per 5 seconds of audio at a fixed real-time factor"""
+
+    class Dims:
+        n_mels = 80
+
+    dims = Dims()
+    device = 'cpu'
+
+    def __init__(self, real_time_factor: float):
+        self.real_time_factor = real_time_factor
+
+    def detect_language(self, _mel):
+        return None, {'en': 1.0}
+
+    def transcribe(self, audio: np.ndarray, **kwargs):
+        from faster_whisper.transcribe import Segment, Word
+
+        duration = len(audio) / 16000
+        with_words = kwargs.get('word_timestamps', False)
+
+        def generate():
+            for i, start in enumerate(np.arange(0, duration, 5.0)):
+                end = min(duration, start + 5.0)
+                time.sleep((end - start) * self.real_time_factor)
+                words = [Word(start=start + j * (end - start) / 8, end=start + (j + 1) * (end - start) / 8,
+                              word=f' word{j}', probability=0.9) for j in range(8)]
+                yield Segment(id=i, seek=int(start * 100), start=float(start), end=float(end),
+                              text=''.join(word.word for word in words), tokens=list(range(50364, 50380)),
+                              avg_logprob=-0.2, compression_ratio=1.2, no_speech_prob=0.01,
+                              words=words if with_words else None, temperature=0.0)
+
+        return generate(), None
+
+
+def install_standins(llm_latency: float, asr_real_time_factor: float):
+    """Plug stand-ins into sessions and the ASR module, returning the stand-in LLM."""
+    import asr
+    import main
+
+    llm = make_standin_llm(llm_latency)
+    main.Session.openAiLLM = llm
+    main.Session.bambooLLM = llm
+    model = StandInASR(asr_real_time_factor)
+    asr.get_model = lambda *_args, **_kwargs: model
+    # Query summaries are posted to the PandasAI server when its key is set, which must not happen offline
+    os.environ.pop('PANDASAI_API_KEY', None)
+    return llm
+
+
+def make_frame(rows: int, seed: int = 0):
+    import pandas as pd
+
+    generator = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'category': generator.choice(['north', 'south', 'east', 'west'], rows),
+        'value': generator.normal(100, 15, rows).round(2),
+        'amount': generator.integers(0, 1000, rows),
+        'date': pd.date_range('2020-01-01', periods=rows, freq='min').strftime('%Y-%m-%d %H:%M'),
+    })
+
+
+def make_csv_payloads(rows: int, count: int) -> list[bytes]:
+    """CSV files of given rows, each different from the others so the dataset store can't deduplicate them."""
+    body = make_frame(rows).to_csv(index=False).encode()
+    header, rest = body.split(b'\n', 1)
+    return [header + f'\n{-i - 1},north,{i},{i},2019-12-31 00:00\n'.encode() + rest for i in range(count)]
+
+
+def make_xlsx_payloads(rows: int, count: int) -> list[bytes]:
+    from openpyxl import Workbook
+
+    df = make_frame(rows)
+    values = df.values.tolist()
+    payloads = []
+    for i in range(count):
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(list(df.columns))
+        sheet.append([-i - 1, 'north', i, i, '2019-12-31 00:00'])
+        for row in values:
+            sheet.append(row)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        payloads.append(buffer.getvalue())
+    return payloads
+
+
+def make_wav(seconds: float, seed: int = 0) -> bytes:
+    """Synthetic speech-like audio: noise bursts modulated at syllable rate with pauses."""
+    generator = np.random.default_rng(seed)
+    t = np.arange(int(seconds * 16000)) / 16000
+    envelope = (np.sin(2 * np.pi * 4 * t) > 0) * (np.sin(2 * np.pi * 0.2 * t) > -0.5)
+    samples = (generator.normal(0, 0.3, len(t)) * envelope * 32767 * 0.5).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(16000)
+        out.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def process_rss(pid: int | str) -> int:
+    """Resident memory of a process in bytes from /proc, 0 if it is gone."""
+    try:
+        with open(f'/proc/{pid}/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def descendants(pid: int) -> list[str]:
+    """Return IDs of all processes descending from a process, e.g. sandbox workers started by the fork server."""
+    children: dict[str, list[str]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as file:
+                # Parent ID follows the command name, which may contain spaces and parentheses
+                parent = file.read().rsplit(')', 1)[1].split()[1]
+        except (OSError, IndexError):
+            continue
+        children.setdefault(parent, []).append(entry)
+    found = []
+    pending = [str(pid)]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+
+def current_rss() -> int:
+    """Resident memory of this process and its child processes in bytes, from /proc where available."""
+    if os.path.isdir('/proc'):
+        pid = os.getpid()
+        # Pages shared by children, e.g. forked from the same server, are counted in each, erring on the high side
+        return process_rss(pid) + sum(process_rss(child) for child in descendants(pid))
+    # Peak rather than current on other platforms, in KB on Linux and bytes on macOS
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def get_environment() -> dict:
+    """Describe the machine running the benchmark, as results only compare on the same hardware."""
+    return {'cpus': os.cpu_count(), 'platform': sys.platform, 'python': sys.version.split()[0]}
+
+
+class RSSSampler:
+    """Samples resident memory in the background to find its peak during a scenario"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = current_rss()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='rss-sampler', daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def summarize(latencies: list[float], statuses: dict[int, int], elapsed: float, peak_rss: int) -> dict:
+    values = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        'requests': len(latencies),
+        'errors': sum(count for status, count in statuses.items() if status >= 400),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss / 1024 / 1024,
+    }
+
+
+Request = Callable[[object, int, object], Awaitable]  # (client, request index, user context) -> response
+
+
+async def run_scenario(client, request: Request, count: int, concurrency: int, contexts: list) -> dict:
+    """ Issue count requests from concurrency virtual users, each sending its requests one after the other
+
+        Parameters
+        client (AsyncClient): Client bound to the app
+        request (callable): Sends one request
+        count (int): Total number of requests
+        concurrency (int): Number of virtual users
+        contexts (list): Context of each user, e.g. its session token
+    """
+    latencies = []
+    statuses: dict[int, int] = {}
+
+    async def user(index: int):
+        for i in range(index, count, concurrency):
+            start = time.perf_counter()
+            try:
+                response = await request(client, i, contexts[index])
+                status = response.status_code
+                if status >= 400 and status not in statuses:
+                    print('Benchmark request failed', status, response.text[:200])
+            except Exception as e:
+                print('Benchmark request error', repr(e))
+                status = 599
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    with RSSSampler() as sampler:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(index) for index in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, statuses, elapsed, sampler.peak)
+
+
+async def create_sessions(client, count: int) -> list[str]:
+    return [(await client.post('/session')).json()['token'] for _ in range(count)]
+
+
+async def upload(client, token: str, filename: str, payload: bytes):
+    return await client.post('/data/input', params={'token': token}, files=[('files', (filename, payload))])
+
+
+async def run_benchmark(requests: int, concurrency: int, scenarios: list[str] | None = None) -> dict:
+    """Run all scenarios, or those matching given patterns, against the server app, returning the report of each."""
+    import httpx
+    from server import api
+
+    results = {}
+
+    def selected(name: str) -> bool:
+        return scenarios is None or any(fnmatch.fnmatch(name, pattern) for pattern in scenarios)
+
+    transport = httpx.ASGITransport(app=api)
+    async with api.router.lifespan_context(api):
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=600) as client:
+            if selected('session'):
+                results['session'] = await run_scenario(
+                    client, lambda c, i, _: c.post('/session'), requests, concurrency, [None] * concurrency)
+
+            for extension, sizes, make_payloads in [('csv', ROW_SIZES, make_csv_payloads),
+                                                    ('xlsx', XLSX_ROW_SIZES, make_xlsx_payloads)]:
+                for rows in sizes:
+                    name = f'upload_{extension}_{rows}'
+                    if not selected(name):
+                        continue
+                    payloads = make_payloads(rows, requests)
+                    tokens = await create_sessions(client, concurrency)
+                    results[name] = await run_scenario(
+                        client, lambda c, i, token: upload(c, token, f'data{i}.{extension}', payloads[i]),
+                        requests, concurrency, tokens)
+
+            for name, unique in [('query', True), ('query_cached', False), ('query_fastpath', True)]:
+                if not selected(name):
+                    continue
+                tokens = await create_sessions(client, concurrency)
+                data = make_csv_payloads(ROW_SIZES[1], 1)[0]
+                for token in tokens:
+                    await upload(client, token, 'data.csv', data)
+
+                def query(c, i, token, name=name, unique=unique):
+                    kind = QUERY_KINDS[i % len(QUERY_KINDS)]
+                    prompt = f'{kind} of the data, request {i}' if unique else f'{kind} of the data'
+                    if name == 'query_fastpath':
+                        prompt = SIMPLE_PROMPTS[i % len(SIMPLE_PROMPTS)]
+                    return c.post('/query', params={'token': token}, json={'query': prompt})
+
+                if not unique:
+                    # Answer every prompt once, so timed requests all hit the response cache
+                    for i in range(len(QUERY_KINDS)):
+                        await query(client, i, tokens[0])
+                results[name] = await run_scenario(client, query, requests, concurrency, tokens)
+
+            if selected('transcribe'):
+                if shutil.which('ffmpeg') is None:
+                    print('Skipping transcribe scenario, ffmpeg is not installed')
+                else:
+                    tokens = await create_sessions(client, concurrency)
+                    for index, token in enumerate(tokens):
+                        await upload(client, token, 'speech.wav', make_wav(120, index))
+
+                    def transcribe(c, i, token):
+                        # Vary the prompt so transcripts are decoded rather than read from the cache
+                        return c.post('/transcribe', params={'token': token},
+                                      json={'performance': 'fast', 'limit': 'full', 'prompt': f'request {i}'})
+
+                    results['transcribe'] = await run_scenario(client, transcribe, requests, concurrency, tokens)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    """Return regressions of p95 latency, throughput or errors against the baseline, for scenarios in both."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None or name == 'environment':
+            continue
+        if result['p95'] > reference['p95'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {result["p95"] * 1000:.1f} ms, baseline {reference["p95"] * 1000:.1f} ms')
+        if result['throughput'] < reference['throughput'] * (1 - tolerance):
+            regressions.append(f'{name}: throughput {result["throughput"]:.1f}/s, '
+                               f'baseline {reference["throughput"]:.1f}/s')
+        if result['errors'] > reference['errors']:
+            regressions.append(f'{name}: {result["errors"]} errors, baseline {reference["errors"]}')
+    return regressions
+
+
+def format_report(results: dict) -> str:
+    lines = [f'{"scenario":<20}{"requests":>9}{"errors":>7}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+             f'{"req/s":>9}{"peak MB":>9}']
+    for name, result in results.items():
+        lines.append(f'{name:<20}{result["requests"]:>9}{result["errors"]:>7}{result["p50"] * 1000:>10.1f}'
+                     f'{result["p95"] * 1000:>10.1f}{result["p99"] * 1000:>10.1f}{result["throughput"]:>9.1f}'
+                     f'{result["peak_rss_mb"]:>9.0f}')
+    return '\n'.join(lines)
+
+
+def main(args: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Offline benchmark of the API server with stand-in backends')
+    parser.add_argument('--requests', type=int, default=20, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent virtual users')
+    parser.add_argument('--scenarios', nargs='*', help="scenarios to run, e.g. 'session' or 'upload_*', all if not given")
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='seconds the stand-in LLM takes to answer')
+    parser.add_argument('--asr-rtf', type=float, default=0.01, help='real-time factor of the stand-in ASR model')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file to compare with or save to')
+    parser.add_argument('--save-baseline', action='store_true', help='save results as new baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='relative slowdown tolerated')
+    parser.add_argument('--output', help='file to write results to as JSON')
+    options = parser.parse_args(args)
+
+    directory = tempfile.mkdtemp(prefix='datachat-benchmark-')
+    try:
+        configure_environment(directory)
+        random.seed(0)
+        install_standins(options.llm_latency, options.asr_rtf)
+        results = asyncio.run(run_benchmark(options.requests, options.concurrency, options.scenarios))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(format_report(results))
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    environment = get_environment()
+    if options.save_baseline:
+        with open(options.baseline, 'w') as file:
+            json.dump({'environment': environment, **results}, file, indent=2)
+        print('Saved baseline to', options.baseline)
+        return 0
+    if not os.path.isfile(options.baseline):
+        print('No baseline to compare with, save one with --save-baseline')
+        return 0
+    with open(options.baseline) as file:
+        baseline = json.load(file)
+    if baseline.get('environment', {}).get('cpus') != environment['cpus']:
+        print(f'Baseline was saved on {baseline.get("environment", {}).get("cpus", "an unknown number of")} CPUs, '
+              f'this run has {environment["cpus"]}, so results may differ regardless of changes')
+    regressions = compare(results, baseline, options.tolerance)
+    for regression in regressions:
+        print('Regression', regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
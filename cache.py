@@ -0,0 +1,389 @@
+"""
+Bounded in-memory caches shared by the core modules
+
+    - LRUCache: thread-safe key/value store with idle TTL, count and byte budgets and eviction callbacks
+    - ResponseCache: LLM responses keyed by dataset content, model and prompt, with optional similarity matching
+    - DiskCache: persistent files keyed by content hash, evicted least recently used first over a size budget
+
+Usage: Instantiate per use case (sessions, models, responses...) and configure limits from environment.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import pandas as pd
+
+EvictCallback = Callable[[Hashable, Any, str], None]
+
+
+class LRUCache:
+    """Least recently used cache with optional idle expiration and memory budget
+
+    Entries are kept in access order so lookups, insertions and evictions are all O(1).
+    Eviction reasons passed to callbacks are 'expired', 'lru', 'memory' and 'removed'.
+    """
+
+    def __init__(self, max_items: int | None = None, max_bytes: int | None = None,
+                 ttl: float | None = None, on_evict: EvictCallback | None = None):
+        """ Instantiate new cache
+
+            Parameters
+            max_items (int): Maximum number of entries, unbounded if None
+            max_bytes (int): Maximum total size of entries as reported to put/resize, unbounded if None
+            ttl (float): Seconds an entry may stay idle before expiring, never if None
+            on_evict (callable): Called with (key, value, reason) after an entry leaves the cache
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.callbacks: list[EvictCallback] = [on_evict] if on_evict else []
+        self.entries: OrderedDict[Hashable, list] = OrderedDict()  # key -> [value, size, last access]
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions: dict[str, int] = {'expired': 0, 'lru': 0, 'memory': 0, 'removed': 0}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and not self._expired(entry, time.monotonic())
+
+    def add_callback(self, callback: EvictCallback):
+        self.callbacks.append(callback)
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry[2] > self.ttl
+
+    def get(self, key, default=None):
+        """Return the value for key and mark it as recently used, or default when missing or expired."""
+        evicted = []
+        with self.lock:
+            now = time.monotonic()
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                evicted.append(self._pop(key, 'expired'))
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                entry[2] = now
+                self.entries.move_to_end(key)
+            evicted += self._evict_expired(now)
+        self._notify(evicted)
+        return default if entry is None else entry[0]
+
+    def peek(self, key, default=None):
+        """Return the value for key without touching recency or counters."""
+        with self.lock:
+            entry = self.entries.get(key)
+            return default if entry is None else entry[0]
+
+    def put(self, key, value, size: int = 0):
+        """Insert or replace an entry, then evict as needed to honor the budgets."""
+        evicted = []
+        with self.lock:
+            if key in self.entries:
+                old = self.entries.pop(key)
+                self.total_bytes -= old[1]
+                if old[0] is not value:
+                    evicted.append((key, old[0], 'removed'))
+            self.entries[key] = [value, size, time.monotonic()]
+            self.total_bytes += size
+            evicted += self._enforce(key)
+        self._notify(evicted)
+
+    def resize(self, key, size: int):
+        """Update the accounted size of an existing entry, e.g. after its data changed."""
+        evicted = []
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            self.total_bytes += size - entry[1]
+            entry[1] = size
+            evicted += self._enforce(key)
+        self._notify(evicted)
+
+    def pop(self, key, default=None):
+        """Remove an entry explicitly, firing callbacks with reason 'removed'."""
+        with self.lock:
+            if key not in self.entries:
+                return default
+            evicted = self._pop(key, 'removed')
+        self._notify([evicted])
+        return evicted[1]
+
+    def clear(self):
+        with self.lock:
+            evicted = [self._pop(key, 'removed') for key in list(self.entries)]
+        self._notify(evicted)
+
+    def values(self):
+        with self.lock:
+            return [entry[0] for entry in self.entries.values()]
+
+    def items(self):
+        with self.lock:
+            return [(key, entry[0]) for key, entry in self.entries.items()]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': dict(self.evictions),
+            }
+
+    def _pop(self, key, reason):
+        value, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+        self.evictions[reason] += 1
+        return key, value, reason
+
+    def _evict_expired(self, now):
+        evicted = []
+        if self.ttl is None:
+            return evicted
+        # Oldest entries come first, so stop at the first one still alive
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if not self._expired(entry, now):
+                break
+            evicted.append(self._pop(key, 'expired'))
+        return evicted
+
+    def _enforce(self, keep):
+        """Evict least recently used entries over budget, never the entry just touched."""
+        evicted = self._evict_expired(time.monotonic())
+        while self.max_items is not None and len(self.entries) > self.max_items:
+            key = self._oldest(keep)
+            if key is None:
+                break
+            evicted.append(self._pop(key, 'lru'))
+        while self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            key = self._oldest(keep)
+            if key is None:
+                break
+            evicted.append(self._pop(key, 'memory'))
+        return evicted
+
+    def _oldest(self, keep):
+        # The entry just touched may still be the oldest, e.g. when resized in place
+        return next((key for key in self.entries if key != keep), None)
+
+    def _notify(self, evicted):
+        # Callbacks run outside the lock as they may release heavy resources or reenter the cache
+        for key, value, reason in evicted:
+            for callback in self.callbacks:
+                try:
+                    callback(key, value, reason)
+                except Exception as e:
+                    print('Cache eviction callback error', repr(e))
+
+
+def hash_schema(df) -> str:
+    """Fingerprint of a DataFrame structure, i.e. column names and dtypes, regardless of values."""
+    return hashlib.sha1(repr([(str(column), str(dtype)) for column, dtype in df.dtypes.items()]).encode()).hexdigest()
+
+
+def hash_dataframe(df) -> str:
+    """Content hash of a DataFrame, covering column names, dtypes and all values including index."""
+    digest = hashlib.sha1()
+    digest.update(repr([(str(column), str(dtype)) for column, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+STOPWORDS = {'a', 'an', 'the', 'please', 'me', 'us', 'show', 'tell', 'give', 'what', 'whats', 'is', 'are', 'of',
+             'can', 'you', 'i', 'want', 'to', 'know', 'list'}
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase prompt and collapse punctuation and whitespace, keeping word order."""
+    prompt = unicodedata.normalize('NFKC', prompt).lower().replace("'", '')
+    return ' '.join(re.findall(r'\w+(?:\.\d+)?', prompt))
+
+
+def prompt_tokens(prompt: str) -> frozenset:
+    """Bag of meaningful words of a normalized prompt, used for similarity matching."""
+    return frozenset(word for word in prompt.split() if word not in STOPWORDS)
+
+
+class ResponseCache:
+    """Cache of LLM responses keyed by dataset content hash, model name and normalized prompt
+
+    Besides exact matches, an optional similarity tier matches prompts on the same dataset and model
+    whose word sets overlap above a Jaccard threshold, e.g. 'how many rows' and 'rows: how many?'.
+    """
+
+    def __init__(self, max_items: int | None = None, max_bytes: int | None = None, ttl: float | None = None,
+                 similarity: float | None = None):
+        """ Instantiate new cache
+
+            Parameters
+            similarity (float): Minimum Jaccard similarity of prompt word sets to match, exact only if None
+            Other parameters as for LRUCache
+        """
+        self.similarity = similarity
+        self.similar_hits = 0
+        self.index: dict[tuple, dict[tuple, frozenset]] = {}  # (dataset, model) -> {key: prompt tokens}
+        self.entries = LRUCache(max_items=max_items, max_bytes=max_bytes, ttl=ttl, on_evict=self._unindex)
+
+    def _unindex(self, key, _value, _reason):
+        with self.entries.lock:
+            keys = self.index.get(key[:2])
+            if keys is not None:
+                keys.pop(key, None)
+                if not keys:
+                    del self.index[key[:2]]
+
+    def _find_similar(self, key):
+        tokens = prompt_tokens(key[2])
+        if not tokens:
+            return None
+        best, best_score = None, self.similarity
+        with self.entries.lock:
+            candidates = list(self.index.get(key[:2], {}).items())
+        for candidate, candidate_tokens in candidates:
+            score = len(tokens & candidate_tokens) / len(tokens | candidate_tokens)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def get(self, dataset: str, model: str, prompt: str):
+        """Return cached response for the prompt on given dataset and model, or None."""
+        key = (dataset, model, normalize_prompt(prompt))
+        response = self.entries.get(key)
+        if response is None and self.similarity:
+            similar = self._find_similar(key)
+            if similar is not None:
+                response = self.entries.get(similar)
+                if response is not None:
+                    self.similar_hits += 1
+        return response
+
+    def put(self, dataset: str, model: str, prompt: str, response, size: int = 0):
+        key = (dataset, model, normalize_prompt(prompt))
+        self.entries.put(key, response, size)
+        with self.entries.lock:
+            if key in self.entries.entries:
+                self.index.setdefault(key[:2], {})[key] = prompt_tokens(key[2])
+
+    def invalidate(self, dataset: str, model: str, prompt: str):
+        self.entries.pop((dataset, model, normalize_prompt(prompt)))
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        stats = self.entries.stats()
+        stats['similar_hits'] = self.similar_hits
+        return stats
+
+
+class DiskCache:
+    """Cache of serialized values stored as files in a directory, shared by processes and kept across restarts
+
+    Recency is tracked by file modification time, which hits refresh, so the oldest files are evicted first
+    when the directory grows over its size budget.
+    """
+
+    def __init__(self, directory: str, max_bytes: int | None = None, suffix: str = ''):
+        """ Instantiate new cache
+
+            Parameters
+            directory (str): Folder of cached files, created when first needed
+            max_bytes (int): Maximum total size of cached files, unbounded if None
+            suffix (str): File extension of cached files, e.g. '.json'
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key: str) -> bytes | None:
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store data atomically, then evict the oldest files over budget."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.get_path(key)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+        self._enforce(path)
+
+    def files(self) -> list[tuple[float, int, str]]:
+        """Return (modification time, size, path) of cached files, oldest first."""
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return files
+        for name in names:
+            if not name.endswith(self.suffix) or name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return sorted(files)
+
+    def _enforce(self, keep: str):
+        if self.max_bytes is None:
+            return
+        with self.lock:
+            files = self.files()
+            total = sum(size for _, size, _ in files)
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        files = self.files()
+        return {
+            'size': len(files),
+            'bytes': sum(size for _, size, _ in files),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,160 @@
+"""
+Content addressed on-disk store of datasets in Arrow IPC columnar format
+
+    - Each distinct dataset is converted once and saved under its content hash, so identical uploads share one file
+    - Sessions hold lightweight references and load data memory mapped, projected to columns or head rows on demand
+    - Data that Arrow can't represent (e.g. mixed type columns) is kept in memory behind the same interface
+    - Files are touched on use, so the artifact reaper deletes least recently used ones over the disk budget
+
+Usage: Call store_dataframe(), find_dataset() or memory_dataset() to get a DatasetRef, then ref.load() for the DataFrame.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+from cache import hash_dataframe
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+
+DATASET_DIR = os.environ.get('DATASET_DIR', os.path.join(root_path, 'data', 'datasets'))
+
+# Key of custom metadata saved in the Arrow schema
+METADATA_KEY = b'datachat'
+
+
+class DatasetRef:
+    """Reference to a stored dataset, cheap to hold and to pass between processes"""
+
+    def __init__(self, key: str, name: str, rows: int, memory: int, path: str | None = None,
+                 df: pd.DataFrame | None = None):
+        """ Instantiate new reference
+
+            Parameters
+            key (str): Content hash identifying the dataset
+            name (str): Name of the source, e.g. uploaded file name
+            rows (int): Number of rows
+            memory (int): Memory footprint in bytes of the DataFrame when fully loaded
+            path (str): Path to the Arrow file, if stored on disk
+            df (DataFrame): The data itself, if kept in memory
+        """
+        self.key = key
+        self.name = name
+        self.rows = rows
+        self.memory = memory
+        self.path = path
+        self.df = df
+
+    def load(self, head: int | None = None, columns: list[str] | None = None) -> pd.DataFrame:
+        """ Load dataset as DataFrame
+
+            Parameters
+            head (int): Only load this number of first rows
+            columns (list): Only load these columns
+        """
+        if self.df is not None:
+            df = self.df if columns is None else self.df[columns]
+            return df.head(head) if head else df
+        touch(self.path)
+        with pa.memory_map(self.path) as source:
+            table = pa.ipc.open_file(source).read_all()
+            if columns is not None:
+                table = table.select(columns)
+            if head:
+                table = table.slice(0, head)
+            return table.to_pandas()
+
+    def __repr__(self):
+        return f'DatasetRef({self.key[:12]}, {self.name!r}, rows={self.rows})'
+
+
+def hash_bytes(source) -> str:
+    """Content hash of a file object or a file path read in blocks, rewinding file objects afterwards, or of bytes."""
+    if isinstance(source, bytes):
+        return hashlib.sha1(source).hexdigest()
+    if isinstance(source, str):
+        with open(source, 'rb') as file:
+            return hash_bytes(file)
+    digest = hashlib.sha1()
+    while block := source.read(1024 * 1024):
+        digest.update(block)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+def get_path(key: str) -> str:
+    return os.path.join(DATASET_DIR, f'{key}.arrow')
+
+
+def touch(path: str):
+    """Refresh recency of a stored file for the reaper, ignoring files deleted meanwhile."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def find_dataset(key: str, name: str | None = None) -> DatasetRef | None:
+    """ Return reference to a dataset already stored under the key, or None
+
+        Parameters
+        key (str): Content hash of the dataset
+        name (str): Name of the source in the caller's context, rather than the stored one of the first upload
+    """
+    if pa is None:
+        return None
+    path = get_path(key)
+    if not os.path.isfile(path):
+        return None
+    with pa.memory_map(path) as source:
+        metadata = json.loads(pa.ipc.open_file(source).schema.metadata[METADATA_KEY])
+    touch(path)
+    return DatasetRef(key, metadata['name'] if name is None else name, metadata['rows'], metadata['memory'], path=path)
+
+
+def memory_dataset(df: pd.DataFrame, name: str = '') -> DatasetRef:
+    """Wrap a DataFrame held by the caller as dataset reference, without storing it."""
+    return DatasetRef(hash_dataframe(df), name, len(df.index), int(df.memory_usage(deep=True).sum()), df=df)
+
+
+def store_dataframe(df: pd.DataFrame, name: str = '', key: str | None = None) -> DatasetRef:
+    """ Save DataFrame to the store unless already there
+
+        Parameters
+        df (DataFrame): Data to store
+        name (str): Name of the source
+        key (str): Content hash of the source, e.g. of the uploaded file, hashing the DataFrame if None
+    """
+    key = key or hash_dataframe(df)
+    rows = len(df.index)
+    memory = int(df.memory_usage(deep=True).sum())
+    if pa is None:
+        return DatasetRef(key, name, rows, memory, df=df)
+    ref = find_dataset(key, name)
+    if ref is not None:
+        return ref
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        print('Keeping dataset in memory as Arrow cannot convert it:', repr(e))
+        return DatasetRef(key, name, rows, memory, df=df)
+    metadata = dict(table.schema.metadata or {})
+    metadata[METADATA_KEY] = json.dumps({'name': name, 'rows': rows, 'memory': memory}).encode()
+    table = table.replace_schema_metadata(metadata)
+    path = get_path(key)
+    os.makedirs(DATASET_DIR, exist_ok=True)
+    # Write to a temporary file then rename, so concurrent readers and writers never see partial files
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+    return DatasetRef(key, name, rows, memory, path=path)
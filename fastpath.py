@@ -0,0 +1,271 @@
+"""
+Local answers to simple questions on the selected data, without calling the LLM
+
+    - A statistics profile of the data is computed once when it is selected: shape, column names and types,
+      summary statistics of numeric and date columns, distinct counts and value counts of low cardinality columns
+    - Prompts are matched whole against a small set of intents: row and column counts, column list,
+      describe, mean/median/min/max/sum/std of a column, distinct and value counts of a column, head and tail
+    - Anything else, including known intents on unknown columns or with extra conditions, is left to the LLM
+
+Usage: Build a DataProfile of the data, then answer() prompts with it, falling back to the LLM on None.
+"""
+
+import os
+import re
+
+import pandas as pd
+
+from cache import normalize_prompt
+
+FASTPATH = os.environ.get('FASTPATH', 'true').lower() in ['1', 'true', 'yes']
+# Columns with more distinct values than this get no value counts, as the answer would be a table of the data
+FASTPATH_MAX_VALUES = int(os.environ.get('FASTPATH_MAX_VALUES', 1000))
+# Rows of head and tail answers when the prompt doesn't tell
+FASTPATH_HEAD_ROWS = 5
+
+# Statistics by the words prompts use for them, named as in DataFrame.describe() plus 'sum'
+STATISTICS = {
+    'mean': 'mean', 'average': 'mean', 'avg': 'mean',
+    'median': '50%',
+    'min': 'min', 'minimum': 'min', 'lowest': 'min', 'smallest': 'min',
+    'max': 'max', 'maximum': 'max', 'highest': 'max', 'largest': 'max',
+    'sum': 'sum', 'total': 'sum',
+    'std': 'std', 'standard deviation': 'std',
+}
+
+
+class DataProfile:
+    """Statistics of a DataFrame computed up front, enough to answer simple questions without the data"""
+
+    def __init__(self, df: pd.DataFrame):
+        self.rows = len(df.index)
+        self.columns = [str(column) for column in df.columns]
+        self.dtypes = {str(column): str(dtype) for column, dtype in df.dtypes.items()}
+        self.names: dict[str, str] = {}  # normalized name -> column, for unambiguous names only
+        self.stats: dict[str, dict] = {}  # column -> describe() statistics, plus 'sum' for numbers
+        # Distinct counts, and value counts of columns with few values, see get_distinct() and get_value_counts()
+        self.distinct: dict[str, int] = {}
+        self.value_counts: dict[str, pd.DataFrame] = {}
+        self.uncounted: set[str] = set()
+        # Kept for head and tail answers, sharing the data held by the session
+        self.df = df
+        unique = not df.columns.duplicated().any()
+        ambiguous = set()
+        for column in self.columns:
+            name = normalize_prompt(column)
+            if name in self.names:
+                ambiguous.add(name)
+            self.names[name] = column
+        for name in ambiguous:
+            del self.names[name]
+        self.summary = None
+        if not unique or not len(self.columns):
+            return
+        numbers = df.select_dtypes(include='number', exclude='bool')
+        dates = df.select_dtypes(include='datetime')
+        self.summary = self.describe(df, numbers, dates)
+        # Reduced by columns of the same type, which keeps integers as integers
+        by_dtype: dict[str, list] = {}
+        for column, dtype in numbers.dtypes.items():
+            by_dtype.setdefault(str(dtype), []).append(column)
+        for columns in by_dtype.values():
+            values = numbers[columns]
+            for column, low, high, total in zip(columns, values.min(), values.max(), values.sum()):
+                self.stats[str(column)] = {**self.summary[column].to_dict(), 'min': low, 'max': high, 'sum': total}
+        for column in dates.columns:
+            values = dates[column]
+            self.stats[str(column)] = {'count': values.count(), 'min': values.min(), 'max': values.max()}
+        # Floats are rarely categories, their values are counted on demand
+        self.uncounted = {str(column) for column, dtype in df.dtypes.items() if pd.api.types.is_float_dtype(dtype)}
+        for column in df.columns:
+            if str(column) not in self.uncounted:
+                self.count_values(df[column])
+
+    @staticmethod
+    def describe(df: pd.DataFrame, numbers: pd.DataFrame, dates: pd.DataFrame) -> pd.DataFrame:
+        """Return df.describe(), computing statistics of all numeric columns at once as wide data is common."""
+        if not len(numbers.columns):
+            return df.describe()
+        quantiles = numbers.quantile([0.25, 0.5, 0.75])
+        summary = pd.DataFrame({
+            'count': numbers.count(), 'mean': numbers.mean(), 'std': numbers.std(), 'min': numbers.min(),
+            '25%': quantiles.iloc[0], '50%': quantiles.iloc[1], '75%': quantiles.iloc[2], 'max': numbers.max(),
+        }).T.astype('float64')
+        if not len(dates.columns):
+            return summary
+        summary = pd.concat([summary.astype(object), dates.describe()], axis=1)
+        columns = [column for column in df.columns if column in summary.columns]
+        summary = summary.loc[['count', 'mean', 'min', '25%', '50%', '75%', 'max', 'std'], columns]
+        return summary.astype({column: 'float64' for column in numbers.columns})
+
+    def count_values(self, values: pd.Series):
+        try:
+            counts = values.value_counts()
+        except TypeError:
+            # Unhashable values such as lists
+            return
+        # Categoricals of head selections keep all categories of the whole data, which are counted as zero
+        counts = counts[counts > 0]
+        column = str(values.name)
+        self.distinct[column] = len(counts.index)
+        if len(counts.index) <= FASTPATH_MAX_VALUES:
+            self.value_counts[column] = counts.rename('count').rename_axis(values.name).reset_index()
+
+    def get_distinct(self, column: str) -> int | None:
+        if column in self.uncounted:
+            self.uncounted.discard(column)
+            self.count_values(self.df[self.df.columns[self.columns.index(column)]])
+        return self.distinct.get(column)
+
+    def get_value_counts(self, column: str) -> pd.DataFrame | None:
+        self.get_distinct(column)
+        return self.value_counts.get(column)
+
+    def column(self, text: str) -> str | None:
+        """Return the column named by text of a normalized prompt, or None if there is none or more."""
+        text = re.sub(r'^(?:the|a) ', '', text)
+        text = re.sub(r' (?:column|field|variable|values?)$', '', text)
+        column = self.names.get(text)
+        if column is None and text.endswith('s'):
+            # Plurals as in 'how many unique cities'
+            column = self.names.get(re.sub(r'ies$', 'y', text)) if text.endswith('ies') else None
+            column = column or self.names.get(text[:-1])
+        return column
+
+    def describe_column(self, column: str) -> pd.DataFrame | None:
+        if self.summary is not None and column in self.summary.columns:
+            return self.summary[[column]]
+        counts = self.get_value_counts(column)
+        if counts is None or not len(counts.index):
+            return None
+        # Same rows as describe() of a column of strings
+        return pd.DataFrame({column: [int(counts['count'].sum()), self.distinct[column], counts.iloc[0, 0],
+                                      int(counts.iloc[0, 1])]}, index=['count', 'unique', 'top', 'freq'])
+
+
+def scalar(value):
+    """Return numpy scalars as Python values, the way answers from the engine are typed."""
+    return value.item() if hasattr(value, 'item') and not isinstance(value, pd.Timestamp) else value
+
+
+# Optional request and article around the subject of a prompt, and reference to the data after it
+LEAD = r'(?:please )?(?:(?:can|could) you )?' \
+       r'(?:(?:show|tell|give|get|list|display|print|return|find|calculate|compute)(?: me)? )?' \
+       r'(?:(?:what|which) (?:is|are|s) )?(?:whats )?(?:the )?'
+DATA = r'(?:the |this )?(?:data|dataset|dataframe|df|table|file|sheet)'
+TAIL = rf'(?: (?:in|of|for|from) {DATA})?(?: please)?'
+ROWS = r'(?:rows|records|entries|lines)'
+STATISTIC = '|'.join(sorted(STATISTICS, key=len, reverse=True))
+
+
+def row_count(profile: DataProfile, match: re.Match):
+    return profile.rows
+
+
+def column_count(profile: DataProfile, match: re.Match):
+    return len(profile.columns)
+
+
+def column_list(profile: DataProfile, match: re.Match):
+    return ', '.join(profile.columns)
+
+
+def describe(profile: DataProfile, match: re.Match):
+    column = match.groupdict().get('column')
+    if column is None:
+        return profile.summary
+    column = profile.column(column)
+    return profile.describe_column(column) if column is not None else None
+
+
+def statistic(profile: DataProfile, match: re.Match):
+    column = profile.column(match.group('column'))
+    stats = profile.stats.get(column) if column is not None else None
+    if stats is None:
+        return None
+    value = stats.get(STATISTICS[match.group('stat')])
+    return None if value is None or pd.isna(value) else scalar(value)
+
+
+def distinct_count(profile: DataProfile, match: re.Match):
+    column = profile.column(match.group('column'))
+    return profile.get_distinct(column) if column is not None else None
+
+
+def value_counts(profile: DataProfile, match: re.Match):
+    column = profile.column(match.group('column'))
+    return profile.get_value_counts(column) if column is not None else None
+
+
+def head_tail(profile: DataProfile, match: re.Match):
+    rows = int(match.group('rows') or FASTPATH_HEAD_ROWS)
+    return profile.df.tail(rows) if match.group('end') in ['last', 'bottom', 'tail'] else profile.df.head(rows)
+
+
+# Intents in order of matching, each pattern matching whole normalized prompts
+INTENTS = [
+    ('row_count', row_count, [
+        rf'{LEAD}(?:total )?(?:number|count|total) of {ROWS}{TAIL}',
+        rf'{LEAD}(?:row|record) count{TAIL}',
+        rf'how many {ROWS}(?: (?:are|is))?(?: there)?(?: (?:in|on) {DATA}| (?:does|do) {DATA} (?:have|contain))?',
+        rf'{LEAD}(?:length|size) of {DATA}',
+        r'count (?:the )?rows',
+    ]),
+    ('column_count', column_count, [
+        rf'{LEAD}(?:total )?(?:number|count) of (?:columns|fields){TAIL}',
+        rf'{LEAD}column count{TAIL}',
+        rf'how many (?:columns|fields)(?: (?:are|is))?(?: there)?(?: in {DATA}| (?:does|do) {DATA} have)?',
+    ]),
+    ('columns', column_list, [
+        rf'{LEAD}(?:all )?(?:the )?(?:columns|fields|column names|names of (?:the )?columns|list of columns){TAIL}',
+        rf'(?:which|what) columns (?:are there|does {DATA} have|are in {DATA})',
+    ]),
+    ('describe', describe, [
+        rf'{LEAD}describe {DATA}',
+        rf'{LEAD}(?:summary|descriptive|basic) (?:statistics|stats){TAIL}',
+        rf'{LEAD}describe (?P<column>.+?){TAIL}',
+        rf'{LEAD}(?:summary|descriptive|basic) (?:statistics|stats) (?:of|for) (?P<column>.+?){TAIL}',
+    ]),
+    ('statistic', statistic, [
+        rf'{LEAD}(?P<stat>{STATISTIC}) (?:value )?(?:of|for|in) (?P<column>.+?){TAIL}',
+        rf'{LEAD}(?P<stat>{STATISTIC}) (?P<column>.+?){TAIL}',
+    ]),
+    ('distinct_count', distinct_count, [
+        rf'how many (?:unique|distinct|different) (?P<column>.+?)(?: are there)?{TAIL}',
+        rf'{LEAD}(?:number|count) of (?:unique|distinct|different) (?P<column>.+?){TAIL}',
+    ]),
+    ('value_counts', value_counts, [
+        rf'{LEAD}value counts (?:of|for|in) (?P<column>.+?){TAIL}',
+        rf'{LEAD}(?P<column>.+?) value counts{TAIL}',
+        rf'{LEAD}(?:(?:count|number) of each|counts of|frequency of|frequencies of)'
+        rf'(?: (?:unique |distinct )?values? (?:of|in))? (?P<column>.+?){TAIL}',
+        rf'{LEAD}(?:number|count) of {ROWS} (?:per|by|for each) (?P<column>.+?){TAIL}',
+        rf'how many {ROWS} (?:per|by|for each) (?P<column>.+?){TAIL}',
+    ]),
+    ('head_tail', head_tail, [
+        rf'{LEAD}(?P<end>first|top|last|bottom) (?:(?P<rows>\d+) )?{ROWS}{TAIL}',
+        r'(?:df )?(?P<end>head|tail)(?: (?P<rows>\d+))?',
+    ]),
+]
+PATTERNS = [(name, handler, [re.compile(pattern) for pattern in patterns]) for name, handler, patterns in INTENTS]
+
+
+def answer(profile: DataProfile, prompt: str) -> tuple[str, object] | None:
+    """ Answer a simple question from the data profile
+
+        Parameters
+        profile (DataProfile): Profile of the data the question is about
+        prompt (str): Question, as sanitized for the LLM
+
+        Returns
+        (intent, answer) with a number, string or DataFrame answer, or None to ask the LLM
+    """
+    text = normalize_prompt(prompt)
+    for name, handler, patterns in PATTERNS:
+        for pattern in patterns:
+            match = pattern.fullmatch(text)
+            if match is not None:
+                response = handler(profile, match)
+                if response is not None:
+                    return name, response
+    return None
@@ -106,20 +106,23 @@ const DataSource: FC<Props> = ({selection, setSelection, isMedia, setIsMedia, se
                 setDirty(true)
                 setShowMedia(true)
             }
-            if (!isMedia && data.rows.length !== files.length)
+            if (!isMedia && data.rows.length !== data.names.length)
                 return Promise.reject(new Error('Upload files out of sync'))
-            const upFiles = files.map(((file, index) => {
-                return isMedia ? {
-                    value: index.toString(),
-                    label: file.name,
-                    url: data.url,
-                    result: data.result
-                } : {
-                    value: index.toString(),
-                    label: file.name,
-                    rows: data.rows[index]
-                }
-            }))
+            // Workbooks give a dataset per sheet, and files failing to parse give none
+            const upFiles = isMedia ? files.map(((file, index) => ({
+                value: index.toString(),
+                label: file.name,
+                url: data.url,
+                result: data.result
+            }))) : data.names.map(((name: string, index: number) => ({
+                value: index.toString(),
+                label: name,
+                rows: data.rows[index]
+            })))
+            const failed = isMedia ? [] : data.files.filter((file: { error?: string }) => file.error)
+            if (failed.length)
+                setError(new Error(failed.map((file: { name: string, error: string }) =>
+                    `${file.name}: ${file.error}`).join('\n')))
             selectFile(0, upFiles)
             setUploadedFiles(upFiles)
 
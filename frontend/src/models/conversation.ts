@@ -7,8 +7,25 @@ export interface Message {
     message: string
 }
 
+export interface ResultInfo {
+    id: string
+    columns: {name: string, dtype: string}[]
+    rows: number
+    page_rows: number
+}
+
+export interface PromptInfo {
+    columns: number
+    total_columns: number
+    tokens: number
+    full_tokens: number
+}
+
 export interface ChatResponse {
     answer: string
     type: string
     html?: boolean
+    result?: ResultInfo
+    source?: 'fastpath' | 'response_cache' | 'code_cache' | 'llm' | 'security'
+    prompt?: PromptInfo
 }
\ No newline at end of file
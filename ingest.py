@@ -0,0 +1,255 @@
+"""
+Ingestion of uploaded datasheets into compact DataFrames
+
+    - Parse CSV in chunks so large uploads never exist twice in memory at default dtypes
+    - Infer column types from a sample, downcast numerics and turn low cardinality strings into categoricals
+    - Enforce row and memory limits, and read only the head rows when that is all the client needs
+    - Read every sheet of workbooks as a dataset of its own, with the calamine reader when installed
+    - Report the outcome of each uploaded file, so uploads can be parsed in parallel and fail one by one
+
+Usage: Call read_dataset() on an uploaded file object, its bytes or its path, ingest_file() to also store it,
+or ingest_report() from worker processes, passing the path of the spooled upload.
+"""
+
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from dataset_store import DatasetRef, find_dataset, hash_bytes, store_dataframe
+
+# Limits of data read into a session at once, configurable from environment
+INGEST_MAX_ROWS = int(os.environ.get('INGEST_MAX_ROWS', 10_000_000))
+INGEST_MAX_BYTES = int(os.environ.get('INGEST_MAX_MB', 1024)) * 1024 * 1024
+INGEST_CHUNK_ROWS = int(os.environ.get('INGEST_CHUNK_ROWS', 100_000))
+INGEST_SAMPLE_ROWS = 10_000
+
+# String columns become categorical when distinct values are at most this share of the sample
+CATEGORY_MAX_RATIO = 0.5
+
+# Workbook reader: Rust based calamine is several times faster than the default openpyxl, from pandas 2.2
+try:
+    import python_calamine  # noqa: F401
+    XLSX_ENGINE = 'calamine' if tuple(map(int, pd.__version__.split('.')[:2])) >= (2, 2) else None
+except ImportError:
+    XLSX_ENGINE = None
+XLSX_ENGINE = os.environ.get('XLSX_ENGINE') or XLSX_ENGINE
+
+
+class IngestLimitExceeded(ValueError):
+    """Raised when an upload exceeds the row or memory limit."""
+
+
+def memory_usage(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True).sum())
+
+
+def category_columns(sample: pd.DataFrame) -> list[str]:
+    """Return string columns of the sample with few distinct values relative to their count."""
+    columns = []
+    for column in sample.columns:
+        series = sample[column]
+        if series.dtype != object:
+            continue
+        count = series.count()
+        if count and series.nunique() <= count * CATEGORY_MAX_RATIO:
+            columns.append(column)
+    return columns
+
+
+def downcast(df: pd.DataFrame, categories: list[str] | None = None) -> pd.DataFrame:
+    """ Shrink column dtypes in place without losing information
+
+        Parameters
+        df (DataFrame): Data to optimize
+        categories (list): String columns to convert to categorical, inferred from data if None
+    """
+    if categories is None:
+        categories = category_columns(df)
+    for column in df.columns:
+        series = df[column]
+        kind = series.dtype.kind
+        if kind in 'iu':
+            df[column] = pd.to_numeric(series, downcast='integer' if kind == 'i' else 'unsigned')
+        elif kind == 'f':
+            single = series.astype(np.float32)
+            # Keep double precision unless every value survives the round trip
+            if np.array_equal(single.to_numpy(np.float64), series.to_numpy(), equal_nan=True):
+                df[column] = single
+        elif column in categories and series.dtype == object:
+            df[column] = series.astype('category')
+    return df
+
+
+def concat_chunks(chunks: list[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate parsed chunks, merging categoricals so they don't fall back to strings."""
+    if len(chunks) == 1:
+        return chunks[0]
+    columns = {}
+    for column in chunks[0].columns:
+        parts = [chunk[column] for chunk in chunks]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[column] = pd.Series(union_categoricals(parts, ignore_order=True), name=column)
+        else:
+            columns[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def check_limits(rows: int, nbytes: int, max_rows: int | None, max_bytes: int | None):
+    if max_rows is not None and rows > max_rows:
+        raise IngestLimitExceeded(f'Data exceeds limit of {max_rows} rows')
+    if max_bytes is not None and nbytes > max_bytes:
+        raise IngestLimitExceeded(f'Data exceeds memory limit of {max_bytes // (1024 * 1024)} MB')
+
+
+def read_csv(source, head: int | None = None, max_rows: int | None = INGEST_MAX_ROWS,
+             max_bytes: int | None = INGEST_MAX_BYTES) -> pd.DataFrame:
+    """Parse CSV chunk by chunk, optimizing each chunk before reading the next."""
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    nrows = head if head else None if max_rows is None else max_rows + 1
+    chunks = []
+    rows = nbytes = 0
+    categories = None
+    float_columns = {}
+    with pd.read_csv(source, chunksize=INGEST_CHUNK_ROWS, nrows=nrows) as reader:
+        for chunk in reader:
+            if categories is None:
+                # First chunk serves as sample: later chunks keep its float columns as floats
+                # so values of a column don't get different dtypes across chunks
+                sample = chunk.head(INGEST_SAMPLE_ROWS)
+                categories = category_columns(sample)
+                float_columns = {column for column in chunk.columns if chunk[column].dtype.kind == 'f'}
+            else:
+                for column in float_columns:
+                    if chunk[column].dtype.kind in 'iub':
+                        chunk[column] = chunk[column].astype(np.float64)
+            chunk = downcast(chunk, categories)
+            rows += len(chunk.index)
+            nbytes += memory_usage(chunk)
+            check_limits(rows, nbytes, None if head else max_rows, max_bytes)
+            chunks.append(chunk)
+    if not chunks:
+        return pd.read_csv(io.StringIO(''))
+    return concat_chunks(chunks)
+
+
+def read_sheets(source, head: int | None = None, max_rows: int | None = INGEST_MAX_ROWS,
+                max_bytes: int | None = INGEST_MAX_BYTES, sheets: list | None = None) -> dict[str, pd.DataFrame]:
+    """ Parse sheets of a workbook, which has no chunked reader, then optimize them
+
+        Limits apply to all sheets together, and blank sheets are left out
+
+        Parameters as for read_dataset(), plus sheets (list) of names or indexes of sheets to read, all if None
+
+        Returns
+        DataFrames by sheet name, in workbook order
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    nrows = head if head else None if max_rows is None else max_rows + 1
+    rows = nbytes = 0
+    dfs = {}
+    for name, df in pd.read_excel(source, sheet_name=sheets, nrows=nrows, engine=XLSX_ENGINE).items():
+        if not len(df.columns):
+            continue
+        rows += len(df.index)
+        check_limits(rows, 0, None if head else max_rows, None)
+        df = downcast(df, category_columns(df.head(INGEST_SAMPLE_ROWS)))
+        nbytes += memory_usage(df)
+        check_limits(rows, nbytes, None, max_bytes)
+        dfs[name] = df
+    return dfs
+
+
+def read_excel(source, head: int | None = None, max_rows: int | None = INGEST_MAX_ROWS,
+               max_bytes: int | None = INGEST_MAX_BYTES) -> pd.DataFrame:
+    """Parse first sheet of a workbook, then optimize it."""
+    return next(iter(read_sheets(source, head, max_rows, max_bytes, sheets=[0]).values()), pd.DataFrame())
+
+
+def read_dataset(source, extension: str, head: int | None = None, max_rows: int | None = INGEST_MAX_ROWS,
+                 max_bytes: int | None = INGEST_MAX_BYTES) -> pd.DataFrame:
+    """ Read an uploaded datasheet into a memory efficient DataFrame
+
+        Parameters
+        source (file | bytes | str): File object, content or path of the upload
+        extension (str): 'csv' or 'xlsx'
+        head (int): Only read this number of first rows, ignoring row limit
+        max_rows (int): Maximum number of rows, unbounded if None
+        max_bytes (int): Maximum memory of resulting DataFrame, unbounded if None
+
+        Raises
+        IngestLimitExceeded: Data is over the row or memory limit
+    """
+    read = read_csv if extension == 'csv' else read_excel
+    return read(source, head=head, max_rows=max_rows, max_bytes=max_bytes)
+
+
+def sheet_names(name: str, sheets: list[str]) -> list[str]:
+    """Return names of the datasets of a workbook: its file name, followed by sheet names if several."""
+    return [name] if len(sheets) == 1 else [f'{name} - {sheet}' for sheet in sheets]
+
+
+def find_sheets(key: str, name: str) -> list[DatasetRef]:
+    """Return references to the sheets of a workbook stored under the key, named for this upload, or empty."""
+    refs = []
+    while ref := find_dataset(f'{key}-sheet{len(refs)}'):
+        refs.append(ref)
+    # Sheets are stored under their sheet name, as the file name is that of whoever uploaded them first
+    for ref, label in zip(refs, sheet_names(name, [ref.name for ref in refs])):
+        ref.name = label
+    return refs
+
+
+def ingest_file(source, extension: str, name: str, head: int | None = None,
+                max_rows: int | None = INGEST_MAX_ROWS, max_bytes: int | None = INGEST_MAX_BYTES) -> list[DatasetRef]:
+    """ Read an uploaded datasheet into the dataset store, skipping parsing if the same file was stored before
+
+        Parameters as for read_dataset(), plus name (str) of the uploaded file
+
+        Returns
+        References to the stored datasets: one for CSV, one per non blank sheet for workbooks
+    """
+    key = hash_bytes(source) + (f'-head{head}' if head else '')
+    refs = find_sheets(key, name) if extension == 'xlsx' \
+        else [ref for ref in [find_dataset(key, name)] if ref is not None]
+    if refs:
+        check_limits(sum(ref.rows for ref in refs), sum(ref.memory for ref in refs),
+                     None if head else max_rows, max_bytes)
+        return refs
+    if extension != 'xlsx':
+        return [store_dataframe(read_dataset(source, extension, head, max_rows, max_bytes), name, key)]
+    sheets = list(read_sheets(source, head, max_rows, max_bytes).items())
+    if not sheets:
+        raise ValueError('Workbook has no data')
+    names = sheet_names(name, [str(sheet) for sheet, _ in sheets])
+    refs = [None] * len(sheets)
+    # Store the last sheet first, so finding the first one means all sheets are stored
+    for index in reversed(range(len(sheets))):
+        refs[index] = store_dataframe(sheets[index][1], str(sheets[index][0]), f'{key}-sheet{index}')
+        refs[index].name = names[index]
+    return refs
+
+
+def ingest_report(source, extension: str, name: str, head: int | None = None,
+                  max_rows: int | None = INGEST_MAX_ROWS, max_bytes: int | None = INGEST_MAX_BYTES) -> dict:
+    """ Ingest an uploaded datasheet as ingest_file() does, reporting failures instead of raising them
+
+        Returns
+        Dictionary of file name, references to its datasets (empty on failure), parsing time in seconds,
+        and error message with its HTTP status code if it failed
+    """
+    start = time.perf_counter()
+    report = {'name': name, 'datasets': [], 'error': None, 'status': 200}
+    try:
+        report['datasets'] = ingest_file(source, extension, name, head, max_rows, max_bytes)
+    except IngestLimitExceeded as e:
+        report.update(error=str(e), status=413)
+    except Exception as e:
+        report.update(error=f'Cannot read data: {e}', status=400)
+    report['seconds'] = time.perf_counter() - start
+    return report
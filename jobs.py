@@ -0,0 +1,151 @@
+"""
+Background jobs for long running requests, i.e. transcriptions and heavy queries
+
+    - Clients get a job ID at once, then poll status and progress and fetch the result, instead of holding the connection
+    - Jobs keep running on the worker pools when clients disconnect, and can be cancelled
+    - The number of active jobs is bounded, and finished jobs expire after a TTL
+
+Usage: Create a job with jobs.create(), attach the future of its pool work, and let clients query jobs.get().
+"""
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+# Seconds finished jobs are kept for clients to fetch results, and maximum number of queued or running jobs
+JOB_TTL = float(os.environ.get('JOB_TTL', 3600))
+JOB_MAX_ACTIVE = int(os.environ.get('JOB_MAX_ACTIVE', 16))
+
+
+class JobCancelled(Exception):
+    """Raised from progress callbacks to stop the work of a cancelled job."""
+
+
+class TooManyJobs(Exception):
+    """Raised when the maximum number of active jobs is reached."""
+
+    def __init__(self, max_active: int):
+        super().__init__(f'Too many active jobs, at most {max_active} allowed')
+
+
+class Job:
+    """Work running on a pool on behalf of a session, tracked until its result is fetched or expires"""
+
+    def __init__(self, kind: str, token: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.token = token
+        self.status = 'queued'
+        self.progress = 0.0
+        self.created = time.time()
+        self.finished: float | None = None
+        self.result = None
+        self.error: str | None = None
+        self.future: asyncio.Future | None = None
+        self.cancelled = threading.Event()
+
+    @property
+    def active(self) -> bool:
+        return self.finished is None
+
+    def set_progress(self, percent: float):
+        """Report progress from the worker, which also stops the work once the job is cancelled."""
+        if self.cancelled.is_set():
+            raise JobCancelled(self.id)
+        if self.status == 'queued':
+            self.status = 'running'
+        self.progress = max(self.progress, min(percent, 100.0))
+
+    def attach(self, future: asyncio.Future):
+        self.future = future
+        future.add_done_callback(self.finish)
+
+    def finish(self, future: asyncio.Future):
+        if self.cancelled.is_set() or future.cancelled():
+            self.status = 'cancelled'
+        elif future.exception() is not None:
+            self.status = 'failed'
+            self.error = repr(future.exception())
+        else:
+            self.status = 'done'
+            self.result = future.result()
+            self.progress = 100.0
+        self.finished = time.time()
+
+    def cancel(self):
+        """Cancel the job, at once if still queued, otherwise at its next progress report."""
+        if not self.active:
+            return
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def info(self) -> dict:
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': round(self.progress, 1),
+            'created': self.created,
+            'finished': self.finished,
+            'error': self.error,
+        }
+
+
+class JobRegistry:
+    """Jobs by ID, bounded in number of active jobs and expiring some time after they finish"""
+
+    def __init__(self, ttl: float = JOB_TTL, max_active: int = JOB_MAX_ACTIVE):
+        self.ttl = ttl
+        self.max_active = max_active
+        self.jobs: dict[str, Job] = {}
+        self.expired = 0
+        self.lock = threading.Lock()
+
+    def reap(self):
+        """Drop finished jobs past their TTL."""
+        now = time.time()
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items()
+                           if not job.active and now - job.finished > self.ttl]:
+                del self.jobs[job_id]
+                self.expired += 1
+
+    def create(self, kind: str, token: str) -> Job:
+        """ Register new job
+
+            Raises
+            TooManyJobs: Maximum number of active jobs reached
+        """
+        self.reap()
+        with self.lock:
+            if sum(job.active for job in self.jobs.values()) >= self.max_active:
+                raise TooManyJobs(self.max_active)
+            job = Job(kind, token)
+            self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str, token: str) -> Job | None:
+        """Return job of given session, or None if unknown or expired."""
+        self.reap()
+        job = self.jobs.get(job_id)
+        return job if job is not None and job.token == token else None
+
+    def discard(self, job_id: str):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return {
+            'size': len(jobs),
+            'active': sum(job.active for job in jobs),
+            'max_active': self.max_active,
+            'expired': self.expired,
+        }
+
+
+jobs = JobRegistry()
@@ -2,6 +2,8 @@ import os
 
 import uvicorn
 
-os.environ['DATACHAT_ENV'] = 'production'
-uvicorn.run("server:api", host="127.0.0.1", port=8001)
-del os.environ['DATACHAT_ENV']
+# Guarded as sandbox worker processes import the main module when starting
+if __name__ == '__main__':
+    os.environ['DATACHAT_ENV'] = 'production'
+    uvicorn.run("server:api", host="127.0.0.1", port=8001)
+    del os.environ['DATACHAT_ENV']
@@ -9,16 +9,31 @@ Usage: Import functions directly into client modules.
 
 import os
 import random
+import re
 import string
+import time
+import uuid
 from enum import Enum
+from typing import Callable
 
 import pandas as pd
 from dotenv import load_dotenv
 from pandasai import Agent
+from pandasai.helpers.openai_info import get_openai_callback
+from pandasai.helpers.save_chart import add_save_chart
 from pandasai.llm import OpenAI, BambooLLM
 from pandasai.responses.streamlit_response import StreamlitResponse
 
+from artifacts import chart_dir, store_chart
 from asr import DecodeConfig, Media
+from cache import LRUCache, ResponseCache, hash_schema, normalize_prompt
+from dataset_store import DatasetRef, find_dataset, memory_dataset
+from fastpath import FASTPATH, DataProfile, answer as answer_locally
+from metrics import span, record_span, llm_tokens, llm_cost, answers, prompt_tokens
+from pruning import PROMPT_MAX_COLUMNS, DataSchema, build_schema, count_tokens
+from sandbox import ExecutionAborted, install as install_sandbox
+from session import get_backend
+from workers import session_guard
 
 load_dotenv()
 
@@ -48,6 +63,36 @@ pandasAISecurity = None  # AdvancedSecurityAgent() if Security else None
 #     output_scanners = [Deanonymize(vault), NoRefusal(), Sensitive()]
 
 
+# Cache of LLM responses shared by all sessions, configurable from environment
+# Answers are reused for the same prompt on identical data with the same model, skipping the LLM
+# RESPONSE_CACHE_SIMILARITY: minimum word overlap (0-1) to also match reworded prompts, exact only if unset
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1000))
+RESPONSE_CACHE_MB = int(os.environ.get('RESPONSE_CACHE_MB', 256))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 24 * 60 * 60))
+RESPONSE_CACHE_SIMILARITY = float(os.environ['RESPONSE_CACHE_SIMILARITY']) \
+    if os.environ.get('RESPONSE_CACHE_SIMILARITY') else None
+
+responses = ResponseCache(max_items=RESPONSE_CACHE_SIZE, max_bytes=RESPONSE_CACHE_MB * 1024 * 1024,
+                          ttl=RESPONSE_CACHE_TTL, similarity=RESPONSE_CACHE_SIMILARITY)
+
+# Cache of code generated by the LLM, reusable on any data with the same columns and dtypes
+# The code is run locally against current data, asking the LLM again only if it fails
+CODE_CACHE_SIZE = int(os.environ.get('CODE_CACHE_SIZE', 1000))
+CODE_CACHE_TTL = float(os.environ.get('CODE_CACHE_TTL', 7 * 24 * 60 * 60))
+
+codes = LRUCache(max_items=CODE_CACHE_SIZE, ttl=CODE_CACHE_TTL)
+
+# Number of agents kept per session for recent data selections, each holding its data and conversation
+AGENT_POOL_SIZE = int(os.environ.get('AGENT_POOL_SIZE', 4))
+
+# Chart file name in generated code before PandasAI rewrites it to a unique path
+CHART_PLACEHOLDER = 'temp_chart.png'
+
+# Conversation messages kept in session state, as many as agents use in prompts, and their maximum length
+HISTORY_SIZE = 20
+HISTORY_MESSAGE_CHARS = 1000
+
+
 class ModelName(str, Enum):
     bamboo = 'bamboo'
     openai = 'openai'
@@ -83,6 +128,63 @@ def sanitize_output(sanitized_prompt: str, response_text: str):
     # return sanitized_response_text
 
 
+def is_chart(response) -> bool:
+    """Whether response is the path of a chart image saved by the LLM engine."""
+    return isinstance(response, str) and bool(re.search(r'\.(png|jpe?g|webp)$', response, re.IGNORECASE))
+
+
+def is_error(response) -> bool:
+    """Whether response is the apology PandasAI returns on failure instead of raising."""
+    return isinstance(response, str) and response.startswith('Unfortunately, I was not able')
+
+
+def response_size(response) -> int:
+    """Approximate memory held by a response, for cache accounting."""
+    if isinstance(response, pd.DataFrame):
+        return int(response.memory_usage(deep=True).sum())
+    return len(str(response))
+
+
+class ChatAgent(Agent):
+    """PandasAI Agent reporting pipeline progress to an optional listener
+
+    PandasAI callbacks record each stage on the agent (prompt, generated code, executed code, result),
+    so the listener is notified of those attribute updates as they happen.
+    """
+
+    progress_stages = {
+        'last_prompt': 'prompt',
+        'last_code_generated': 'code',
+        'last_code_executed': 'executing',
+        'last_result': 'result',
+    }
+
+    listener: Callable[[str, dict], None] | None = None
+
+    # Time each stage was last reached, to measure LLM and code execution latency
+    stage_times: dict[str, float] | None = None
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if value is not None and name in ChatAgent.progress_stages:
+            stage = ChatAgent.progress_stages[name]
+            if self.stage_times is not None:
+                self.stage_times[stage] = time.perf_counter()
+            if self.listener:
+                self.listener(stage, {'code': value} if stage == 'code' else {})
+
+    def record_stages(self, is_chart_result: bool):
+        """Record spans of LLM code generation and code execution from stage times."""
+        times = self.stage_times or {}
+        if 'prompt' in times and 'code' in times:
+            record_span('llm', times['code'] - times['prompt'])
+        if 'executing' in times and 'result' in times:
+            execution = times['result'] - times['executing']
+            record_span('code_execution', execution)
+            if is_chart_result:
+                record_span('chart_render', execution)
+
+
 def generate_token():
     """Generate random token; used by session creation."""
     return ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
@@ -99,112 +201,501 @@ class Session:
     bambooLLM = BambooLLM()
     openAiLLM = OpenAI(temperature=0)
 
-    current_media: Media
-
-    def __init__(self, use_streamlit=False):
+    def __init__(self, use_streamlit=False, token: str | None = None):
         """ Instantiate new session
 
             Parameters
             use_streamlit (bool): Whether to emit Streamlit specific response, for use by Streamlit client
+            token (str): Token of a session restored from its state, a new one is generated if None
         """
         Session.inc_id += 1
         self.id = Session.inc_id
         self.use_streamlit = use_streamlit
         self.model = ModelName.openai
-        self.token = generate_token()
-        self.datasets: list[pd.DataFrame] = []
+        self.token = token or generate_token()
+        self.version = 0
+        self.datasets: list[DatasetRef] = []
+        self.data_bytes = 0
         self.df = None
+        self.df_hash = None
+        self.df_schema = None
+        self.profile: DataProfile | None = None
+        self.schema: DataSchema | None = None
+        # Columns the LLM saw for the last prompt, when pruned
+        self.pruned_columns: list[str] | None = None
+        self.selection = None
         self.agent = None
-        self.current_media: Media | None = None
+        # Path that served the last answer: 'fastpath', 'response_cache', 'code_cache', 'llm' or 'security'
+        self.last_source: str | None = None
+        # Columns and tokens of the last prompt sent to the LLM, against those of the whole data
+        self.last_prompt_size: dict | None = None
+        self.agents = LRUCache(max_items=AGENT_POOL_SIZE)
+        # Selection to load and conversation to replay when the agent is next needed, after restoring state
+        self.pending_selection: tuple[int, int | None] | None = None
+        self.history: list[dict] = []
+        self.media: Media | None = None
+        self.media_source: tuple[str, str] | None = None
+
+    @property
+    def current_media(self) -> Media | None:
+        """Current media, decoded again on first use after the session was restored in this process."""
+        if self.media is None and self.media_source is not None:
+            filename, path = self.media_source
+            self.media_source = None
+            if os.path.isfile(path):
+                self.media = Media(filename, path)
+        return self.media
+
+    def get_state(self) -> dict:
+        """Return what other processes need to rebuild this session, as JSON serializable values."""
+        media = self.media or self.media_source
+        if isinstance(media, Media):
+            media = (media.filename, media.path)
+        return {
+            'use_streamlit': self.use_streamlit,
+            'model': self.model.value,
+            'datasets': [{'key': ref.key, 'name': ref.name, 'rows': ref.rows, 'memory': ref.memory}
+                         for ref in self.datasets],
+            'selection': self.selection or self.pending_selection,
+            'media': media,
+            'history': self.history,
+        }
+
+    def save(self):
+        """Persist session state to the backend, for other processes to pick up changes."""
+        self.version = backend.save(self.token, self.get_state())
+
+    def restore(self, state: dict):
+        """ Apply state saved by another process, keeping live objects that are still valid
+
+            Agents are rebuilt on demand, and datasets only held in memory by another process are dropped
+            Live objects a running job may use are never cleared here, but swapped by the next job of the session,
+            and replaced media is released once no job of the session uses it
+
+            Parameters
+            state (dict): State as returned by the backend, with its version
+        """
+        self.version = state['version']
+        self.use_streamlit = state['use_streamlit']
+        self.model = ModelName(state['model'])
+        if self.agent:
+            self.agent.context.config.llm = self.get_llm()
+        keys = [dataset['key'] for dataset in state['datasets']]
+        selection = tuple(state['selection']) if state['selection'] else None
+        if keys != [ref.key for ref in self.datasets] or selection != self.selection or \
+                state['history'] != self.history:
+            datasets = []
+            for dataset in state['datasets']:
+                ref = next((ref for ref in self.datasets if ref.key == dataset['key']), None) \
+                    or find_dataset(dataset['key'], dataset['name'])
+                if ref is None:
+                    print('Dataset not available in this process', dataset['key'], dataset['name'])
+                    datasets = []
+                    selection = None
+                    break
+                datasets.append(ref)
+            self.datasets = datasets
+            self.selection = None
+            self.pending_selection = selection
+            self.history = state['history']
+        media = tuple(state['media']) if state['media'] else None
+        current = (self.media.filename, self.media.path) if self.media else self.media_source
+        if media != current:
+            # A transcription running on the replaced media keeps its own reference
+            replaced, self.media, self.media_source = self.media, None, media
+            if replaced:
+                session_guard.defer([(self.token, 'media')], replaced.release)
+
+    def restore_agent(self):
+        """ Load the pending data selection, replaying the saved conversation into its agent
+
+            Run under the agent key of the session, as it replaces the agent and data in use
+        """
+        if self.selection is not None:
+            return
+        if self.pending_selection is None:
+            # Data was dropped elsewhere, or isn't available in this process
+            self.df, self.agent, self.profile, self.schema = None, None, None, None
+            return
+        index, head = self.pending_selection
+        self.pending_selection = None
+        self.load_selection(index, head)
+        memory = self.agent.context.memory
+        memory.clear()
+        for message in self.history:
+            memory.add(message['message'], message['is_user'])
+
+    def get_llm(self):
+        return Session.openAiLLM if self.model == ModelName.openai else Session.bambooLLM
 
     def get_config(self):
         return {
-            'llm': Session.openAiLLM
-            if self.model == ModelName.openai
-            else Session.bambooLLM,
+            'llm': self.get_llm(),
             'response_parser': StreamlitResponse if self.use_streamlit else None,
             'open_charts': False,
             'save_charts': True,
-            'save_charts_path': os.path.join(os.getcwd(), 'public'),
+            'save_charts_path': chart_dir(self.token),
         }
 
     def set_model(self, model: ModelName):
         """ Change current LLM model for subsequent use
 
+            The LLM is swapped in the current agent, keeping its data and conversation memory
+
             Parameters
             model(str): 'openai' or 'bamboo'
         """
+        changed = model != self.model
         self.model = model
-        if self.df is not None and self.agent:
-            self.agent = Agent(
-                self.df,
-                self.get_config(),
-                security=pandasAISecurity,
-                memory_size=10,
-            )
-
-    def set_data(self, dfs: list[pd.DataFrame]):
+        if self.agent:
+            self.agent.context.config.llm = self.get_llm()
+        if changed:
+            self.save()
+
+    def set_data(self, dfs: list[pd.DataFrame | DatasetRef]):
         """ Change current dataset
 
+            Setting the same data as current selection again is a no-op, as clients may do on every rerun
+
             Parameters
-            dfs: List of DataFrames, typically read from input files
+            dfs: List of DataFrames, typically read from input files, or references to stored datasets
         """
         if not len(dfs):
             raise Exception('Setting empty data')
-        self.datasets = dfs
+        unchanged = self.agent is not None and self.selection == (0, None) and len(dfs) == len(self.datasets)
+        # Cheapest check first: the very same objects
+        if unchanged and all(df is ref or df is ref.df for df, ref in zip(dfs, self.datasets)):
+            return
+        datasets = [df if isinstance(df, DatasetRef) else memory_dataset(df) for df in dfs]
+        if unchanged and [ref.key for ref in datasets] == [ref.key for ref in self.datasets]:
+            return
+        self.datasets = datasets
+        self.pending_selection = None
         self.select_data(0)
 
+    def get_agent(self, dataset: DatasetRef, head: int | None) -> (pd.DataFrame, ChatAgent, DataProfile, DataSchema):
+        """Return data, agent, profile and schema of the dataset head from the pool, building them on first use."""
+        key = (dataset.key, head)
+        entry = self.agents.get(key)
+        if entry is None:
+            with span('data_load'):
+                df = dataset.load(head=head)
+            with span('agent_build'):
+                agent = ChatAgent(
+                    df,
+                    self.get_config(),
+                    security=pandasAISecurity,
+                    memory_size=10,
+                )
+                install_sandbox(agent, dataset, head)
+            with span('data_profile'):
+                profile = DataProfile(df) if FASTPATH or len(df.columns) > PROMPT_MAX_COLUMNS else None
+                schema = build_schema(profile)
+            entry = (df, agent, profile, schema)
+            # Views on data held in memory by the dataset are counted twice, erring on the safe side
+            self.agents.put(key, entry, int(df.memory_usage(deep=True).sum()))
+        else:
+            entry[1].context.config.llm = self.get_llm()
+        return entry
+
     def select_data(self, index: int, head: int = None):
         """ Change current data selection, including DataFrame and number of head rows
 
+            Only the selected data is loaded in memory, unless datasets were given as DataFrames
+            Agents of recent selections are kept, so switching back restores them with their conversation
+
             Parameters
             index (int): Index of DataFrame in list
             head(int): Number of head rows taken from DataFrame
         """
+        self.pending_selection = None
+        self.load_selection(index, head)
+        self.history = self.get_history()
+        self.save()
+
+    def load_selection(self, index: int, head: int | None):
         if index >= len(self.datasets):
             raise Exception('Selecting data out of range')
-        df = self.datasets[index]
-        self.df = df if not head else df.head(head)
-        self.agent = Agent(
-            self.df,
-            self.get_config(),
-            security=pandasAISecurity,
-            memory_size=10,
-        )
+        dataset = self.datasets[index]
+        self.df, self.agent, self.profile, self.schema = self.get_agent(dataset, head)
+        self.pruned_columns = None
+        self.selection = (index, head)
+        self.df_hash = f'{dataset.key}:{head or ""}'
+        self.df_schema = hash_schema(self.df)
+        self.data_bytes = sum(ref.memory for ref in self.datasets if ref.df is not None) + self.agents.total_bytes
+        sessions.resize(self.token, self.data_bytes)
+
+    def get_history(self) -> list[dict]:
+        """Return the last conversation messages of the current agent, shortened for storage."""
+        if self.agent is None:
+            return []
+        return [{'message': str(message['message'])[:HISTORY_MESSAGE_CHARS], 'is_user': message['is_user']}
+                for message in self.agent.context.memory.all()[-HISTORY_SIZE:]]
 
     def add_media(self, filename, path):
-        self.current_media = Media(filename, path)
-        return self.current_media
-
-    def get_transcribe_response(self, config: DecodeConfig):
-        return self.current_media.transcribe(config)
-
-    def get_srt(self):
-        return self.current_media.export_srt()
+        if self.media:
+            self.media.close()
+        self.media_source = None
+        self.media = Media(filename, path)
+        self.save()
+        return self.media
+
+    def close(self):
+        """ Release data, agent and media held by this session; used on eviction, once no job uses them
+
+            Only objects in memory are dropped, as the saved state may be restored later in this or another process,
+            so the uploaded media file is kept for it
+        """
+        self.agent = None
+        self.agents.clear()
+        self.df = None
+        self.df_hash = None
+        self.df_schema = None
+        self.profile = None
+        self.schema = None
+        self.pruned_columns = None
+        self.selection = None
+        self.datasets = []
+        self.data_bytes = 0
+        self.pending_selection = None
+        if self.media:
+            self.media_source = (self.media.filename, self.media.path)
+            self.media.release()
+            self.media = None
+
+    def delete_files(self):
+        """Delete the uploaded media file of this session, once its saved state is gone for all processes."""
+        media = self.media or self.media_source
+        if isinstance(media, Media):
+            media.close()
+        elif media is not None and os.path.isfile(media[1]):
+            os.remove(media[1])
+        self.media = None
+        self.media_source = None
+
+    def get_transcribe_response(self, config: DecodeConfig, on_segment: Callable | None = None):
+        return self.current_media.transcribe(config, on_segment)
+
+    def get_subtitles(self, format: str = 'srt', max_chars: int | None = None, max_cps: float | None = None):
+        return self.current_media.export_subtitles(format, max_chars, max_cps)
 
     """
         Data Analysis
     """
 
-    def get_chat_response(self, query: str):
+    def get_cached_response(self, query: str):
+        """Return the cached answer to the query on current data and model, or None."""
+        response = responses.get(self.df_hash, self.model.value, query)
+        # Charts live on disk and may have been cleaned up since
+        if is_chart(response) and not os.path.isfile(response):
+            responses.invalidate(self.df_hash, self.model.value, query)
+            return None
+        return response
+
+    def cache_response(self, query: str, response):
+        if response is None or is_error(response) or (is_chart(response) and not os.path.isfile(response)):
+            return
+        if isinstance(response, pd.DataFrame):
+            # Don't keep the session data alive through a view on it
+            response = response.copy()
+        responses.put(self.df_hash, self.model.value, query, response, response_size(response))
+
+    def get_code_key(self, query: str):
+        return self.df_schema, self.model.value, normalize_prompt(query)
+
+    def cache_code(self, query: str, response):
+        code = self.agent.last_code_executed
+        if not code or response is None or is_error(response):
+            return
+        if is_chart(response):
+            # Restore the placeholder so each rerun saves a new chart instead of overwriting this one
+            code = code.replace(response, CHART_PLACEHOLDER)
+        codes.put(self.get_code_key(query), code)
+
+    def run_cached_code(self, query: str):
+        """ Answer the query by running code generated earlier for the same prompt on data of same schema
+
+            Returns
+            Response as from the agent, or None if no code cached or it failed on current data
+        """
+        key = self.get_code_key(query)
+        code = codes.get(key)
+        if code is None:
+            return None
+        config = self.agent.context.config
+        if self.agent.listener:
+            self.agent.listener('cache', {'source': 'code', 'code': code})
+        if CHART_PLACEHOLDER in code:
+            code = add_save_chart(code, self.agent.logger, str(uuid.uuid4()), config.save_charts_path)
+        self.agent.context.reset_intermediate_values()
+        self.agent.context.add_many({'output_type': None, 'last_prompt_id': self.agent.last_prompt_id})
+        # Result parsing records the answer, so the query goes first and is taken back if execution fails
+        self.agent.context.memory.add(query, True)
+        # Run the execution stages only, as error correction would call the LLM anyway
+        error_correction = config.use_error_correction_framework
+        config.use_error_correction_framework = False
+        try:
+            return self.agent.pipeline.code_execution_pipeline.run(code)
+        except ExecutionAborted as e:
+            # Asking the LLM for new code would likely hit the same limit
+            codes.pop(key)
+            self.forget_query(query)
+            return f'Unfortunately, I was not able to get your answers, because of the following error:\n\n{e}\n'
+        except Exception as e:
+            print('Cached code failed, falling back to LLM:', repr(e))
+            codes.pop(key)
+            # The LLM path adds the query again
+            self.forget_query(query)
+            return None
+        finally:
+            config.use_error_correction_framework = error_correction
+
+    def forget_query(self, query: str):
+        """Remove the query from agent memory if it is the last message, left unanswered."""
+        messages = self.agent.context.memory.all()
+        if messages and messages[-1] == {'message': query, 'is_user': True}:
+            messages.pop()
+
+    def chat(self, query: str):
+        """ Ask the agent, showing it only the columns relevant to the query when data is wide
+
+            Queries failing on pruned columns are asked again with all columns
+        """
+        connector = self.agent.context.dfs[0]
+        columns = self.schema.select(query, self.pruned_columns) if self.schema else None
+        self.pruned_columns = columns
+        if columns is None:
+            self.agent.last_prompt = None
+            response = self.agent.chat(query)
+            self.measure_prompt(connector, connector)
+            return response
+        view = self.schema.view(columns)
+        self.agent.context.dfs = [view]
+        self.agent.last_prompt = None
+        try:
+            response = self.agent.chat(query)
+        finally:
+            self.agent.context.dfs = [connector]
+        self.measure_prompt(connector, view, columns)
+        # Queries stopped by execution limits would likely hit them again
+        if is_error(response) and ExecutionAborted.prefix not in response:
+            print('Query failed on pruned columns, asking again with all of them:', columns)
+            self.pruned_columns = None
+            self.agent.last_prompt = None
+            response = self.agent.chat(query)
+            self.measure_prompt(connector, connector)
+        return response
+
+    def measure_prompt(self, connector, view, columns: list[str] | None = None):
+        """ Record tokens of the prompt sent with the data of view, and of the same prompt with all the data
+
+            The data parts of both prompts are counted once per selection, as serializing wide data is slow
+        """
+        prompt = self.agent.last_prompt
+        if not prompt:
+            # Answered by the engine cache
+            self.last_prompt_size = None
+            return
+        tokens = count_tokens(prompt)
+        full_tokens = tokens
+        if view is not connector:
+            config = self.agent.context.config
+            full_tokens += self.schema.prompt_tokens(connector, config)
+            full_tokens -= self.schema.prompt_tokens(view, config, columns)
+        self.last_prompt_size = {'columns': view.columns_count, 'total_columns': connector.columns_count,
+                                 'tokens': tokens, 'full_tokens': full_tokens}
+        prompt_tokens.inc(tokens, kind='sent')
+        prompt_tokens.inc(full_tokens, kind='full')
+
+    def answer_locally(self, query: str, on_progress: Callable[[str, dict], None] | None = None):
+        """ Answer simple questions from the profile of current data, recording them in the conversation
+
+            Returns
+            Answer as from the agent, or None if the question needs the LLM
+        """
+        if not FASTPATH or self.profile is None:
+            return None
+        with span('fastpath'):
+            local = answer_locally(self.profile, query)
+        if local is None:
+            return None
+        intent, response = local
+        if on_progress:
+            on_progress('fastpath', {'intent': intent})
+        self.remember(query, response)
+        return response
+
+    def remember(self, query: str, response):
+        """Record a question and its answer served without the agent in its conversation, as PandasAI would."""
+        memory = self.agent.context.memory
+        memory.add(query, True)
+        if isinstance(response, pd.DataFrame):
+            memory.add('Check it out: <dataframe>', False)
+        else:
+            memory.add('Check it out: <plot>' if is_chart(response) else str(response), False)
+        self.history = self.get_history()
+        self.save()
+
+    def get_chat_response(self, query: str, on_progress: Callable[[str, dict], None] | None = None):
         """ Query LLM engine with the prompt, applying security layer if enabled
 
+            Simple questions are answered from the data profile, then cached answers and code are tried first.
+            The path serving the answer is left in last_source, and the size of the prompt in last_prompt_size.
+
             Parameters
             query (str): Use prompt
+            on_progress (callable): Called with (stage, data) as the answer progresses,
+                stage being 'fastpath', 'cache', 'prompt', 'code', 'executing' or 'result'
 
             Returns
             (str | StreamlitResponse): Response from LLM engine
         """
-        # with get_openai_callback() as cb:
-        #     response = agent.chat(query)
-        #     print("Result:", cb)
+        self.restore_agent()
         if not self.agent:
             raise Exception('No agent initialized')
+        self.last_prompt_size = None
         try:
             sanitized_query = sanitize_prompt(query)
         except ValueError:
+            self.last_source = 'security'
             return 'Your question is deemed unsafe. Please reformulate properly and try again.'
-        response = self.agent.chat(sanitized_query)
+        response = self.answer_locally(sanitized_query, on_progress)
+        if response is not None:
+            self.last_source = 'fastpath'
+            answers.inc(source=self.last_source)
+            return response
+        response = self.get_cached_response(sanitized_query)
+        if response is not None:
+            self.last_source = 'response_cache'
+            if on_progress:
+                on_progress('cache', {'source': 'response'})
+            self.remember(sanitized_query, response)
+        else:
+            self.agent.listener = on_progress
+            self.agent.stage_times = {}
+            try:
+                response = self.run_cached_code(sanitized_query)
+                self.last_source = 'code_cache'
+                if response is None:
+                    self.last_source = 'llm'
+                    # Token usage is only reported by OpenAI models
+                    with get_openai_callback() as cb:
+                        response = self.chat(sanitized_query)
+                    if cb.total_tokens:
+                        llm_tokens.inc(cb.prompt_tokens, model=self.model.value, kind='prompt')
+                        llm_tokens.inc(cb.completion_tokens, model=self.model.value, kind='completion')
+                        llm_cost.inc(cb.total_cost, model=self.model.value)
+                    self.cache_code(sanitized_query, response)
+                if is_chart(response) and os.path.isfile(response):
+                    response = store_chart(response)
+                self.agent.record_stages(is_chart(response))
+            finally:
+                self.agent.listener = None
+                self.agent.stage_times = None
+            self.cache_response(sanitized_query, response)
+            self.history = self.get_history()
+            self.save()
+        answers.inc(source=self.last_source)
         if not isinstance(response, str):
             return response
         return sanitize_output(sanitized_query, response)
@@ -212,10 +703,25 @@ class Session:
 
 # End class Session
 
-# List of sessions to maintain states with individual clients
-# For simplicity, this is stored in memory and will be lost on module rerun
-# Ideally, persist in server storage and enforce expiration/refresh
-sessions: list[Session] = []
+# Limits of the session registry, configurable from environment
+# Idle sessions expire after the TTL, least recently used ones go first when over count or data budget
+SESSION_TTL = float(os.environ.get('SESSION_TTL', 60 * 60))
+SESSION_MAX_COUNT = int(os.environ.get('SESSION_MAX_COUNT', 1000))
+SESSION_MAX_DATA_BYTES = int(os.environ.get('SESSION_MAX_DATA_MB', 2048)) * 1024 * 1024
+
+
+def on_session_evicted(token: str, session: Session, reason: str):
+    """Free resources of a session leaving the registry, once its running jobs are done with them."""
+    print('Session evicted', token, reason)
+    session_guard.defer([(token, 'agent'), (token, 'media')], session.close)
+
+
+# Sessions to maintain states with individual clients, keyed by token
+# Their state is saved to the configured backend, so sessions evicted here or held by other worker processes
+# are rebuilt on demand, while live objects (agents, data, media) are kept in memory by this cache
+backend = get_backend()
+sessions = LRUCache(max_items=SESSION_MAX_COUNT, max_bytes=SESSION_MAX_DATA_BYTES,
+                    ttl=SESSION_TTL, on_evict=on_session_evicted)
 
 
 # All public functions below are exposed by the core module for use by clients
@@ -232,7 +738,8 @@ def create_session(use_streamlit=False):
             Client should attach this token to any subsequent call
     """
     session = Session(use_streamlit)
-    sessions.append(session)
+    sessions.put(session.token, session)
+    session.save()
     print('Session created', session.token)
     return session.token
 
@@ -244,10 +751,24 @@ def new_session():
 
 
 def get_session_by_token(token: str):
-    """Internal function to get the session based on client submitted token."""
-    session = next((s for s in sessions if s.token == token), None)
-    if not session:
+    """Internal function to get the session based on client submitted token.
+
+    Sessions unknown to this process are rebuilt from their saved state, and known ones updated if changed elsewhere.
+    """
+    session = sessions.get(token)
+    if session is not None and backend.version(token) == session.version:
+        return session
+    state = backend.load(token)
+    if state is None:
+        if session is not None:
+            sessions.pop(token)
+            # Expired for every process, so the files of the session can go once its jobs are done
+            session_guard.defer([(token, 'agent'), (token, 'media')], session.delete_files)
         raise Exception('Expired session. Try refreshing page')
+    if session is None:
+        session = Session(state['use_streamlit'], token)
+        sessions.put(token, session)
+    session.restore(state)
     return session
 
 
@@ -281,3 +802,18 @@ def get_chat_response(query: str, token: str):
     session = get_session_by_token(token)
     response = session.get_chat_response(query)
     return response
+
+
+def get_session_stats():
+    """Return hit/miss/eviction counters and usage of the session registry, and number of saved sessions."""
+    return {**sessions.stats(), 'saved': backend.stats()}
+
+
+def get_response_cache_stats():
+    """Return hit/miss/eviction counters and usage of the response cache."""
+    return responses.stats()
+
+
+def get_code_cache_stats():
+    """Return hit/miss/eviction counters and usage of the generated code cache."""
+    return codes.stats()
@@ -0,0 +1,150 @@
+"""
+Latency instrumentation exposed in Prometheus text format
+
+    - Counters and histograms with labels, safe to update from worker threads
+    - Spans timing named stages (upload parsing, agent construction, LLM, code execution, transcription...)
+    - Per-request collection of span timings, for an optional Server-Timing response header
+
+Usage: Wrap stages with `with span('name'):` or record values directly, then serve render() at /metrics.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Default latency buckets in seconds, from fast cache hits to long transcriptions
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    labels = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter:
+    """Monotonic counter, optionally labelled"""
+
+    type = 'counter'
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [f'{self.name}{format_labels(self.labels, key)} {value}' for key, value in self.values.items()]
+
+
+class Histogram:
+    """Distribution of observed values over cumulative buckets, optionally labelled"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, entry in self.values.items():
+                for bound, count in zip(self.buckets, entry):
+                    le = 'le="%s"' % bound
+                    lines.append(f'{self.name}_bucket{format_labels(self.labels, key, le)} {count}')
+                le = 'le="+Inf"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, key, le)} {entry[-1]}')
+                lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {entry[-2]}')
+                lines.append(f'{self.name}_count{format_labels(self.labels, key)} {entry[-1]}')
+        return lines
+
+
+registry: list[Counter | Histogram] = []
+
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+span_seconds = register(Histogram('datachat_span_seconds', 'Duration of processing stages', ('span',)))
+request_seconds = register(Histogram('datachat_http_request_seconds', 'Duration of API requests',
+                                     ('method', 'route', 'status')))
+llm_tokens = register(Counter('datachat_llm_tokens_total', 'Tokens used by LLM calls', ('model', 'kind')))
+llm_cost = register(Counter('datachat_llm_cost_usd_total', 'Estimated cost of LLM calls in USD', ('model',)))
+asr_tokens = register(Counter('datachat_asr_tokens_total', 'Tokens decoded by transcription', ('model',)))
+asr_cost = register(Counter('datachat_asr_cost_usd_total', 'Estimated cost of transcription in USD', ('model',)))
+answers = register(Counter('datachat_answers_total', 'Answers to queries by path serving them', ('source',)))
+prompt_tokens = register(Counter('datachat_prompt_tokens_total',
+                                 'Tokens of prompts sent to the LLM, and of the same prompts on all columns',
+                                 ('kind',)))
+sandbox_kills = register(Counter('datachat_sandbox_kills_total', 'Workers killed running generated code, by cause',
+                                 ('reason',)))
+
+# Span timings of the current request, as (name, seconds) pairs
+request_timings: contextvars.ContextVar[list | None] = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_request() -> list:
+    """Start collecting span timings for the current request context."""
+    timings = []
+    request_timings.set(timings)
+    return timings
+
+
+def record_span(name: str, seconds: float):
+    span_seconds.observe(seconds, span=name)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def span(name: str):
+    """Time the enclosed block as named stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def format_server_timing(timings: list) -> str:
+    """Format span timings as Server-Timing header value, in milliseconds."""
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings)
+
+
+def render() -> str:
+    """Render all metrics in Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines += metric.samples()
+    return '\n'.join(lines) + '\n'
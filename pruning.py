@@ -0,0 +1,198 @@
+"""
+Compact schemas of wide datasets and pruning of the columns sent to the LLM with each prompt
+
+    - PandasAI puts a sample of every column in each prompt, which makes prompts on wide tables long and slow
+    - A schema summary is built once per dataset: type, distinct count and a few representative values of each column
+    - Each prompt selects the columns it names, those holding values it mentions, dates for questions about time,
+      and the columns selected for the previous prompt, so follow-up questions keep their context
+    - The agent then works on a view of the data limited to those columns, described by their summary
+    - Narrow datasets, and prompts matching no column, are sent whole
+    - Prompt sizes are measured in tokens, before and after pruning, serializing the data once per selection
+
+Usage: Build a DataSchema from the data profile, select() columns for a prompt and give the agent a view() on them.
+"""
+
+import os
+import re
+import warnings
+
+import pandas as pd
+from pandasai.connectors import BaseConnector, PandasConnector
+
+from cache import LRUCache, STOPWORDS, normalize_prompt
+from fastpath import DataProfile
+
+# Datasets with more columns than this get pruned prompts
+PROMPT_MAX_COLUMNS = int(os.environ.get('PROMPT_MAX_COLUMNS', 30))
+# Name of a tiktoken encoding counting prompt tokens exactly, e.g. 'cl100k_base', otherwise they are estimated
+PROMPT_TOKENIZER = os.environ.get('PROMPT_TOKENIZER', '')
+# Representative values listed per column, and their maximum length
+SUMMARY_VALUES = 3
+SUMMARY_VALUE_CHARS = 30
+# Longest values, in words, matched in prompts
+VALUE_MAX_WORDS = 4
+# Words of prompts about time, selecting date columns
+TIME_WORDS = {'date', 'dates', 'time', 'day', 'days', 'daily', 'week', 'weeks', 'weekly', 'month', 'months',
+              'monthly', 'quarter', 'quarters', 'quarterly', 'year', 'years', 'yearly', 'annual', 'trend', 'when'}
+# Number of views kept per dataset, as selections tend to repeat during a conversation
+VIEW_CACHE_SIZE = 4
+
+encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens of text with the configured tokenizer, or estimate them at 4 characters per token."""
+    global encoding
+    if encoding is None:
+        encoding = False
+        if PROMPT_TOKENIZER:
+            try:
+                import tiktoken
+                encoding = tiktoken.get_encoding(PROMPT_TOKENIZER)
+            except Exception as e:
+                print('Estimating prompt tokens as tokenizer is not available:', repr(e))
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def stem(word: str) -> str:
+    """Crude singular of a word, so 'cities' matches 'city' and 'sales' matches 'sale'."""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def name_words(name: str) -> list[str]:
+    """Words of a column name, split on case changes, underscores and punctuation."""
+    name = re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', name)
+    return normalize_prompt(name.replace('_', ' ')).split()
+
+
+def format_value(value) -> str:
+    text = f'{value:.6g}' if isinstance(value, float) else str(value)
+    return text if len(text) <= SUMMARY_VALUE_CHARS else text[:SUMMARY_VALUE_CHARS - 3] + '...'
+
+
+class DataSchema:
+    """Summary of the columns of a dataset, selecting those relevant to prompts"""
+
+    def __init__(self, profile: DataProfile):
+        """ Instantiate new schema
+
+            Parameters
+            profile (DataProfile): Profile of the data, providing statistics and value counts of columns
+        """
+        self.df = profile.df
+        self.columns = profile.columns
+        # Original column labels by name, which may not be strings
+        self.labels = dict(zip(profile.columns, profile.df.columns))
+        self.summary: dict[str, str] = {}
+        self.words: dict[str, set[str]] = {}  # word of column names -> columns
+        self.values: dict[str, set[str]] = {}  # normalized value -> columns holding it
+        self.dates = [column for column, dtype in profile.dtypes.items() if dtype.startswith('datetime')]
+        self.views = LRUCache(max_items=VIEW_CACHE_SIZE)
+        # Tokens of the data part of prompts, by columns (None for all) and prompt settings
+        self.tokens = LRUCache(max_items=VIEW_CACHE_SIZE + 1)
+        for column in self.columns:
+            self.summary[column] = self.describe(profile, column)
+            for word in name_words(column):
+                if word not in STOPWORDS:
+                    self.words.setdefault(stem(word), set()).add(column)
+        for column, counts in profile.value_counts.items():
+            if column in profile.stats:
+                # Numbers and dates are matched by name only
+                continue
+            for value in counts.iloc[:, 0]:
+                text = normalize_prompt(str(value))
+                if text and len(text.split()) <= VALUE_MAX_WORDS:
+                    self.values.setdefault(text, set()).add(column)
+
+    @staticmethod
+    def describe(profile: DataProfile, column: str) -> str:
+        """Return a line summarizing a column: type, distinct count and range or most frequent values."""
+        line = f'{column}: {profile.dtypes[column]}'
+        if column in profile.distinct:
+            line += f', {profile.distinct[column]} distinct'
+        stats = profile.stats.get(column)
+        if stats is not None and 'min' in stats and not pd.isna(stats['min']):
+            return f'{line}, {format_value(stats["min"])} to {format_value(stats["max"])}'
+        counts = profile.value_counts.get(column)
+        if counts is not None and len(counts.index):
+            return f'{line}, e.g. ' + ', '.join(format_value(value) for value in counts.iloc[:SUMMARY_VALUES, 0])
+        return line
+
+    def select(self, prompt: str, previous: list[str] | None = None) -> list[str] | None:
+        """ Select the columns relevant to a prompt
+
+            Parameters
+            prompt (str): Question about the data
+            previous (list): Columns selected for the previous question in the conversation
+
+            Returns
+            Columns in data order, or None to send all columns
+        """
+        if len(self.columns) <= PROMPT_MAX_COLUMNS:
+            return None
+        words = normalize_prompt(prompt).split()
+        selected = set()
+        for word in words:
+            selected.update(self.words.get(stem(word), ()))
+        for size in range(1, VALUE_MAX_WORDS + 1):
+            for start in range(len(words) - size + 1):
+                selected.update(self.values.get(' '.join(words[start:start + size]), ()))
+        previous = [column for column in previous or [] if column in self.summary]
+        about_time = bool(TIME_WORDS.intersection(words))
+        # Questions naming nothing are only pruned as follow-ups about time, e.g. 'and by month?'
+        if not selected and not (about_time and previous):
+            return None
+        if about_time:
+            selected.update(self.dates)
+        selected.update(previous)
+        if len(selected) == len(self.columns):
+            return None
+        return [column for column in self.columns if column in selected]
+
+    def view(self, columns: list[str]) -> PandasConnector:
+        """Return a connector to the data limited to columns, to give the agent in place of the whole data."""
+        key = tuple(columns)
+        view = self.views.get(key)
+        if view is None:
+            # Sample rows are drawn and anonymized by the connector, as for the whole data
+            view = PandasConnector({'original_df': self.df[[self.labels[column] for column in columns]]},
+                                   description='\n'.join(self.summary[column] for column in columns))
+            self.views.put(key, view)
+        return view
+
+    def prompt_tokens(self, connector: BaseConnector, config, columns: list[str] | None = None) -> int:
+        """ Return tokens of the part of prompts describing the data, serializing it on first use only
+
+            Parameters
+            connector (BaseConnector): Connector to all the data, or the view on columns
+            config (Config): Agent configuration, telling how the data is rendered
+            columns (list): Columns of the view, None for all the data
+        """
+        key = (None if columns is None else tuple(columns), config.direct_sql, str(config.dataframe_serializer),
+               config.enforce_privacy)
+        tokens = self.tokens.get(key)
+        if tokens is None:
+            tokens = count_tokens(dataframe_prompt(connector, config))
+            self.tokens.put(key, tokens)
+        return tokens
+
+
+def dataframe_prompt(connector: BaseConnector, config) -> str:
+    """Return the part of prompts describing the data of a connector, as PandasAI renders it."""
+    with warnings.catch_warnings():
+        # PandasAI samples wide data column by column
+        warnings.simplefilter('ignore', pd.errors.PerformanceWarning)
+        return connector.to_string(0, config.direct_sql, config.dataframe_serializer, config.enforce_privacy)
+
+
+def build_schema(profile: DataProfile | None) -> DataSchema | None:
+    """Return the schema of profiled data wide enough for its prompts to be pruned, or None."""
+    if profile is None or profile.summary is None or len(profile.columns) <= PROMPT_MAX_COLUMNS:
+        return None
+    return DataSchema(profile)
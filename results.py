@@ -0,0 +1,166 @@
+"""
+Server-side store of tabular answers, served page by page
+
+    - DataFrame answers are kept under a result ID for a while, so responses carry their schema and first page only
+    - Further pages are served on request as JSON rows, HTML, or streamed as Arrow IPC or CSV
+    - HTML is only rendered for the requested page, never for the whole result
+    - Results are scoped to the session that produced them and bounded in count, memory and idle time
+
+Usage: Put a DataFrame answer with results.put(), describe() it in the response, then serve pages from results.get().
+"""
+
+import io
+import os
+import uuid
+from typing import Iterator
+
+import pandas as pd
+
+from cache import LRUCache
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Limits of the result store, configurable from environment
+RESULT_MAX_COUNT = int(os.environ.get('RESULT_MAX_COUNT', 1000))
+RESULT_MAX_BYTES = int(os.environ.get('RESULT_MAX_MB', 512)) * 1024 * 1024
+RESULT_TTL = float(os.environ.get('RESULT_TTL', 60 * 60))
+# Rows of the page sent with an answer, and maximum rows of a page served as JSON or HTML
+RESULT_PAGE_ROWS = int(os.environ.get('RESULT_PAGE_ROWS', 100))
+RESULT_MAX_PAGE_ROWS = int(os.environ.get('RESULT_MAX_PAGE_ROWS', 10000))
+
+# Rows converted at once when streaming Arrow record batches or CSV
+STREAM_ROWS = 10000
+
+FORMATS = {
+    'json': 'application/json',
+    'html': 'text/html',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'csv': 'text/csv',
+}
+
+
+def index_names(df: pd.DataFrame) -> list:
+    """Names to give index levels turned into columns, suffixed where they clash with columns, e.g. after groupby."""
+    taken = set(df.columns)
+    names = []
+    for i, name in enumerate(df.index.names):
+        if name is None:
+            name = 'index' if df.index.nlevels == 1 else f'level_{i}'
+        while name in taken:
+            name = f'{name}_index'
+        taken.add(name)
+        names.append(name)
+    return names
+
+
+class Result:
+    """DataFrame answer of a session, with its index turned into columns so every format carries it"""
+
+    def __init__(self, df: pd.DataFrame, token: str):
+        """ Instantiate new result
+
+            Parameters
+            df (DataFrame): The answer, kept as is unless its index holds data
+            token (str): Session owning the result
+        """
+        index = df.index
+        if not (isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1):
+            df = df.reset_index(names=index_names(df))
+        self.id = uuid.uuid4().hex
+        self.df = df
+        self.token = token
+
+    @property
+    def rows(self) -> int:
+        return len(self.df.index)
+
+    def schema(self) -> list[dict]:
+        return [{'name': str(name), 'dtype': str(dtype)} for name, dtype in self.df.dtypes.items()]
+
+    def slice(self, offset: int = 0, limit: int | None = None) -> pd.DataFrame:
+        offset = max(offset, 0)
+        return self.df.iloc[offset:] if limit is None else self.df.iloc[offset:offset + max(limit, 0)]
+
+    def to_json(self, offset: int = 0, limit: int = RESULT_PAGE_ROWS) -> str:
+        """Encode a page of rows as a JSON object, with rows as arrays of values in column order."""
+        page = self.slice(offset, min(limit, RESULT_MAX_PAGE_ROWS))
+        rows = page.to_json(orient='values', date_format='iso')
+        return f'{{"id":"{self.id}","offset":{max(offset, 0)},"total_rows":{self.rows},"rows":{rows}}}'
+
+    def to_html(self, offset: int = 0, limit: int = RESULT_PAGE_ROWS) -> str:
+        """Render a page of rows as an HTML table, noting the range shown when the result has more rows."""
+        offset = max(offset, 0)
+        page = self.slice(offset, min(limit, RESULT_MAX_PAGE_ROWS))
+        html = page.to_html(index=False)
+        if 0 < len(page.index) < self.rows:
+            html += f'\n<p>Rows {offset + 1}-{offset + len(page.index)} of {self.rows}</p>'
+        return html
+
+    def iter_csv(self, offset: int = 0, limit: int | None = None) -> Iterator[str]:
+        """Stream rows as CSV with a header line, converting STREAM_ROWS rows at a time."""
+        df = self.slice(offset, limit)
+        yield df.iloc[:0].to_csv(index=False)
+        for start in range(0, len(df.index), STREAM_ROWS):
+            yield df.iloc[start:start + STREAM_ROWS].to_csv(index=False, header=False)
+
+    def iter_arrow(self, offset: int = 0, limit: int | None = None) -> Iterator[bytes]:
+        """Stream rows in Arrow IPC streaming format, one record batch of at most STREAM_ROWS rows at a time."""
+        table = to_arrow(self.slice(offset, limit))
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=STREAM_ROWS):
+                writer.write_batch(batch)
+                yield take(sink)
+        yield take(sink)
+
+    def describe(self, limit: int = RESULT_PAGE_ROWS) -> dict:
+        """Return what answers carry about the result: ID, schema, total rows and size of the page included."""
+        return {'id': self.id, 'columns': self.schema(), 'rows': self.rows, 'page_rows': min(limit, self.rows)}
+
+
+def take(sink: io.BytesIO) -> bytes:
+    """Return bytes written to the sink so far and empty it."""
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def to_arrow(df: pd.DataFrame) -> 'pa.Table':
+    """Convert to an Arrow table, sending columns Arrow can't represent, e.g. of mixed types, as strings."""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        objects = df.select_dtypes('object').columns
+        return pa.Table.from_pandas(df.astype({name: str for name in objects}), preserve_index=False)
+
+
+class ResultStore:
+    """Results by ID, evicted least recently used first over count and memory budgets, or when idle too long"""
+
+    def __init__(self, max_items: int | None = RESULT_MAX_COUNT, max_bytes: int | None = RESULT_MAX_BYTES,
+                 ttl: float | None = RESULT_TTL):
+        self.results = LRUCache(max_items=max_items, max_bytes=max_bytes, ttl=ttl)
+
+    def put(self, df: pd.DataFrame, token: str) -> Result:
+        result = Result(df, token)
+        # Shallow size, as object values are mostly shared with the session data the answer was computed from
+        self.results.put(result.id, result, int(result.df.memory_usage(index=False).sum()))
+        return result
+
+    def get(self, result_id: str, token: str) -> Result | None:
+        """Return result of given session, or None if unknown or expired."""
+        result = self.results.get(result_id)
+        return result if result is not None and result.token == token else None
+
+    def discard(self, result_id: str):
+        self.results.pop(result_id)
+
+    def stats(self) -> dict:
+        return self.results.stats()
+
+
+results = ResultStore()
@@ -0,0 +1,438 @@
+"""
+Isolated execution of code generated by the LLM, bounded in time and memory
+
+    - Generated code runs in a pool of worker processes started ahead of queries, off the API process
+    - Workers load datasets themselves from their Arrow files and keep the last ones loaded,
+      so only code and results cross process boundaries; queries go to a worker already holding their data
+    - Data kept in memory by sessions is pickled to a worker once, then reused the same way
+    - Datasets held by a worker are private copies, so its memory limit applies on top of their size
+    - Workers exceeding the wall-clock or memory limit are killed and replaced, and the query gets a clean error
+    - Workers are also replaced after a number of jobs, bounding memory kept by fragmentation or leaks
+    - PandasAI internals the sandbox relies on are accessed in one place, for the version pinned in requirements
+
+Usage: Call install(agent, dataset, head) to route code execution of an agent to the shared pool.
+"""
+
+import os
+import pickle
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from pandasai.exceptions import NoResultFoundError
+from pandasai.helpers.optional import get_environment
+from pandasai.pipelines.chat.code_execution import CodeExecution
+
+from dataset_store import DatasetRef
+from metrics import sandbox_kills
+from workers import process_context
+
+SANDBOX = os.environ.get('SANDBOX', 'true').lower() in ['1', 'true', 'yes']
+SANDBOX_WORKERS = int(os.environ.get('SANDBOX_WORKERS', 2))
+# Seconds generated code may run, including loading data in a fresh worker
+SANDBOX_TIMEOUT = float(os.environ.get('SANDBOX_TIMEOUT', 30))
+# Private resident memory a worker may use on top of the datasets it holds, above which it is killed
+SANDBOX_MAX_RSS_MB = int(os.environ.get('SANDBOX_MAX_RSS_MB', 1024))
+# Jobs run by a worker before it is replaced
+SANDBOX_MAX_JOBS = int(os.environ.get('SANDBOX_MAX_JOBS', 200))
+# Datasets kept loaded per worker
+SANDBOX_DATASETS = int(os.environ.get('SANDBOX_DATASETS', 2))
+# Seconds between checks of a running job
+POLL_INTERVAL = 0.02
+# Seconds a new worker may take to start, not counted in the time limit of its first job
+STARTUP_TIMEOUT = 120
+
+# Modules imported once by the fork server, so workers, including file parsing ones, start without importing them
+PRELOAD = ['pandas', 'numpy', 'pyarrow', 'matplotlib.pyplot', 'openpyxl', 'sandbox', 'ingest']
+
+
+class SandboxError(Exception):
+    """Raised by generated code in a worker, carrying the worker traceback for the error correction prompt."""
+
+
+class ExecutionAborted(Exception):
+    """Raised when a worker was killed running generated code; not retried with the LLM."""
+
+    # Start of every message, recognizing the error in responses
+    prefix = 'Code execution was stopped'
+    messages = {
+        'timeout': 'after exceeding the {timeout:g} s time limit',
+        'memory': 'after exceeding the {memory} MB memory limit',
+        'crash': 'as its process exited unexpectedly',
+        'busy': 'before starting as all workers stayed busy for {timeout:g} s',
+    }
+
+    def __init__(self, reason: str, timeout: float = SANDBOX_TIMEOUT, memory: int = SANDBOX_MAX_RSS_MB):
+        super().__init__(f'{self.prefix} ' + self.messages[reason].format(timeout=timeout, memory=memory))
+        self.reason = reason
+
+
+def process_rss(pid: int) -> int | None:
+    """Private resident memory of a process in bytes, without shared and file backed pages, or None if unknown."""
+    try:
+        with open(f'/proc/{pid}/statm') as file:
+            fields = file.read().split()
+    except OSError:
+        return None
+    return (int(fields[1]) - int(fields[2])) * os.sysconf('SC_PAGE_SIZE')
+
+
+# PandasAI internals used to route code execution, private in the pinned version, see test_pandasai_internals
+
+def pipeline_steps(agent) -> list:
+    """Stages of the code execution pipeline of an agent, replaceable in place."""
+    return agent.pipeline.code_execution_pipeline._steps
+
+
+def stage_config(stage: CodeExecution):
+    """Agent configuration, set on the stage when it executes."""
+    return stage._config
+
+
+def stage_dfs(stage: CodeExecution) -> list:
+    """Connectors of the agent, set on the stage when it executes."""
+    return stage._dfs
+
+
+def stage_dependencies(stage: CodeExecution) -> list:
+    """Modules the generated code imports, set on the stage when it executes."""
+    return stage._additional_dependencies
+
+
+def uses_data(stage: CodeExecution, code: str) -> bool:
+    """Whether generated code reads the dataframes."""
+    return bool(stage._required_dfs(code))
+
+
+def run_job(job: dict, frames: OrderedDict):
+    """Run generated code of a job in a worker against its dataset, returning the result variable."""
+    key = job['key']
+    if 'df' in job:
+        frames[key] = job['df']
+    elif key not in frames:
+        frames[key] = DatasetRef(key, '', 0, 0, path=job['path']).load(head=job['head'])
+    frames.move_to_end(key)
+    while len(frames) > SANDBOX_DATASETS:
+        frames.popitem(last=False)
+    environment = get_environment(job['dependencies'])
+    environment['dfs'] = []
+    if job['data']:
+        df = frames[key] if job['columns'] is None else frames[key][job['columns']]
+        environment['dfs'] = [df]
+        environment['df'] = df
+    exec(job['code'], environment)
+    if 'result' not in environment:
+        raise NoResultFoundError('No result returned')
+    return environment['result']
+
+
+def format_error(error: Exception) -> str:
+    """Traceback of an error limited to lines of generated code, as the LLM is shown to correct it."""
+    error = traceback.TracebackException.from_exception(error)
+    stack = traceback.StackSummary.from_list([frame for frame in error.stack if frame.filename == '<string>'])
+    return ''.join(['Traceback (most recent call last):\n', *stack.format(), *error.format_exception_only()]).strip()
+
+
+def serve(conn):
+    """Worker loop: run jobs received on the connection and send back ('result', value) or ('error', text)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    frames = OrderedDict()  # dataset key -> DataFrame, most recently used last
+    conn.send(('ready', None))
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            reply = ('result', run_job(job, frames))
+        except Exception as e:
+            reply = ('error', format_error(e))
+        finally:
+            plt.close('all')
+        try:
+            conn.send(reply)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            # Results holding e.g. figures or generators can't be sent, and nothing was written
+            conn.send(('error', format_error(e)))
+
+
+def get_context():
+    """Process start context of workers, with modules preloaded when started from the fork server."""
+    context = process_context()
+    if context.get_start_method() == 'forkserver':
+        context.set_forkserver_preload(PRELOAD)
+    return context
+
+
+class Worker:
+    """Worker process with its connection and the datasets it holds"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=serve, args=(child_conn,), name='sandbox', daemon=True)
+        self.process.start()
+        child_conn.close()
+        # Mirror of the datasets held by the process with their memory, evicted in the same order
+        self.datasets: OrderedDict[str, int] = OrderedDict()
+        self.jobs = 0
+        self.ready = False
+
+    def holds(self, key: str) -> bool:
+        return key in self.datasets
+
+    def run(self, job: dict, timeout: float, max_rss: int):
+        """ Send a job to the process and wait for its result, within limits
+
+            Raises
+            SandboxError: Generated code failed
+            ExecutionAborted: Limit exceeded or process died, the process is then killed
+        """
+        if not self.ready:
+            # Starting may import the main module of the program, which shouldn't count against the code
+            try:
+                self.ready = self.conn.poll(STARTUP_TIMEOUT) and self.conn.recv()[0] == 'ready'
+            except (EOFError, OSError):
+                pass
+            if not self.ready:
+                self.abort('crash', timeout, max_rss)
+        self.conn.send(job)
+        self.jobs += 1
+        key = job['key']
+        self.datasets[key] = job['memory']
+        self.datasets.move_to_end(key)
+        while len(self.datasets) > SANDBOX_DATASETS:
+            self.datasets.popitem(last=False)
+        # Loaded data is copied out of the mapped files, so it counts as private memory of the worker
+        allowed = max_rss + sum(self.datasets.values())
+        deadline = time.monotonic() + timeout
+        while not self.conn.poll(POLL_INTERVAL):
+            if not self.process.is_alive():
+                self.abort('crash', timeout, max_rss)
+            if time.monotonic() > deadline:
+                self.abort('timeout', timeout, max_rss)
+            rss = process_rss(self.process.pid)
+            if rss is not None and rss > allowed:
+                self.abort('memory', timeout, max_rss)
+        try:
+            status, value = self.conn.recv()
+        except (EOFError, OSError):
+            self.abort('crash', timeout, max_rss)
+        if status == 'error':
+            # The dataset may have failed to load, so send it again next time
+            self.datasets.pop(key, None)
+            raise SandboxError(value)
+        return value
+
+    def abort(self, reason: str, timeout: float, max_rss: int):
+        self.kill()
+        sandbox_kills.inc(reason=reason)
+        raise ExecutionAborted(reason, timeout, max_rss // (1024 * 1024))
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class SandboxPool:
+    """Fixed number of worker processes running one job at a time, replaced when killed or worn out"""
+
+    def __init__(self, workers: int = SANDBOX_WORKERS, timeout: float = SANDBOX_TIMEOUT,
+                 max_rss_mb: int = SANDBOX_MAX_RSS_MB, max_jobs: int = SANDBOX_MAX_JOBS):
+        """ Instantiate new pool, starting no process until start() or the first job
+
+            Parameters
+            workers (int): Number of worker processes
+            timeout (float): Seconds a job may run
+            max_rss_mb (int): Private resident memory in MB a worker may use on top of the datasets it holds
+            max_jobs (int): Jobs run by a worker before it is replaced
+        """
+        self.size = workers
+        self.timeout = timeout
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.max_jobs = max_jobs
+        self.idle: list[Worker] = []
+        self.busy = 0
+        self.started = False
+        self.completed = 0
+        self.failed = 0
+        self.killed = 0
+        self.recycled = 0
+        self.affinity_hits = 0
+        self.condition = threading.Condition()
+        self._context = None
+
+    def start(self):
+        """Start worker processes, so the first queries don't wait for them."""
+        with self.condition:
+            if self.started:
+                return
+            self.started = True
+            self._context = get_context()
+            self.idle = [Worker(self._context) for _ in range(self.size)]
+
+    def acquire(self, key: str) -> Worker:
+        """Take an idle worker, preferably one holding the dataset, waiting up to the timeout for one."""
+        self.start()
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            while not self.idle:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ExecutionAborted('busy', timeout=self.timeout)
+                self.condition.wait(remaining)
+            worker = next((worker for worker in reversed(self.idle) if worker.holds(key)), None)
+            if worker is None:
+                worker = self.idle[-1]
+            else:
+                self.affinity_hits += 1
+            self.idle.remove(worker)
+            self.busy += 1
+            return worker
+
+    def release(self, worker: Worker, killed: bool = False):
+        if not killed and worker.jobs >= self.max_jobs:
+            worker.kill()
+            self.recycled += 1
+            killed = True
+        if killed:
+            worker = Worker(self._context)
+        with self.condition:
+            self.busy -= 1
+            if self.started:
+                self.idle.append(worker)
+            else:
+                worker.kill()
+            self.condition.notify()
+
+    def run(self, job: dict, df=None):
+        """ Run generated code in a worker
+
+            Parameters
+            job (dict): Code and dataset of the job, see run_job
+            df (DataFrame): Data held in memory, sent along if the worker doesn't hold it yet
+
+            Returns
+            Value of the result variable set by the code
+
+            Raises
+            SandboxError: Generated code failed
+            ExecutionAborted: Limit exceeded, worker died or none became free in time
+        """
+        worker = self.acquire(job['key'])
+        killed = False
+        try:
+            if df is not None and not worker.holds(job['key']):
+                job = {**job, 'df': df}
+            result = worker.run(job, self.timeout, self.max_rss)
+            self.completed += 1
+            return result
+        except SandboxError:
+            self.failed += 1
+            raise
+        except ExecutionAborted:
+            self.killed += 1
+            killed = True
+            raise
+        finally:
+            self.release(worker, killed or not worker.alive)
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                'workers': self.size,
+                'busy': self.busy,
+                'completed': self.completed,
+                'failed': self.failed,
+                'killed': self.killed,
+                'recycled': self.recycled,
+                'affinity_hits': self.affinity_hits,
+                'timeout': self.timeout,
+                'max_rss_mb': self.max_rss // (1024 * 1024),
+            }
+
+    def shutdown(self):
+        with self.condition:
+            self.started = False
+            workers, self.idle = self.idle, []
+        for worker in workers:
+            worker.kill()
+
+
+pool = SandboxPool()
+
+
+class SandboxedCodeExecution(CodeExecution):
+    """PandasAI code execution stage running the code in the sandbox pool instead of the calling process"""
+
+    def __init__(self, sandbox: SandboxPool, dataset: DatasetRef, head: int | None, connector, **kwargs):
+        """ Instantiate new stage
+
+            Parameters
+            sandbox (SandboxPool): Pool running the code
+            dataset (DatasetRef): Dataset of the agent, loaded by workers from its file when stored
+            head (int): Number of head rows of the dataset given to the agent
+            connector (BaseConnector): Connector of the agent to the whole dataset
+        """
+        super().__init__(**kwargs)
+        self.sandbox = sandbox
+        self.dataset = dataset
+        self.head = head
+        self.connector = connector
+        self.key = f'{dataset.key}:{head or ""}'
+
+    def execute(self, input, **kwargs):
+        config = kwargs['context'].config
+        error_correction = config.use_error_correction_framework
+        try:
+            return super().execute(input, **kwargs)
+        finally:
+            config.use_error_correction_framework = error_correction
+
+    def execute_code(self, code: str, context):
+        config = stage_config(self)
+        dfs = stage_dfs(self)
+        if config.direct_sql or context.skills_manager.used_skills or len(dfs) != 1:
+            # Connections and skills live in this process
+            return super().execute_code(code, context)
+        connector = dfs[0]
+        rows = self.dataset.rows
+        job = {
+            'key': self.key,
+            'path': self.dataset.path,
+            'head': self.head,
+            # Memory of the loaded data, prorated for head rows
+            'memory': self.dataset.memory * min(self.head, rows) // rows if self.head and rows else self.dataset.memory,
+            'code': code,
+            'dependencies': stage_dependencies(self),
+            'data': uses_data(self, code),
+            # Agents on wide data may be given a view on some columns
+            'columns': None if connector is self.connector else list(connector.pandas_df.columns),
+        }
+        try:
+            return self.sandbox.run(job, df=None if self.dataset.path else self.dataset.load(head=self.head))
+        except ExecutionAborted:
+            # Generated code would likely hit the limit again, so don't ask the LLM to correct it
+            config.use_error_correction_framework = False
+            raise
+
+
+def install(agent, dataset: DatasetRef, head: int | None, sandbox: SandboxPool = pool):
+    """Replace the code execution stage of an agent by one running in the sandbox, when enabled."""
+    if not SANDBOX:
+        return
+    steps = pipeline_steps(agent)
+    for index, step in enumerate(steps):
+        if type(step) is CodeExecution:
+            steps[index] = SandboxedCodeExecution(sandbox, dataset, head, agent.context.dfs[0],
+                                                  before_execution=step.before_execution,
+                                                  on_failure=step.on_failure, on_retry=step.on_retry)
@@ -3,25 +3,45 @@ FastAPI app to serve public REST API to connect frontend clients to the core LLM
 
 Usage: run with uvicorn, sharing SERVER_URL in .env for clients to use
 """
+import asyncio
 import codecs
+import json
 import os
 import random
 import re
+import shutil
 import string
+import tempfile
+import time
 import traceback
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from pydantic import BaseModel
 import pandas as pd
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, Response, UploadFile, HTTPException
+from fastapi import FastAPI, Request, Response, UploadFile, HTTPException
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-
-from asr import DecodeResult, DecodeConfig
-from main import create_session, new_session, get_session_by_token, Session, ModelName
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+
+from artifacts import PUBLIC_DIR, MEDIA_DIR, reaper
+
+from asr import DecodeResult, DecodeConfig, HEAD_SECONDS, get_batch_stats, get_transcript_cache_stats, segment_value
+from ingest import ingest_report, check_limits, IngestLimitExceeded, INGEST_MAX_ROWS, INGEST_MAX_BYTES
+from main import create_session, new_session, get_session_by_token, get_session_stats, get_response_cache_stats, \
+    get_code_cache_stats, Session, ModelName
+from jobs import jobs, Job, TooManyJobs
+from results import results, RESULT_PAGE_ROWS, FORMATS as RESULT_FORMATS, pa
+from subtitles import FORMATS as SUBTITLE_FORMATS
+from transcript import dumps
+from metrics import span, start_request, request_seconds, format_server_timing, render as render_metrics
+from sandbox import SANDBOX, pool as sandbox
+from workers import llm_pool, asr_pool, parse_pool, PoolSaturated, SessionBusy, get_pool_stats, shutdown_pools
 
 root_path = os.path.dirname(os.path.realpath(__file__))
 # root_path = os.path.abspath(os.path.dirname(__file__))
@@ -35,8 +55,38 @@ load_dotenv(dotenv_path=os.path.join(root_path, ".env.production") if production
 
 SERVER_URL = os.environ.get('SERVER_URL')
 FRONTEND_URL = os.environ.get('FRONTEND_URL')
+# Add Server-Timing header with span durations to every response, e.g. for browser dev tools
+TIMING_HEADER = os.environ.get('TIMING_HEADER', '').lower() in ('1', 'true', 'yes')
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    reaper.start()
+    if SANDBOX:
+        sandbox.start()
+    parse_pool.warm()
+    yield
+    reaper.stop()
+    sandbox.shutdown()
+    shutdown_pools()
+
+
+api = FastAPI(lifespan=lifespan)
+
+
+@api.exception_handler(PoolSaturated)
+def on_pool_saturated(_request, e: PoolSaturated):
+    return JSONResponse({'detail': str(e)}, status_code=503, headers={'Retry-After': '5'})
+
+
+@api.exception_handler(SessionBusy)
+def on_session_busy(_request, e: SessionBusy):
+    return JSONResponse({'detail': str(e)}, status_code=429, headers={'Retry-After': '1'})
+
 
-api = FastAPI()
+@api.exception_handler(TooManyJobs)
+def on_too_many_jobs(_request, e: TooManyJobs):
+    return JSONResponse({'detail': str(e)}, status_code=429, headers={'Retry-After': '5'})
 
 # CORS required for cross-domain client connection
 # Restrict origins to minimum for security
@@ -48,22 +98,45 @@ api.add_middleware(
     allow_headers=['*'],
 )
 
+
+class ArtifactFiles(StaticFiles):
+    """Static files whose names identify their content, so clients can cache them for good"""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        # Charts are named after their content hash, and uploaded media after a random name used once
+        response.headers['etag'] = f'"{Path(full_path).stem}"'
+        response.headers['cache-control'] = 'public, max-age=31536000, immutable'
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
 # Mount public folder, mainly for exposing images generated by the LLM engine
 api.mount(
-    '/public', StaticFiles(directory=os.path.join(root_path, 'public')), name='static'
+    '/public', ArtifactFiles(directory=PUBLIC_DIR), name='static'
 )
 api.mount(
-    '/media', StaticFiles(directory=os.path.join(root_path, 'media')), name='media'
+    '/media', ArtifactFiles(directory=MEDIA_DIR), name='media'
 )
 
 require_session = True
 
 
-# @api.middleware("http")
-# async def middleware(request: Request, call_next):
-#     response: Response = await call_next(request)
-#     print('Response', vars(response))
-#     return response
+@api.middleware('http')
+async def trace_request(request: Request, call_next):
+    """Time every request by route template and status, collecting spans run on its behalf."""
+    timings = start_request()
+    start = time.perf_counter()
+    response: Response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get('route')
+    # Label by path template rather than actual path to keep the number of series bounded
+    path = route.path if route is not None else 'unmatched'
+    request_seconds.observe(elapsed, method=request.method, route=path, status=response.status_code)
+    if TIMING_HEADER:
+        response.headers['Server-Timing'] = format_server_timing(timings + [('total', elapsed)])
+    return response
 
 
 @api.get('/')
@@ -71,6 +144,21 @@ def about():
     return {'app': "Son's Data Chat API App"}
 
 
+@api.get('/metrics')
+def get_metrics():
+    """Expose latency histograms and usage counters in Prometheus text format."""
+    return Response(render_metrics(), media_type='text/plain; version=0.0.4')
+
+
+@api.get('/stats')
+def get_stats():
+    """Report usage counters of server side caches and registries."""
+    return {'sessions': get_session_stats(), 'responses': get_response_cache_stats(),
+            'codes': get_code_cache_stats(), 'pools': get_pool_stats(), 'asr': get_batch_stats(),
+            'transcripts': get_transcript_cache_stats(), 'jobs': jobs.stats(), 'results': results.stats(),
+            'artifacts': reaper.stats(), 'sandbox': sandbox.stats()}
+
+
 class SessionResponse(BaseModel):
     token: str
 
@@ -110,7 +198,8 @@ async def set_model(model: str, token: str) -> SetModelResponse:
     See corresponding session method for details.
     """
     session = get_session(token)
-    session.set_model(ModelName.openai if model == 'openai' else ModelName.bamboo)
+    await llm_pool.run(session.set_model, ModelName.openai if model == 'openai' else ModelName.bamboo,
+                       key=(session.token, 'agent'))
     print('Switched model to:', model)
     return SetModelResponse(model=model)
 
@@ -123,8 +212,19 @@ def generate_filename(extension: str) -> str:
     )
 
 
+class FileReport(BaseModel):
+    name: str
+    datasets: int
+    rows: int
+    seconds: float
+    error: str | None = None
+
+
 class UploadResponse(BaseModel):
     rows: list[int]
+    memory: list[int]
+    names: list[str]
+    files: list[FileReport]
     selectedIndex: int
 
 
@@ -138,43 +238,88 @@ class MediaDecodeResponse(BaseModel):
     result: DecodeResult
 
 
+def spool_upload(file: UploadFile, extension: str) -> str:
+    """Internal function to copy an upload in blocks to a temporary file, returning its path."""
+    file.file.seek(0)
+    with tempfile.NamedTemporaryFile('wb', suffix=f'.{extension}', delete=False) as out_file:
+        shutil.copyfileobj(file.file, out_file, 1024 * 1024)
+    return out_file.name
+
+
+async def parse_upload(file: UploadFile, extension: str, head: int | None) -> dict:
+    """Internal function to parse an uploaded datasheet in the parse pool, returning its ingestion report."""
+    if not parse_pool.processes:
+        return await parse_pool.run(ingest_report, file.file, extension, file.filename, head)
+    # Process workers can't share the spooled upload file, so hand them a copy on disk to read in chunks,
+    # rather than its content which would be held in memory here and pickled to the worker
+    path = await asyncio.to_thread(spool_upload, file, extension)
+    try:
+        return await parse_pool.run(ingest_report, path, extension, file.filename, head)
+    finally:
+        os.remove(path)
+
+
 @api.post('/data/input')
-async def upload_files(files: list[UploadFile], token: str) -> UploadResponse | MediaUploadResponse:
+async def upload_files(files: list[UploadFile], token: str,
+                       head: int | None = None) -> UploadResponse | MediaUploadResponse:
     """Upload files as data input
 
     Upload files, read data from files and set it as current dataset
+    Files are parsed in parallel, and every sheet of workbooks becomes a dataset of its own
+    If head is given, only that number of first rows is read from each file or sheet
+    Reports number of rows, memory footprint in bytes and name of each dataset,
+    and parsing time and error of each file; files failing to parse are left out
     """
     session = get_session(token)
-    rows = []
-    dfs = []
-    try:
-        for file in files:
-            extension = os.path.splitext(file.filename)[1][1:].lower()
-            if extension not in ['csv', 'xlsx', 'mp3', 'wav', 'mp4', 'mpeg', 'webm']:
-                raise HTTPException(
-                    status_code=400, detail='Input file must be datasheet or media'
-                )
-            if extension not in ['csv', 'xlsx']:
-                out_filename = generate_filename(extension)
-                out_path = f'{root_path}/media/{out_filename}'
-                with open(out_path, "wb+") as out_file:
-                    # shutil.copyfileobj(file.file, out_file)
-                    out_file.write(file.file.read())
-                media = session.add_media(file.filename, out_path)
-                # if result.info is not None and math.isinf(result.info.vad_options.max_speech_duration_s):
-                #     result.info.vad_options.max_speech_duration_s = 0
-                return MediaUploadResponse(
-                    type=media.type, url=f'{SERVER_URL}/media/{out_filename}', result=media.result)
-
-            df = (
-                pd.read_csv(file.file)
-                if extension == 'csv'
-                else pd.read_excel(file.file)
+    sheets = []
+    for file in files:
+        extension = os.path.splitext(file.filename)[1][1:].lower()
+        if extension not in ['csv', 'xlsx', 'mp3', 'wav', 'mp4', 'mpeg', 'webm']:
+            raise HTTPException(
+                status_code=400, detail='Input file must be datasheet or media'
             )
-            dfs.append(df)
-            rows.append(len(df.index))
-        session.set_data(dfs)
-        return UploadResponse(rows=rows, selectedIndex=0)
+        if extension in ['csv', 'xlsx']:
+            sheets.append((file, extension))
+            continue
+        out_filename = generate_filename(extension)
+        out_path = os.path.join(MEDIA_DIR, out_filename)
+        with open(out_path, "wb+") as out_file:
+            # shutil.copyfileobj(file.file, out_file)
+            out_file.write(await file.read())
+        media = await asr_pool.run(session.add_media, file.filename, out_path, key=(session.token, 'media'))
+        # if result.info is not None and math.isinf(result.info.vad_options.max_speech_duration_s):
+        #     result.info.vad_options.max_speech_duration_s = 0
+        return MediaUploadResponse(
+            type=media.type, url=f'{SERVER_URL}/media/{out_filename}', result=media.result)
+    try:
+        with span('upload_parse'):
+            reports = await asyncio.gather(*[parse_upload(file, extension, head) for file, extension in sheets])
+        datasets = []
+        for report in reports:
+            if report['error'] is None:
+                try:
+                    # Limits apply to the whole batch as it replaces the session data, filled in upload order
+                    check_limits(sum(ref.rows for ref in datasets + report['datasets']),
+                                 sum(ref.memory for ref in datasets + report['datasets']),
+                                 None if head else INGEST_MAX_ROWS, INGEST_MAX_BYTES)
+                    datasets.extend(report['datasets'])
+                except IngestLimitExceeded as e:
+                    report.update(datasets=[], error=str(e), status=413)
+            if report['error'] is not None:
+                print(f'Failed to ingest {report["name"]}:', report['error'])
+        if not datasets:
+            raise HTTPException(status_code=max(report['status'] for report in reports),
+                                detail='; '.join(f'{report["name"]}: {report["error"]}' for report in reports))
+        await llm_pool.run(session.set_data, datasets, key=(session.token, 'agent'))
+        return UploadResponse(
+            rows=[ref.rows for ref in datasets], memory=[ref.memory for ref in datasets],
+            names=[ref.name for ref in datasets],
+            files=[FileReport(name=report['name'], datasets=len(report['datasets']),
+                              rows=sum(ref.rows for ref in report['datasets']), seconds=report['seconds'],
+                              error=report['error']) for report in reports],
+            selectedIndex=0)
+    except (HTTPException, PoolSaturated, SessionBusy):
+        raise
     except (IOError, Exception) as e:
         raise HTTPException(status_code=500, detail=repr(e))
 
@@ -187,28 +332,129 @@ class TranscribeResponse(BaseModel):
     result: object
 
 
+def transcribe_response(result: DecodeResult, offset: int = 0, limit: int | None = None) -> Response:
+    """Internal function to serialize a decode result with a page of its segments, bypassing model validation."""
+    return Response(dumps({'result': result.page(offset, limit)}), media_type='application/json')
+
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    progress: float
+    created: float
+    finished: float | None = None
+    error: str | None = None
+
+
+async def start_job(kind: str, token: str, start) -> JobResponse:
+    """Internal function to register a job and start its work, given a coroutine function taking the job."""
+    job = jobs.create(kind, token)
+    try:
+        job.attach(await start(job))
+    except BaseException:
+        jobs.discard(job.id)
+        raise
+    return JobResponse(**job.info())
+
+
 @api.post('/transcribe')
-async def get_transcribe(token: str, config: DecodeConfig) -> TranscribeResponse:
+async def get_transcribe(token: str, config: DecodeConfig, job: bool = False, offset: int = 0,
+                         limit: int | None = None) -> TranscribeResponse | JobResponse:
+    """Transcribe or translate current media
+
+    Result includes limit segments from offset, all if limit is not given, and total_segments to page through the rest.
+    If job is true, respond at once with a job to poll at /jobs/{id}, whose progress is the share of media decoded.
+    """
     session = get_session(token)
     print(config)
+    if job:
+        media = session.current_media
+        if not media:
+            raise HTTPException(status_code=400, detail='No media uploaded')
+        duration = min(media.result.duration, HEAD_SECONDS) if config.limit == 'head' else media.result.duration
+
+        def start(transcription: Job):
+            def on_segment(segment):
+                transcription.set_progress(segment_value(segment, 'end') / duration * 100 if duration else 0)
+
+            def run():
+                transcription.set_progress(0)
+                return session.get_transcribe_response(config, on_segment).result
+
+            return asr_pool.start(run, key=(session.token, 'media'))
+
+        return await start_job('transcribe', session.token, start)
     try:
-        media = session.get_transcribe_response(config)
-        return TranscribeResponse(result=media.result)
+        media = await asr_pool.run(session.get_transcribe_response, config, key=(session.token, 'media'))
+        return transcribe_response(media.result, offset, limit)
+    except (PoolSaturated, SessionBusy):
+        raise
     except (ValueError, Exception) as e:
         print('Transcribe error', traceback.format_exc())
         raise HTTPException(status_code=500, detail=f'{repr_error(e)}')
 
 
+@api.get('/transcript')
+def get_transcript(token: str, offset: int = 0, limit: int | None = None) -> TranscribeResponse:
+    """Fetch a page of segments of the last decoded result of current media"""
+    session = get_session(token)
+    media = session.current_media
+    if not media or not media.result or not media.result.decoded:
+        raise HTTPException(status_code=404, detail='Media is not transcribed yet')
+    return transcribe_response(media.result, offset, limit)
+
+
+@api.post('/transcribe/stream')
+async def stream_transcribe(token: str, config: DecodeConfig):
+    """Transcribe current media, streaming segments as server-sent events while decoding continues
+
+    Events: 'info' with language and duration, 'segment' for each decoded segment in order,
+    then 'result' with the decoding summary without segments, or 'error', and finally 'done'.
+    """
+    session = get_session(token)
+    if not session.current_media:
+        raise HTTPException(status_code=400, detail='No media uploaded')
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_segment(segment):
+        loop.call_soon_threadsafe(events.put_nowait, segment)
+
+    info = session.current_media.result
+    future = await asr_pool.start(session.get_transcribe_response, config, on_segment, key=(session.token, 'media'))
+    future.add_done_callback(lambda _: events.put_nowait(None))
+
+    async def generate():
+        yield format_event('info', {'lang': info.lang, 'language': info.language, 'duration': info.duration})
+        while (segment := await events.get()) is not None:
+            yield format_event('segment', jsonable_encoder(segment))
+        try:
+            media = future.result()
+        except Exception as e:
+            print('Transcribe error', traceback.format_exc())
+            yield format_event('error', {'detail': repr_error(e)})
+        else:
+            yield format_event('result', media.result.model_dump())
+        yield format_event('done', {})
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @api.get("/srt")
-async def download_srt(token: str):
+async def download_srt(token: str, format: str = 'srt', max_chars: int | None = None, max_cps: float | None = None):
+    """Download subtitles of current media as SRT, WebVTT (vtt) or word level JSON (json)
+
+    Cues are re-segmented from word timestamps to lines of at most max_chars if given,
+    and extended to be read at no more than max_cps characters per second if given.
+    """
     session = get_session(token)
+    if format not in SUBTITLE_FORMATS:
+        raise HTTPException(status_code=400, detail=f'Subtitle format must be one of {", ".join(SUBTITLE_FORMATS)}')
     try:
-        srt, filename = session.get_srt()
-        # out_filename = generate_filename('srt')
-        # out_path = f'{root_path}/media/{filename}'
-        # with codecs.open(out_path, "w", "utf-8") as f:
-        #     f.write(srt)
-        return Response(srt, media_type='text/plain', headers={
+        chunks, filename = session.get_subtitles(format, max_chars, max_cps)
+        return StreamingResponse(chunks, media_type=SUBTITLE_FORMATS[format], headers={
             "Content-Disposition": f"attachment; filename={filename}"
         })
     except (ValueError, Exception) as e:
@@ -227,7 +473,7 @@ async def select_data(index: int, head: int, token: str) -> SetDataResponse:
     See corresponding session method for details.
     """
     session = get_session(token)
-    session.select_data(index, head)
+    await llm_pool.run(session.select_data, index, head, key=(session.token, 'agent'))
     return SetDataResponse(selectedIndex=index)
 
 
@@ -235,45 +481,239 @@ class QueryInput(BaseModel):
     query: str
 
 
+class ColumnInfo(BaseModel):
+    name: str
+    dtype: str
+
+
+class ResultInfo(BaseModel):
+    id: str
+    columns: list[ColumnInfo]
+    rows: int
+    page_rows: int
+
+
+class PromptInfo(BaseModel):
+    columns: int
+    total_columns: int
+    tokens: int
+    full_tokens: int
+
+
 class QueryResponse(BaseModel):
     answer: str
     type: str
     html: bool
+    result: ResultInfo | None = None
+    # Path that served the answer: 'fastpath', 'response_cache', 'code_cache', 'llm' or 'security'
+    source: str | None = None
+    # Columns and tokens of the prompt sent to the LLM, against those of a prompt with all columns
+    prompt: PromptInfo | None = None
 
 
 def render_image(path):
     """Internal function to render image output from LLM as HTML img tag using the mounted URL."""
-    file = Path(path)
-    if file.is_file():
-        public_url = f'{SERVER_URL}/public/{file.name}'
-        return public_url
+    # Charts are stored under the public folder by the session, no need to check the file again
+    return f'{SERVER_URL}/public/{Path(os.path.relpath(path, PUBLIC_DIR)).as_posix()}'
 
 
 def render_answer(answer) -> (str, str):
     """Internal function to render answer output according to detected format."""
     t = type(answer)
     if t is str:
-        if re.search(r'\.(png|jpe?g)$', answer, re.IGNORECASE):
+        if re.search(r'\.(png|jpe?g|webp)$', answer, re.IGNORECASE):
             return str(
                 f'<img src="{render_image(answer)}" alt="See image for answer">'
             ), 'html'
     elif t is pd.DataFrame:
-        return answer.to_html(), 'html'
+        return answer.head(RESULT_PAGE_ROWS).to_html(), 'html'
     return str(answer), 'text'
 
 
+def query_response(answer, token: str, source: str | None = None, prompt: dict | None = None) -> QueryResponse:
+    """Internal function to respond with an answer, keeping DataFrames server-side and rendering their first page."""
+    prompt = PromptInfo(**prompt) if prompt else None
+    if isinstance(answer, pd.DataFrame):
+        result = results.put(answer, token)
+        return QueryResponse(answer=result.to_html(), type=type(answer).__name__, html=True,
+                             result=ResultInfo(**result.describe()), source=source, prompt=prompt)
+    text, sformat = render_answer(answer)
+    return QueryResponse(answer=text, type=type(answer).__name__, html=sformat == 'html', source=source,
+                         prompt=prompt)
+
+
+def answer_query(session: Session, query: str, on_progress=None) -> (object, dict):
+    """Internal function to answer a query along with how it was served, run in the pool under the session key."""
+    answer = session.get_chat_response(query, on_progress)
+    return answer, {'source': session.last_source, 'prompt': session.last_prompt_size}
+
+
+# Progress of query jobs reaching each stage reported by the session
+QUERY_PROGRESS = {'fastpath': 90, 'cache': 50, 'prompt': 10, 'code': 50, 'executing': 70, 'result': 90}
+
+
 @api.post('/query')
-async def post_query(query: QueryInput, token: str) -> QueryResponse:
+async def post_query(query: QueryInput, token: str, job: bool = False) -> QueryResponse | JobResponse:
     """Query current LLM model with user prompt
 
     See corresponding session method for details.
+    Simple questions (row count, columns, statistics of a column...) are answered without the LLM,
+    and the response tells the path that served the answer in source.
+    On data with many columns, only those relevant to the prompt are sent to the LLM, as reported in prompt.
+    If job is true, respond at once with a job to poll at /jobs/{id}, for long running analyses.
     """
     session = get_session(token)
+    if job:
+        def start(analysis: Job):
+            def on_progress(stage: str, _data: dict):
+                analysis.set_progress(QUERY_PROGRESS.get(stage, analysis.progress))
+
+            def run():
+                analysis.set_progress(0)
+                answer, served = answer_query(session, query.query, on_progress)
+                return query_response(answer, session.token, **served)
+
+            return llm_pool.start(run, key=(session.token, 'agent'))
+
+        return await start_job('query', session.token, start)
     try:
-        resp = session.get_chat_response(query.query)
-        t = type(resp)
-        answer, sformat = render_answer(resp)
-        return QueryResponse(answer=answer, type=t.__name__, html=sformat == 'html')
+        resp, served = await llm_pool.run(answer_query, session, query.query, key=(session.token, 'agent'))
+        return query_response(resp, session.token, **served)
+    except (PoolSaturated, SessionBusy):
+        raise
     except (ValueError, Exception) as e:
         print('Query response error', e)
         raise HTTPException(status_code=500, detail=f'System error: {repr(e)}')
+
+
+def get_job(job_id: str, token: str) -> Job:
+    """Internal function to get a job of the calling session."""
+    session = get_session(token)
+    job = jobs.get(job_id, session.token)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Unknown or expired job')
+    return job
+
+
+@api.get('/jobs/{job_id}')
+def get_job_status(job_id: str, token: str) -> JobResponse:
+    """Report status (queued, running, done, failed, cancelled) and progress percentage of a job"""
+    return JobResponse(**get_job(job_id, token).info())
+
+
+@api.delete('/jobs/{job_id}')
+def cancel_job(job_id: str, token: str) -> JobResponse:
+    """Cancel a job, at once if still queued, otherwise as soon as its work reports progress"""
+    job = get_job(job_id, token)
+    job.cancel()
+    return JobResponse(**job.info())
+
+
+@api.get('/jobs/{job_id}/result')
+def get_job_result(job_id: str, token: str, offset: int = 0,
+                   limit: int | None = None) -> TranscribeResponse | QueryResponse:
+    """Fetch result of a finished job, in the same format as the corresponding endpoint, paged for transcriptions"""
+    job = get_job(job_id, token)
+    if job.status == 'failed':
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status == 'cancelled':
+        raise HTTPException(status_code=410, detail='Job was cancelled')
+    if job.status != 'done':
+        raise HTTPException(status_code=409, detail=f'Job is {job.status}')
+    if job.kind == 'transcribe':
+        return transcribe_response(job.result, offset, limit)
+    return job.result
+
+
+@api.get('/results/{result_id}')
+def get_result(result_id: str, token: str, offset: int = 0, limit: int | None = None, format: str = 'json'):
+    """Fetch rows of a DataFrame answer kept server-side, as returned by /query with its result ID
+
+    Formats: 'json' for rows as arrays of values, 'html' for a table, both limited to a page of limit rows,
+    or 'arrow' (Arrow IPC stream) and 'csv' streaming all rows from offset unless limit is given.
+    """
+    session = get_session(token)
+    result = results.get(result_id, session.token)
+    if result is None:
+        raise HTTPException(status_code=404, detail='Unknown or expired result')
+    if format not in RESULT_FORMATS:
+        raise HTTPException(status_code=400, detail=f'Result format must be one of {", ".join(RESULT_FORMATS)}')
+    media_type = RESULT_FORMATS[format]
+    if format == 'json':
+        return Response(result.to_json(offset, limit or RESULT_PAGE_ROWS), media_type=media_type)
+    if format == 'html':
+        return Response(result.to_html(offset, limit or RESULT_PAGE_ROWS), media_type=media_type)
+    if format == 'csv':
+        return StreamingResponse(result.iter_csv(offset, limit), media_type=media_type, headers={
+            'Content-Disposition': f'attachment; filename={result_id}.csv'
+        })
+    if pa is None:
+        raise HTTPException(status_code=501, detail='Arrow format is not available')
+    return StreamingResponse(result.iter_arrow(offset, limit), media_type=media_type)
+
+
+# Number of DataFrame rows sent per event when streaming answers
+STREAM_CHUNK_ROWS = 500
+
+
+def format_event(event: str, data) -> str:
+    """Internal function to format a server-sent event, encoding data as JSON unless already encoded."""
+    payload = data if isinstance(data, str) else json.dumps(data)
+    return f'event: {event}\ndata: {payload}\n\n'
+
+
+def stream_answer(answer, token: str, source: str | None = None, prompt: dict | None = None):
+    """Internal generator of events rendering an answer, sending DataFrames in chunks of rows."""
+    if isinstance(answer, pd.DataFrame):
+        # Also kept server-side, so clients can fetch rows again in other formats
+        result = results.put(answer, token)
+        answer = result.df
+        yield format_event('columns', {'columns': [str(column) for column in answer.columns],
+                                       'rows': len(answer.index), 'type': 'DataFrame', 'id': result.id,
+                                       'source': source, 'prompt': prompt})
+        for start in range(0, len(answer.index), STREAM_CHUNK_ROWS):
+            chunk = answer.iloc[start:start + STREAM_CHUNK_ROWS]
+            yield format_event('rows', chunk.to_json(orient='values', date_format='iso'))
+    else:
+        text, sformat = render_answer(answer)
+        yield format_event('answer', {'answer': text, 'type': type(answer).__name__, 'html': sformat == 'html',
+                                      'source': source, 'prompt': prompt})
+
+
+@api.post('/query/stream')
+async def stream_query(query: QueryInput, token: str):
+    """Query current LLM model with user prompt, streaming progress and answer as server-sent events
+
+    Events: 'progress' with a stage (started, fastpath, cache, prompt, code, executing, result),
+    then either 'answer' or 'columns' followed by 'rows' chunks for DataFrames, or 'error', and finally 'done'.
+    Answer and columns events tell the path that served the answer in 'source' and the prompt size in 'prompt',
+    as in /query responses.
+    """
+    session = get_session(token)
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_progress(stage: str, data: dict):
+        loop.call_soon_threadsafe(events.put_nowait, (stage, data))
+
+    # Start before responding so busy pools or sessions still fail with a proper status code
+    future = await llm_pool.start(answer_query, session, query.query, on_progress, key=(session.token, 'agent'))
+    future.add_done_callback(lambda _: events.put_nowait(None))
+
+    async def generate():
+        yield format_event('progress', {'stage': 'started'})
+        while (event := await events.get()) is not None:
+            stage, data = event
+            yield format_event('progress', {'stage': stage, **data})
+        try:
+            answer, served = future.result()
+        except Exception as e:
+            print('Query response error', e)
+            yield format_event('error', {'detail': f'System error: {repr(e)}'})
+        else:
+            for chunk in stream_answer(answer, session.token, **served):
+                yield chunk
+        yield format_event('done', {})
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,179 @@
+"""
+Session state backends, so any worker process can serve any session
+
+    - Sessions persist their state: model, references to stored datasets, data selection, media and conversation
+    - Live objects (agents, loaded data, decoded media) stay in each worker and are rebuilt from the state on demand
+    - MemoryBackend keeps states in the process, for a single worker or the Streamlit app
+    - SQLiteBackend keeps states in a database file shared by workers on the same host, surviving restarts
+    - Every save bumps the state version, which tells workers holding a session that it changed elsewhere
+
+Usage: Select the backend with SESSION_BACKEND ('memory' or 'sqlite') and SESSION_DB, then use get_backend().
+"""
+
+import json
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory').lower()
+SESSION_DB = os.environ.get('SESSION_DB', os.path.join(root_path, 'data', 'sessions.db'))
+# Seconds a stored state may stay untouched before expiring, shared with the session registry
+SESSION_TTL = float(os.environ.get('SESSION_TTL', 60 * 60))
+# Seconds between refreshes of the last access time, to spare writes on every request
+TOUCH_INTERVAL = 60
+
+
+class SessionBackend(ABC):
+    """Store of session states by token, expiring states left untouched for the TTL"""
+
+    def __init__(self, ttl: float | None = SESSION_TTL):
+        self.ttl = ttl
+
+    @abstractmethod
+    def load(self, token: str) -> dict | None:
+        """Return the state of a session and refresh its last access time, or None if unknown or expired."""
+
+    @abstractmethod
+    def save(self, token: str, state: dict) -> int:
+        """Store the state of a session, returning its new version."""
+
+    def version(self, token: str) -> int | None:
+        """Return the current version of a session state, refreshing its last access time, or None if unknown."""
+        state = self.load(token)
+        return None if state is None else state['version']
+
+    @abstractmethod
+    def delete(self, token: str):
+        pass
+
+    @abstractmethod
+    def stats(self) -> dict:
+        pass
+
+
+class MemoryBackend(SessionBackend):
+    """States kept in process memory, lost on restart and invisible to other workers"""
+
+    def __init__(self, ttl: float | None = SESSION_TTL):
+        super().__init__(ttl)
+        self.states: dict[str, tuple[dict, float]] = {}  # token -> (state, last access)
+        self.swept = 0.0
+        self.lock = threading.Lock()
+
+    def load(self, token: str) -> dict | None:
+        now = time.time()
+        with self.lock:
+            entry = self.states.get(token)
+            if entry is None:
+                return None
+            if self.ttl is not None and now - entry[1] > self.ttl:
+                del self.states[token]
+                return None
+            self.states[token] = (entry[0], now)
+            return entry[0]
+
+    def save(self, token: str, state: dict) -> int:
+        now = time.time()
+        with self.lock:
+            entry = self.states.get(token)
+            version = entry[0]['version'] + 1 if entry is not None else 1
+            self.states[token] = ({**state, 'version': version}, now)
+            if self.ttl is not None and now - self.swept > TOUCH_INTERVAL:
+                self.swept = now
+                for expired in [key for key, (_, accessed) in self.states.items() if now - accessed > self.ttl]:
+                    del self.states[expired]
+        return version
+
+    def delete(self, token: str):
+        with self.lock:
+            self.states.pop(token, None)
+
+    def stats(self) -> dict:
+        return {'backend': 'memory', 'size': len(self.states)}
+
+
+class SQLiteBackend(SessionBackend):
+    """States kept as JSON in a SQLite database, shared by all workers opening the same file"""
+
+    def __init__(self, path: str = SESSION_DB, ttl: float | None = SESSION_TTL):
+        super().__init__(ttl)
+        self.path = path
+        self.local = threading.local()
+        with self.connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS sessions '
+                       '(token TEXT PRIMARY KEY, state TEXT NOT NULL, version INTEGER NOT NULL, accessed REAL NOT NULL)')
+            # Expired states are deleted on every save
+            db.execute('CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed)')
+
+    def connect(self) -> sqlite3.Connection:
+        """Return the connection of the calling thread, opening it on first use."""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=10)
+            # Readers don't block the writer nor each other across processes
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return db
+
+    def expired(self, accessed: float, now: float) -> bool:
+        return self.ttl is not None and now - accessed > self.ttl
+
+    def load(self, token: str) -> dict | None:
+        now = time.time()
+        with self.connect() as db:
+            row = db.execute('SELECT state, version, accessed FROM sessions WHERE token = ?', (token,)).fetchone()
+            if row is None or self.expired(row[2], now):
+                return None
+            if now - row[2] > TOUCH_INTERVAL:
+                db.execute('UPDATE sessions SET accessed = ? WHERE token = ?', (now, token))
+        return {**json.loads(row[0]), 'version': row[1]}
+
+    def version(self, token: str) -> int | None:
+        now = time.time()
+        with self.connect() as db:
+            row = db.execute('SELECT version, accessed FROM sessions WHERE token = ?', (token,)).fetchone()
+            if row is None or self.expired(row[1], now):
+                return None
+            # Sessions may be used for long without loading their state again
+            if now - row[1] > TOUCH_INTERVAL:
+                db.execute('UPDATE sessions SET accessed = ? WHERE token = ?', (now, token))
+        return row[0]
+
+    def save(self, token: str, state: dict) -> int:
+        now = time.time()
+        state = json.dumps({key: value for key, value in state.items() if key != 'version'})
+        with self.connect() as db:
+            row = db.execute('INSERT INTO sessions (token, state, version, accessed) VALUES (?, ?, 1, ?) '
+                             'ON CONFLICT (token) DO UPDATE SET state = excluded.state, '
+                             'version = version + 1, accessed = excluded.accessed RETURNING version',
+                             (token, state, now)).fetchone()
+            if self.ttl is not None:
+                db.execute('DELETE FROM sessions WHERE accessed < ?', (now - self.ttl,))
+        return row[0]
+
+    def delete(self, token: str):
+        with self.connect() as db:
+            db.execute('DELETE FROM sessions WHERE token = ?', (token,))
+
+    def stats(self) -> dict:
+        count = self.connect().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        return {'backend': 'sqlite', 'size': count}
+
+
+def get_backend(name: str = SESSION_BACKEND) -> SessionBackend:
+    """ Instantiate configured backend
+
+        Raises
+        ValueError: Unknown backend name
+    """
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'sqlite':
+        return SQLiteBackend()
+    raise ValueError(f'Unknown session backend {name}')
@@ -0,0 +1,167 @@
+"""
+Subtitle export of decoded segments
+
+    - Stream SRT, WebVTT and word level JSON cue by cue, in time linear in the number of segments
+    - Optionally re-segment cues from word timestamps to limit line length, cue duration and reading speed
+
+Usage: Iterate export(segments, format) into a streaming response, or join it for a whole file.
+"""
+
+import json
+from typing import Iterable, Iterator, NamedTuple
+
+FORMATS = {'srt': 'application/x-subrip', 'vtt': 'text/vtt', 'json': 'application/json'}
+
+# Common subtitling guidelines: cues of at most 2 lines, shown at most 7 seconds
+MAX_LINES = 2
+MAX_DURATION = 7.0
+
+
+class Cue(NamedTuple):
+    start: float
+    end: float
+    text: str
+
+
+def get(item, name: str):
+    """Read a field of a segment or word, which are dicts with the whisper engine and objects otherwise."""
+    return item[name] if isinstance(item, dict) else getattr(item, name)
+
+
+def format_timestamp(seconds: float, separator: str = ',') -> str:
+    """Format seconds as HH:MM:SS,mmm, or with '.' before milliseconds for WebVTT."""
+    milliseconds = max(0, round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}'
+
+
+def wrap(text: str, max_chars: int | None) -> str:
+    """Break text into lines of at most max_chars characters at word boundaries, where possible."""
+    if not max_chars or len(text) <= max_chars:
+        return text
+    lines = []
+    line = ''
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > max_chars:
+            lines.append(line)
+            line = word
+        else:
+            line = f'{line} {word}' if line else word
+    lines.append(line)
+    return '\n'.join(lines)
+
+
+def split_words(segments: Iterable, max_chars: int, max_duration: float = MAX_DURATION) -> Iterator[Cue]:
+    """Group words into cues fitting MAX_LINES lines of max_chars and max_duration, keeping segments without words."""
+    max_length = max_chars * MAX_LINES
+    for segment in segments:
+        words = get(segment, 'words')
+        if not words:
+            yield Cue(get(segment, 'start'), get(segment, 'end'), get(segment, 'text').strip())
+            continue
+        parts = []
+        length = 0
+        start = end = None
+        for word in words:
+            text = get(word, 'word').strip()
+            if not text:
+                continue
+            if parts and (length + 1 + len(text) > max_length or get(word, 'end') - start > max_duration):
+                yield Cue(start, end, ' '.join(parts))
+                parts = []
+                length = 0
+            if not parts:
+                start = get(word, 'start')
+                length = len(text)
+            else:
+                length += 1 + len(text)
+            parts.append(text)
+            end = get(word, 'end')
+        if parts:
+            yield Cue(start, end, ' '.join(parts))
+
+
+def limit_reading_speed(cues: Iterable[Cue], max_cps: float) -> Iterator[Cue]:
+    """Extend cues read faster than max_cps characters per second, into the gap before the next cue."""
+    previous = None
+    for cue in cues:
+        if previous is not None:
+            yield extend(previous, max_cps, cue.start)
+        previous = cue
+    if previous is not None:
+        yield extend(previous, max_cps, None)
+
+
+def extend(cue: Cue, max_cps: float, next_start: float | None) -> Cue:
+    needed = cue.start + len(cue.text) / max_cps
+    if needed <= cue.end:
+        return cue
+    end = needed if next_start is None else max(cue.end, min(needed, next_start))
+    return cue._replace(end=end)
+
+
+def make_cues(segments: Iterable, max_chars: int | None = None, max_cps: float | None = None) -> Iterator[Cue]:
+    """ Turn segments into cues, re-segmented if limits are given
+
+        Parameters
+        segments (iterable): Decoded segments, with words for re-segmentation
+        max_chars (int): Maximum characters per line, no line breaking nor word regrouping if None
+        max_cps (float): Maximum reading speed in characters per second, unlimited if None
+    """
+    if max_chars:
+        cues = split_words(segments, max_chars)
+    else:
+        cues = (Cue(get(segment, 'start'), get(segment, 'end'), get(segment, 'text').strip()) for segment in segments)
+    if max_cps:
+        cues = limit_reading_speed(cues, max_cps)
+    for cue in cues:
+        yield cue._replace(text=wrap(cue.text, max_chars))
+
+
+def iter_srt(cues: Iterable[Cue]) -> Iterator[str]:
+    for i, cue in enumerate(cues, 1):
+        yield f'{i}\n{format_timestamp(cue.start)} --> {format_timestamp(cue.end)}\n{cue.text}\n\n'
+
+
+def iter_vtt(cues: Iterable[Cue]) -> Iterator[str]:
+    yield 'WEBVTT\n\n'
+    for cue in cues:
+        start, end = format_timestamp(cue.start, '.'), format_timestamp(cue.end, '.')
+        yield f'{start} --> {end}\n{cue.text}\n\n'
+
+
+def iter_words_json(segments: Iterable) -> Iterator[str]:
+    """Stream a JSON array of words with timestamps and probability, or of segments for those without words."""
+    separator = '['
+    for segment in segments:
+        words = get(segment, 'words')
+        items = [{'start': get(word, 'start'), 'end': get(word, 'end'), 'word': get(word, 'word').strip(),
+                  'probability': get(word, 'probability')} for word in words] if words \
+            else [{'start': get(segment, 'start'), 'end': get(segment, 'end'), 'word': get(segment, 'text').strip(),
+                   'probability': None}]
+        # Encode words of a segment at once, without the enclosing brackets
+        yield separator + json.dumps(items, ensure_ascii=False)[1:-1]
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+def export(segments: Iterable, format: str = 'srt', max_chars: int | None = None,
+           max_cps: float | None = None) -> Iterator[str]:
+    """ Stream subtitles of segments in given format
+
+        Parameters
+        segments (iterable): Decoded segments
+        format (str): 'srt', 'vtt' or 'json' for words
+        max_chars, max_cps: Re-segmentation limits, see make_cues()
+
+        Raises
+        ValueError: Unknown format
+    """
+    if format not in FORMATS:
+        raise ValueError(f'Unknown subtitle format {format}')
+    if format == 'json':
+        return iter_words_json(segments)
+    cues = make_cues(segments, max_chars, max_cps)
+    return iter_srt(cues) if format == 'srt' else iter_vtt(cues)
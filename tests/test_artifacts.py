@@ -0,0 +1,44 @@
+import os
+import time
+
+from PIL import Image
+
+import artifacts
+from artifacts import ArtifactDirectory, chart_dir, store_chart
+
+
+def save_chart(folder, name: str, color: str, size=(2000, 1000)) -> str:
+    path = os.path.join(folder, name)
+    Image.new('RGB', size, color).save(path)
+    return path
+
+
+def test_store_chart(tmp_path, monkeypatch):
+    """Charts are renamed after their content, identical ones deduplicated, and optionally re-encoded"""
+    folder = str(tmp_path)
+    first = store_chart(save_chart(folder, 'a.png', 'red'))
+    assert os.path.basename(first) == artifacts.hash_file(first) + '.png'
+    assert store_chart(save_chart(folder, 'b.png', 'red')) == first
+    assert sorted(os.listdir(folder)) == [os.path.basename(first)]
+    monkeypatch.setattr(artifacts, 'CHART_FORMAT', 'webp')
+    webp = store_chart(save_chart(folder, 'c.png', 'blue'))
+    assert webp.endswith('.webp')
+    with Image.open(webp) as image:
+        assert max(image.size) == artifacts.CHART_MAX_SIDE
+    assert chart_dir('token') != chart_dir('other') and 'token' not in chart_dir('token')
+
+
+def test_reap(tmp_path):
+    """Reaper deletes expired files, then the oldest over budget, sparing recent ones and removing empty folders"""
+    now = time.time()
+    for i, age in enumerate([5000, 400, 300, 10]):
+        folder = tmp_path / f'session{i}'
+        folder.mkdir()
+        path = folder / 'chart.png'
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (now - age, now - age))
+    directory = ArtifactDirectory(str(tmp_path), max_bytes=250, ttl=3600, min_age=60)
+    directory.reap()
+    assert sorted(os.listdir(tmp_path)) == ['session2', 'session3']
+    assert directory.evictions == {'expired': 1, 'budget': 1}
+    assert directory.stats()['bytes'] == 200
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+from whisper.audio import SAMPLE_RATE
+
+import numpy as np
+
+import asr
+from asr import Media, plan_chunks
+from transcript import build_transcript
+
+
+def test_plan_chunks():
+    """Windows are cut at pauses where possible, with overlap only around hard cuts"""
+    length = 250 * SAMPLE_RATE
+    pauses = [90 * SAMPLE_RATE, 110 * SAMPLE_RATE]
+    chunks = plan_chunks(length, pauses, chunk_seconds=100, overlap_seconds=2)
+    assert chunks == [
+        (0, 90 * SAMPLE_RATE, 0, 90 * SAMPLE_RATE),
+        (90 * SAMPLE_RATE, 190 * SAMPLE_RATE, 90 * SAMPLE_RATE, 192 * SAMPLE_RATE),
+        (190 * SAMPLE_RATE, length, 188 * SAMPLE_RATE, length),
+    ]
+    assert plan_chunks(50 * SAMPLE_RATE, [], chunk_seconds=100) == [(0, 50 * SAMPLE_RATE, 0, 50 * SAMPLE_RATE)]
+
+
+def test_decode_chunks(monkeypatch):
+    """Segments come back in order with absolute timestamps, and overlapping ones only once"""
+    monkeypatch.setattr(asr, 'ASR_CHUNK_SECONDS', 10)
+    monkeypatch.setattr(asr, 'find_pauses', lambda audio: [])
+    monkeypatch.setattr(asr, 'plan_chunks', lambda length, pauses: plan_chunks(length, pauses, 10, 1))
+    audio = np.arange(25 * SAMPLE_RATE, dtype=np.float32) / SAMPLE_RATE
+
+    def decode(samples):
+        # One segment per second, labelled with its absolute start read back from the samples
+        for second in range(int(len(samples) / SAMPLE_RATE)):
+            yield {'start': second, 'end': second + 1, 'text': str(round(samples[second * SAMPLE_RATE])),
+                   'tokens': [0]}
+
+    segments = list(Media.decode_chunks(audio, decode))
+    assert [segment['start'] for segment in segments] == list(range(25))
+    assert [segment['text'] for segment in segments] == [str(second) for second in range(25)]
+
+
+def test_cached_result(tmp_path, monkeypatch):
+    """Results are reused for the same audio and options, and head requests are cropped from full results"""
+    monkeypatch.setattr(asr, 'transcripts', asr.DiskCache(str(tmp_path), suffix='.json'))
+    media = Media.__new__(Media)
+    media.hash = 'audio'
+    segments = [{'id': i, 'start': i * 30, 'end': i * 30 + 5, 'text': str(i), 'tokens': [1, 2]} for i in range(4)]
+    result = asr.DecodeResult(transcript=build_transcript(segments), duration=120, decoded=True, tokens=8, cost=1)
+    asr.transcripts.put(asr.transcript_key('audio', 'base', 'transcribe', 'full', ''), result.to_bytes())
+
+    cached = media.get_cached_result('base', asr.DecodeConfig(limit='full'))
+    assert cached.cached and cached.cost == 0 and len(cached.segments) == 4
+    assert cached.page(1, 1)['segments'][0]['text'] == '1'
+    head = media.get_cached_result('base', asr.DecodeConfig(limit='head'))
+    assert head.limited and head.tokens == 4 and len(head.segments) == 2
+    assert media.get_cached_result('small', asr.DecodeConfig(limit='full')) is None
+
+
+def test_decode_batch(monkeypatch):
+    """Windows are decoded in clips covering the concatenated audio, and segments return to their windows"""
+    calls = []
+
+    class Pipeline:
+        def __init__(self, model):
+            pass
+
+        def transcribe(self, audio, clip_timestamps, batch_size, **kwargs):
+            calls.append((len(audio), clip_timestamps, batch_size))
+            # One segment per clip, labelled with the first sample of the clip as the pipeline slices it
+            segments = [SimpleNamespace(start=clip['start'] / SAMPLE_RATE, end=clip['end'] / SAMPLE_RATE, words=None,
+                                        text=str(audio[clip['start']:clip['end']][0])) for clip in clip_timestamps]
+            return iter(segments), None
+
+    monkeypatch.setattr(asr, 'BatchedInferencePipeline', Pipeline)
+    monkeypatch.setattr(asr, 'get_model', lambda size: None)
+    windows = [np.full(2 * SAMPLE_RATE, 1, dtype=np.float32), np.full(3 * SAMPLE_RATE, 2, dtype=np.float32)]
+    results = asr.decode_batch(('tiny', 'transcribe', None, None, False), windows, [10.0, 40.0])
+    assert calls == [(5 * SAMPLE_RATE, [{'start': 0, 'end': 2 * SAMPLE_RATE},
+                                        {'start': 2 * SAMPLE_RATE, 'end': 5 * SAMPLE_RATE}], 2)]
+    assert [[(segment.start, segment.end, segment.text) for segment in result] for result in results] == [
+        [(10.0, 12.0, '1.0')], [(40.0, 43.0, '2.0')]]
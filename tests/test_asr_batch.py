@@ -0,0 +1,50 @@
+import threading
+
+import numpy as np
+import pytest
+
+from asr_batch import BatchScheduler
+
+
+def fake_decoder(batches):
+    """Decoder returning one segment per window, as (window offset, key), recording batch sizes"""
+    gate = threading.Event()
+
+    def decode(key, windows, offsets):
+        gate.wait(1)
+        batches.append((key, len(windows)))
+        if key == 'fail':
+            raise RuntimeError('decode failed')
+        return [[(offset, key)] for offset in offsets]
+
+    return decode, gate
+
+
+def test_batches_across_jobs():
+    """Windows of jobs with the same key share batches, and each job gets its segments in order"""
+    batches = []
+    decode, gate = fake_decoder(batches)
+    scheduler = BatchScheduler(decode, max_batch=4, max_wait=0.05)
+    audio = np.zeros(100, dtype=np.float32)
+    first = scheduler.submit('a', audio, [(0, 10), (10, 20), (20, 30)], 10)
+    second = scheduler.submit('a', audio, [(50, 60), (60, 70)], 10)
+    other = scheduler.submit('b', audio, [(0, 10)], 10)
+    gate.set()
+    assert list(first.stream()) == [(0, 'a'), (1, 'a'), (2, 'a')]
+    assert second.future.result(1) == [(5, 'a'), (6, 'a')]
+    assert other.future.result(1) == [(0, 'b')]
+    assert batches == [('a', 4), ('a', 1), ('b', 1)] or batches == [('a', 4), ('b', 1), ('a', 1)]
+    stats = scheduler.stats()
+    assert stats['batches'] == 3 and stats['windows'] == 6 and stats['queue_depth'] == 0
+    assert scheduler.get_job(first.id).status == 'done'
+
+
+def test_batch_failure():
+    batches = []
+    decode, gate = fake_decoder(batches)
+    gate.set()
+    scheduler = BatchScheduler(decode, max_batch=4, max_wait=0)
+    job = scheduler.submit('fail', np.zeros(10, dtype=np.float32), [(0, 10)], 10)
+    with pytest.raises(RuntimeError):
+        list(job.stream())
+    assert job.status == 'failed'
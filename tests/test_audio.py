@@ -0,0 +1,26 @@
+import io
+import threading
+
+import numpy as np
+
+import audio as audio_module
+from audio import DecodedAudio
+
+
+def test_decoded_audio(tmp_path, monkeypatch):
+    """Samples stream into a memory-mapped file and readers get ranges as soon as they are decoded"""
+    # Odd read size splits samples between reads
+    monkeypatch.setattr(audio_module, 'READ_BYTES', 777)
+    pcm = (np.arange(50_001) % 1000 - 500).astype(np.int16)
+    audio = DecodedAudio('upload.mp3', str(tmp_path / 'upload.pcm'))
+    thread = threading.Thread(target=audio.write, args=(io.BytesIO(pcm.tobytes()),))
+    thread.start()
+    head = audio.read(0, 100)
+    assert np.allclose(head, pcm[:100] / 32768.0)
+    whole = audio.read()
+    thread.join()
+    assert len(whole) == len(pcm) and isinstance(whole, np.memmap)
+    assert np.allclose(whole, pcm / 32768.0)
+    assert len(audio.read(50_000, 60_000)) == 1
+    audio.close()
+    assert not (tmp_path / 'upload.pcm').exists()
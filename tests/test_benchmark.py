@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from multiprocessing import get_context
+
+from benchmark import compare, current_rss, summarize
+
+root_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def test_compare():
+    """Regressions are slower p95 latency, lower throughput or more errors than the baseline, beyond tolerance"""
+    baseline = {'query': summarize([0.1] * 10, {200: 10}, 1.0, 0)}
+    assert compare({'query': summarize([0.11] * 10, {200: 10}, 1.1, 0)}, baseline) == []
+    regressions = compare({'query': summarize([0.2] * 10, {200: 9, 500: 1}, 2.0, 0),
+                           'session': summarize([1.0], {200: 1}, 1.0, 0)}, baseline)
+    assert len(regressions) == 3 and all(regression.startswith('query') for regression in regressions)
+    assert compare({'query': baseline['query']}, {'environment': {'cpus': 1}, **baseline}) == []
+
+
+def test_child_rss():
+    """Memory of worker processes is counted with that of the server"""
+    rss = current_rss()
+    process = get_context('spawn').Process(target=time.sleep, args=(5,))
+    process.start()
+    try:
+        deadline = time.time() + 5
+        while current_rss() <= rss + 10 * 1024 * 1024 and time.time() < deadline:
+            time.sleep(0.1)
+        assert current_rss() > rss + 10 * 1024 * 1024
+    finally:
+        process.kill()
+        process.join()
+
+
+def test_offline_run(tmp_path):
+    """The benchmark drives the server offline, with stand-in LLM, and reports every scenario run"""
+    output = tmp_path / 'results.json'
+    env = {key: value for key, value in os.environ.items() if key not in ('OPENAI_API_KEY', 'PANDASAI_API_KEY')}
+    completed = subprocess.run([sys.executable, 'benchmark.py', '--requests', '4', '--concurrency', '2',
+                                '--llm-latency', '0', '--scenarios', 'session', 'upload_csv_1000', 'query',
+                                '--baseline', str(tmp_path / 'baseline.json'), '--save-baseline',
+                                '--output', str(output)], cwd=root_path, env=env, capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stderr
+    results = json.loads(output.read_text())
+    assert list(results) == ['session', 'upload_csv_1000', 'query']
+    assert all(result['requests'] == 4 and result['errors'] == 0 for result in results.values())
+    assert json.loads((tmp_path / 'baseline.json').read_text())['environment']['cpus'] == os.cpu_count()
@@ -0,0 +1,95 @@
+import time
+
+import pandas as pd
+
+from cache import DiskCache, LRUCache, ResponseCache, hash_dataframe, hash_schema
+
+
+def test_lru_eviction():
+    evicted = []
+    cache = LRUCache(max_items=2, on_evict=lambda key, value, reason: evicted.append((key, reason)))
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert evicted == [('b', 'lru')]
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['evictions']['lru'] == 1
+
+
+def test_ttl_expiration():
+    cache = LRUCache(ttl=0.05)
+    cache.put('a', 1)
+    assert cache.get('a') == 1
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.stats()['evictions']['expired'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_memory_budget():
+    """Resizing an entry over budget evicts the least recently used others, never itself"""
+    evicted = []
+    cache = LRUCache(max_bytes=100, on_evict=lambda key, value, reason: evicted.append((key, reason)))
+    cache.put('a', 1, 40)
+    cache.put('b', 2, 40)
+    cache.resize('b', 90)
+    assert evicted == [('a', 'memory')]
+    assert 'b' in cache and cache.total_bytes == 90
+    cache.resize('b', 200)
+    assert 'b' in cache
+    # The entry resized may be the least recently used one
+    evicted.clear()
+    cache = LRUCache(max_bytes=100, on_evict=lambda key, value, reason: evicted.append((key, reason)))
+    cache.put('a', 1, 40)
+    cache.put('b', 2, 40)
+    cache.resize('a', 90)
+    assert evicted == [('b', 'memory')]
+    assert 'a' in cache and cache.total_bytes == 90
+
+
+def test_response_cache():
+    """Exact match ignores case and punctuation, similar match is opt-in and scoped to dataset and model"""
+    cache = ResponseCache(max_items=10)
+    cache.put('data', 'openai', 'How many rows?', 891)
+    assert cache.get('data', 'openai', 'how many   ROWS') == 891
+    assert cache.get('data', 'openai', 'Rows: how many?') is None
+    assert cache.get('other', 'openai', 'How many rows?') is None
+    assert cache.get('data', 'bamboo', 'How many rows?') is None
+
+    cache = ResponseCache(max_items=10, similarity=0.8)
+    cache.put('data', 'openai', 'What is the average fare by class?', 'answer')
+    assert cache.get('data', 'openai', 'Average fare by class please') == 'answer'
+    assert cache.get('data', 'openai', 'Average fare by sex') is None
+    assert cache.stats()['similar_hits'] == 1
+
+
+def test_hash_dataframe():
+    df = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+    assert hash_dataframe(df) == hash_dataframe(df.copy())
+    assert hash_dataframe(df) != hash_dataframe(df.head(2))
+    assert hash_dataframe(df) != hash_dataframe(df.astype({'a': float}))
+
+
+def test_hash_schema():
+    """Schema fingerprint only depends on column names and dtypes"""
+    df = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+    assert hash_schema(df) == hash_schema(pd.DataFrame({'a': [4], 'b': ['w']}))
+    assert hash_schema(df) != hash_schema(df.rename(columns={'b': 'c'}))
+
+
+def test_disk_cache(tmp_path):
+    """Files over budget are evicted oldest first, and hits count as recent use"""
+    cache = DiskCache(str(tmp_path), max_bytes=250, suffix='.json')
+    cache.put('a', b'x' * 100)
+    time.sleep(0.01)
+    cache.put('b', b'x' * 100)
+    time.sleep(0.01)
+    assert cache.get('a') == b'x' * 100
+    time.sleep(0.01)
+    cache.put('c', b'x' * 100)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    stats = cache.stats()
+    assert stats['size'] == 2 and stats['evictions'] == 1 and stats['misses'] == 1
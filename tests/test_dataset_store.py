@@ -0,0 +1,36 @@
+import pandas as pd
+
+import dataset_store
+from dataset_store import store_dataframe, find_dataset
+from ingest import ingest_file
+
+
+def test_store_and_load(tmp_path, monkeypatch):
+    """Stored datasets load back identically, projected on demand, and identical content is stored once"""
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    df = pd.DataFrame({'a': [1, 2, 3], 'b': pd.Categorical(['x', 'y', 'x'])})
+    ref = store_dataframe(df, 'sample.csv')
+    assert ref.path is not None and ref.rows == 3
+    assert ref.load().equals(df)
+    assert list(ref.load(head=2, columns=['b'])['b']) == ['x', 'y']
+    assert store_dataframe(df.copy()).path == ref.path
+    assert find_dataset(ref.key).name == 'sample.csv'
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_mixed_types_in_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    df = pd.DataFrame({'a': [1, 'x', 2.5]})
+    ref = store_dataframe(df)
+    assert ref.path is None and ref.load().equals(df)
+
+
+def test_ingest_reupload(tmp_path, monkeypatch):
+    """Uploading the same file again is served from the store without parsing"""
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    data = b'a,b\n1,x\n2,y\n'
+    ref, = ingest_file(data, 'csv', 'data.csv')
+    monkeypatch.setattr('ingest.read_dataset', None)
+    copy, = ingest_file(data, 'csv', 'copy.csv')
+    # Each upload keeps its own name, not that of the first one
+    assert copy.path == ref.path and copy.name == 'copy.csv' and ref.name == 'data.csv'
@@ -0,0 +1,47 @@
+import pandas as pd
+
+from fastpath import DataProfile, answer
+
+sales = pd.DataFrame({
+    'Country': ['France', 'Germany', 'France', 'Italy', 'Spain', 'France'],
+    'Unit Price': [2.5, 4.0, 3.5, 1.0, 2.0, 5.0],
+    'deals': [10, 20, 30, 40, 50, 60],
+    'date': pd.date_range('2024-01-01', periods=6),
+})
+
+
+def test_answers():
+    """Simple questions are answered from the profile, typed as the engine would"""
+    profile = DataProfile(sales)
+    assert answer(profile, 'How many rows are there?') == ('row_count', 6)
+    assert answer(profile, 'what is the number of columns in the dataset') == ('column_count', 4)
+    assert answer(profile, 'List all columns') == ('columns', 'Country, Unit Price, deals, date')
+    assert answer(profile, "What's the average unit price?") == ('statistic', 3.0)
+    assert answer(profile, 'max deals') == ('statistic', 60) and type(answer(profile, 'sum of deals')[1]) is int
+    assert answer(profile, 'minimum of the date column') == ('statistic', pd.Timestamp('2024-01-01'))
+    assert answer(profile, 'How many unique countries?') == ('distinct_count', 4)
+    intent, counts = answer(profile, 'value counts of country')
+    assert intent == 'value_counts' and counts.values.tolist() == [['France', 3], ['Germany', 1], ['Italy', 1],
+                                                                   ['Spain', 1]]
+    intent, head = answer(profile, 'show me the last 2 rows')
+    assert intent == 'head_tail' and head['deals'].tolist() == [50, 60]
+    assert answer(profile, 'describe the data')[1].loc['mean', 'deals'] == 35
+    assert answer(profile, 'describe country')[1].loc['top', 'Country'] == 'France'
+
+
+def test_fall_through():
+    """Questions with conditions, on unknown columns or not applicable to the column go to the LLM"""
+    profile = DataProfile(sales)
+    for prompt in ['Which are the top 5 countries by sales?', 'average unit price by country', 'mean of price',
+                   'How many rows have deals over 20?', 'max country', 'Plot deals by country']:
+        assert answer(profile, prompt) is None, prompt
+
+
+def test_head_categories():
+    """Categories without rows in a head selection are not counted, as when loading head rows of stored data"""
+    cities = pd.DataFrame({'city': pd.Categorical(['Paris', 'Rome', 'Oslo', 'Lima'] * 50), 'sales': range(200)})
+    profile = DataProfile(cities.head(3))
+    assert answer(profile, 'How many unique cities?') == ('distinct_count', 3)
+    intent, counts = answer(profile, 'value counts of city')
+    assert sorted(counts['city'].tolist()) == ['Oslo', 'Paris', 'Rome']
+    assert answer(profile, 'describe city')[1].loc[['count', 'unique'], 'city'].tolist() == [3, 3]
@@ -0,0 +1,82 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataset_store
+import ingest
+from ingest import read_dataset, ingest_report, IngestLimitExceeded
+
+
+def sample_csv(rows=5000):
+    df = pd.DataFrame({
+        'id': range(rows),
+        'pclass': np.random.choice(['first', 'second', 'third'], rows),
+        'fare': np.round(np.random.rand(rows) * 100, 2),
+        'age': [None if i == rows - 10 else i % 80 for i in range(rows)],
+        'name': [f'Passenger {i}' for i in range(rows)],
+    })
+    return df.to_csv(index=False).encode()
+
+
+def test_chunked_read(monkeypatch):
+    """Chunked parsing must keep all values while shrinking dtypes"""
+    monkeypatch.setattr(ingest, 'INGEST_CHUNK_ROWS', 1000)
+    data = sample_csv()
+    df = read_dataset(data, 'csv')
+    plain = pd.read_csv(io.BytesIO(data))
+    assert len(df.index) == len(plain.index)
+    assert df['id'].dtype == np.int16
+    assert isinstance(df['pclass'].dtype, pd.CategoricalDtype)
+    assert df['name'].dtype == object
+    assert df['fare'].dtype == np.float64
+    assert (df['pclass'].astype(object) == plain['pclass']).all()
+    assert df['age'].isna().sum() == 1
+    assert ingest.memory_usage(df) < ingest.memory_usage(plain)
+
+
+def test_head_and_limits():
+    data = sample_csv()
+    assert len(read_dataset(data, 'csv', head=10).index) == 10
+    with pytest.raises(IngestLimitExceeded):
+        read_dataset(data, 'csv', max_rows=100)
+    with pytest.raises(IngestLimitExceeded):
+        read_dataset(data, 'csv', max_bytes=1000)
+
+
+def sample_workbook() -> bytes:
+    output = io.BytesIO()
+    with pd.ExcelWriter(output) as writer:
+        pd.DataFrame({'a': range(5)}).to_excel(writer, sheet_name='first', index=False)
+        pd.DataFrame().to_excel(writer, sheet_name='blank', index=False)
+        pd.DataFrame({'b': list('xyz')}).to_excel(writer, sheet_name='second', index=False)
+    return output.getvalue()
+
+
+def test_ingest_sheets(tmp_path, monkeypatch):
+    """Every non blank sheet becomes a dataset, reuploads find them all, and failures are reported per file"""
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    data = sample_workbook()
+    report = ingest_report(data, 'xlsx', 'book.xlsx')
+    assert report['error'] is None and report['seconds'] > 0
+    assert [(ref.name, ref.rows) for ref in report['datasets']] == [('book.xlsx - first', 5), ('book.xlsx - second', 3)]
+    assert len(read_dataset(data, 'xlsx').index) == 5
+    monkeypatch.setattr(ingest, 'read_sheets', None)
+    copy = ingest_report(data, 'xlsx', 'copy.xlsx')['datasets']
+    assert [ref.path for ref in copy] == [ref.path for ref in report['datasets']]
+    assert [ref.name for ref in copy] == ['copy.xlsx - first', 'copy.xlsx - second']
+    report = ingest_report(b'not a workbook', 'xlsx', 'bad.xlsx')
+    assert report['datasets'] == [] and report['status'] == 400
+    assert ingest_report(sample_csv(), 'csv', 'big.csv', max_rows=100)['status'] == 413
+
+
+def test_ingest_path(tmp_path, monkeypatch):
+    """Uploads spooled to disk are hashed and parsed from their path, as by worker processes"""
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path / 'datasets'))
+    monkeypatch.setattr(ingest, 'INGEST_CHUNK_ROWS', 1000)
+    data = sample_csv()
+    path = tmp_path / 'upload.csv'
+    path.write_bytes(data)
+    ref, = ingest_report(str(path), 'csv', 'upload.csv')['datasets']
+    assert ref.rows == 5000 and ref.key == dataset_store.hash_bytes(data)
@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from jobs import JobCancelled, JobRegistry, TooManyJobs
+from workers import WorkerPool
+
+
+def test_job_lifecycle():
+    """Jobs report progress and result, are scoped to their session, and expire after their TTL"""
+    registry = JobRegistry(ttl=0.2, max_active=1)
+    pool = WorkerPool('test', max_workers=1, max_queue=1)
+
+    def work(job):
+        job.set_progress(50)
+        return 42
+
+    async def flow():
+        job = registry.create('query', 'token')
+        with pytest.raises(TooManyJobs):
+            registry.create('query', 'token')
+        job.attach(await pool.start(work, job))
+        await asyncio.sleep(0.05)
+        return job
+
+    job = asyncio.run(flow())
+    assert job.status == 'done' and job.result == 42 and job.progress == 100
+    assert registry.get(job.id, 'other') is None
+    assert registry.get(job.id, 'token') is job
+    time.sleep(0.3)
+    assert registry.get(job.id, 'token') is None and registry.stats()['expired'] == 1
+    pool.shutdown()
+
+
+def test_job_cancel():
+    """Running work stops at its next progress report once cancelled"""
+    registry = JobRegistry()
+    pool = WorkerPool('test', max_workers=1, max_queue=1)
+    started = threading.Event()
+
+    def work(job):
+        started.set()
+        while True:
+            job.set_progress(10)
+            time.sleep(0.01)
+
+    async def flow():
+        job = registry.create('transcribe', 'token')
+        job.attach(await pool.start(work, job))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        job.cancel()
+        with pytest.raises((JobCancelled, asyncio.CancelledError)):
+            await job.future
+        return job
+
+    job = asyncio.run(flow())
+    assert job.status == 'cancelled'
+    pool.shutdown()
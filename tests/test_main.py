@@ -1,6 +1,6 @@
 import pandas as pd
 
-from main import create_session, set_data, get_chat_response
+from main import create_session, set_data, get_chat_response, get_session_by_token
 
 sales_by_country = pd.DataFrame({
     "country": ["United States", "United Kingdom", "France", "Germany", "Italy", "Spain", "Canada", "Australia",
@@ -29,3 +29,13 @@ def test_flow_with_streamlit():
     response = get_chat_response(query, token)
     assert response is not None
     print(response)
+
+
+def test_flow_fastpath():
+    token = create_session()
+    set_data([sales_by_country], token)
+    assert get_chat_response('How many rows are there?', token) == 10
+    assert get_chat_response('What is the total sales?', token) == 36200
+    session = get_session_by_token(token)
+    assert session.last_source == 'fastpath'
+    assert [message['message'] for message in session.get_history()][-2:] == ['What is the total sales?', '36200']
@@ -0,0 +1,33 @@
+import time
+
+from metrics import Counter, Histogram, span, start_request, format_server_timing, render
+
+
+def test_histogram_buckets():
+    histogram = Histogram('test_seconds', 'Test', ('stage',), buckets=(0.1, 1))
+    histogram.observe(0.05, stage='a')
+    histogram.observe(0.5, stage='a')
+    histogram.observe(5, stage='a')
+    samples = histogram.samples()
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in samples
+    assert 'test_seconds_bucket{stage="a",le="1"} 2' in samples
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in samples
+    assert 'test_seconds_count{stage="a"} 3' in samples
+
+
+def test_counter_labels():
+    counter = Counter('test_total', 'Test', ('model',))
+    counter.inc(2, model='x')
+    counter.inc(3, model='x')
+    counter.inc(model='y')
+    assert counter.samples() == ['test_total{model="x"} 5', 'test_total{model="y"} 1']
+
+
+def test_request_spans():
+    """Spans are collected for the current request and exposed as metrics"""
+    timings = start_request()
+    with span('test_stage'):
+        time.sleep(0.01)
+    assert [name for name, _ in timings] == ['test_stage'] and timings[0][1] >= 0.01
+    assert format_server_timing([('llm', 0.25)]) == 'llm;dur=250.0'
+    assert 'datachat_span_seconds_count{span="test_stage"} 1' in render()
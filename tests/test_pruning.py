@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from fastpath import DataProfile
+from pruning import build_schema, count_tokens, dataframe_prompt
+
+generator = np.random.default_rng(0)
+wide = pd.DataFrame({
+    **{f'metric_{i}': generator.normal(size=100) for i in range(40)},
+    'unitPrice': generator.uniform(1, 5, 100).round(2),
+    'country': generator.choice(['France', 'United Kingdom'], 100),
+    'order_date': pd.date_range('2024-01-01', periods=100),
+})
+
+
+def test_select():
+    """Prompts keep the columns they name or whose values they mention, and follow-ups about time add dates"""
+    schema = build_schema(DataProfile(wide))
+    assert schema.summary['country'] == 'country: object, 2 distinct, e.g. ' + ', '.join(
+        wide['country'].value_counts().index)
+    assert schema.select('Average unit prices in the United Kingdom') == ['unitPrice', 'country']
+    assert schema.select('and by month?', ['unitPrice', 'country']) == ['unitPrice', 'country', 'order_date']
+    assert schema.select('and by month?') is None
+    assert schema.select('Plot everything') is None
+    assert build_schema(DataProfile(wide[['unitPrice', 'country']])) is None
+
+
+def test_view():
+    """Views hold the selected columns only, described by their summary, and shrink the prompt"""
+    schema = build_schema(DataProfile(wide))
+    view = schema.view(['unitPrice', 'country'])
+    assert schema.view(['unitPrice', 'country']) is view
+    assert list(view.pandas_df.columns) == ['unitPrice', 'country']
+    low, high = wide['unitPrice'].min(), wide['unitPrice'].max()
+    assert view.description.split('\n') == [f'unitPrice: float64, {low:g} to {high:g}', schema.summary['country']]
+
+    class Config:
+        direct_sql = False
+        dataframe_serializer = None
+        enforce_privacy = False
+
+    prompt = dataframe_prompt(view, Config)
+    assert 'dfs[0]:100x2' in prompt and 'metric_0' not in prompt
+    assert count_tokens(prompt) < count_tokens(dataframe_prompt(schema.view(list(schema.columns)[:40]), Config))
+
+
+def test_prompt_tokens(monkeypatch):
+    """Data parts of prompts are serialized once per selection to measure them"""
+    schema = build_schema(DataProfile(wide))
+    full = schema.view(list(schema.columns))
+    view = schema.view(['unitPrice', 'country'])
+
+    class Config:
+        direct_sql = False
+        dataframe_serializer = None
+        enforce_privacy = False
+
+    tokens = schema.prompt_tokens(full, Config), schema.prompt_tokens(view, Config, ['unitPrice', 'country'])
+    assert tokens[0] > tokens[1] == count_tokens(dataframe_prompt(view, Config))
+    monkeypatch.setattr('pruning.dataframe_prompt', None)
+    assert (schema.prompt_tokens(full, Config), schema.prompt_tokens(view, Config, ['unitPrice', 'country'])) == tokens
@@ -0,0 +1,41 @@
+import io
+import json
+
+import pandas as pd
+import pyarrow as pa
+
+from results import ResultStore
+
+
+def test_result_pages():
+    """Results keep their index as a column and serve bounded pages as JSON and HTML"""
+    store = ResultStore()
+    df = pd.DataFrame({'count': range(250)}, index=pd.Index([f'k{i}' for i in range(250)], name='key'))
+    result = store.put(df, 'token')
+    assert store.get(result.id, 'other') is None
+    assert store.get(result.id, 'token') is result
+    assert result.describe() == {'id': result.id, 'rows': 250, 'page_rows': 100,
+                                 'columns': [{'name': 'key', 'dtype': 'object'}, {'name': 'count', 'dtype': 'int64'}]}
+    page = json.loads(result.to_json(offset=240, limit=20))
+    assert page['total_rows'] == 250 and page['offset'] == 240
+    assert page['rows'][0] == ['k240', 240] and len(page['rows']) == 10
+    html = result.to_html(limit=10)
+    assert html.count('<td>k') == 10 and 'Rows 1-10 of 250' in html
+
+
+def test_result_index_clash():
+    """Index levels named as columns, as in grouped answers, are kept under another name"""
+    df = pd.DataFrame({'a': list('xyx'), 'b': [1, 2, 3]})
+    result = ResultStore().put(df.groupby('a')[['a']].count(), 'token')
+    assert list(result.df.columns) == ['a_index', 'a'] and list(result.df['a']) == [2, 1]
+    result = ResultStore().put(df.set_index(['a', 'b'], drop=False).rename_axis([None, 'b']), 'token')
+    assert list(result.df.columns) == ['level_0', 'b_index', 'a', 'b']
+
+
+def test_result_streams():
+    """CSV and Arrow streams carry all rows from offset, with a header or schema first"""
+    result = ResultStore().put(pd.DataFrame({'a': range(25000), 'b': ['x', 1] * 12500}), 'token')
+    csv = ''.join(result.iter_csv(offset=5))
+    assert csv.startswith('a,b\n5,1\n') and csv.count('\n') == 24996
+    table = pa.ipc.open_stream(io.BytesIO(b''.join(result.iter_arrow(limit=15000)))).read_all()
+    assert table.num_rows == 15000 and table.column('b').type == pa.string()
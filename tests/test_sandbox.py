@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+import dataset_store
+import sandbox
+from pandasai import Agent
+from pandasai.llm.fake import FakeLLM
+from sandbox import SandboxPool, SandboxError, ExecutionAborted
+
+
+@pytest.fixture
+def pool():
+    pool = SandboxPool(workers=1, timeout=2, max_rss_mb=512)
+    yield pool
+    pool.shutdown()
+
+
+def make_job(ref, code: str, **kwargs) -> dict:
+    return {'key': ref.key, 'path': ref.path, 'head': None, 'memory': ref.memory, 'dependencies': [], 'data': True,
+            'columns': None, 'code': code, **kwargs}
+
+
+def test_run(pool, tmp_path, monkeypatch):
+    """Workers load stored data themselves, keep it for next jobs, and report errors of generated code"""
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    ref = dataset_store.store_dataframe(pd.DataFrame({'a': range(10), 'b': list('xy') * 5}), 'data.csv')
+    job = make_job(ref, "result = {'type': 'number', 'value': int(dfs[0]['a'].sum())}")
+    assert pool.run(job) == {'type': 'number', 'value': 45}
+    result = pool.run(make_job(ref, "result = {'type': 'dataframe', 'value': df.head(2)}", columns=['b']))
+    assert list(result['value'].columns) == ['b']
+    assert pool.stats()['affinity_hits'] == 1
+    with pytest.raises(SandboxError, match="KeyError: 'c'"):
+        pool.run(make_job(ref, "result = df['c']"))
+    memory = dataset_store.memory_dataset(pd.DataFrame({'a': [1, 2]}))
+    assert pool.run(make_job(memory, "result = len(df)", path=None), df=memory.df) == 2
+
+
+def test_limits(pool, tmp_path, monkeypatch):
+    """Workers running over time or memory are killed and replaced, and the pool keeps serving"""
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    ref = dataset_store.store_dataframe(pd.DataFrame({'a': range(10)}), 'data.csv')
+    pool.run(make_job(ref, 'result = 1'))
+    pid = pool.idle[0].process.pid
+    with pytest.raises(ExecutionAborted) as error:
+        pool.run(make_job(ref, 'while True:\n    pass'))
+    assert error.value.reason == 'timeout'
+    with pytest.raises(ExecutionAborted) as error:
+        pool.run(make_job(ref, 'x = np.ones(10 ** 8)\nwhile True:\n    pass'))
+    assert error.value.reason == 'memory'
+    assert pool.run(make_job(ref, 'result = int(df["a"].max())')) == 9
+    assert pool.idle[0].process.pid != pid
+    assert pool.stats()['killed'] == 2
+
+
+def test_dataset_allowance(pool, tmp_path, monkeypatch):
+    """Memory of the datasets a worker holds is allowed on top of the limit"""
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    ref = dataset_store.store_dataframe(pd.DataFrame({'a': range(10)}), 'data.csv')
+    code = 'x = np.ones(8 * 10 ** 7)\nfor _ in range(10 ** 7):\n    pass\nresult = len(x)'
+    assert pool.run(make_job(ref, code, memory=512 * 1024 * 1024)) == 8 * 10 ** 7
+    with pytest.raises(ExecutionAborted) as error:
+        pool.run(make_job(ref, code))
+    assert error.value.reason == 'memory'
+
+
+def test_pandasai_internals(pool, tmp_path, monkeypatch):
+    """Code generated for an agent runs in the sandbox through the PandasAI internals it relies on"""
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    monkeypatch.setattr(sandbox, 'SANDBOX', True)
+    df = pd.DataFrame({'a': range(10)})
+    ref = dataset_store.store_dataframe(df, 'data.csv')
+    code = "result = {'type': 'number', 'value': int(dfs[0]['a'].sum())}"
+    agent = Agent(df, {'llm': FakeLLM(output=code), 'enable_cache': False, 'save_charts': False})
+    sandbox.install(agent, ref, None, pool)
+    assert any(isinstance(step, sandbox.SandboxedCodeExecution) for step in sandbox.pipeline_steps(agent))
+    assert agent.chat('What is the sum of a?') == 45
+    assert pool.stats()['completed'] == 1
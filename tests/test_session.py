@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+import session as session_module
+from session import MemoryBackend, SQLiteBackend, SessionBackend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend(ttl=0.2)
+    return SQLiteBackend(str(tmp_path / 'sessions.db'), ttl=0.2)
+
+
+def test_backend(backend):
+    """States are versioned on every save, and expire once untouched for the TTL"""
+    state = {'model': 'openai', 'selection': [0, None], 'history': [{'message': 'hi', 'is_user': True}]}
+    assert backend.load('token') is None
+    assert backend.save('token', state) == 1
+    assert backend.save('token', {**state, 'model': 'bamboo'}) == 2
+    assert backend.load('token') == {**state, 'model': 'bamboo', 'version': 2}
+    assert backend.version('token') == 2 and backend.version('other') is None
+    time.sleep(0.3)
+    assert backend.load('token') is None
+
+
+def test_sqlite_shared(tmp_path):
+    """Backends opening the same database, as in separate workers, see each other's sessions"""
+    first = SQLiteBackend(str(tmp_path / 'sessions.db'))
+    second = SQLiteBackend(str(tmp_path / 'sessions.db'))
+    first.save('token', {'model': 'openai'})
+    assert second.load('token') == {'model': 'openai', 'version': 1}
+    assert second.save('token', {'model': 'bamboo'}) == 2
+    assert first.version('token') == 2
+    second.delete('token')
+    assert first.load('token') is None and first.stats()['size'] == 0
+
+
+def test_sqlite_version_touch(tmp_path, monkeypatch):
+    """Checking the version keeps a session alive, as requests may never load its state again"""
+    monkeypatch.setattr(session_module, 'TOUCH_INTERVAL', 0)
+    backend = SQLiteBackend(str(tmp_path / 'sessions.db'), ttl=0.3)
+    backend.save('token', {'model': 'openai'})
+    for _ in range(3):
+        time.sleep(0.15)
+        assert backend.version('token') == 1
+
+
+def test_incomplete_backend():
+    """Backends missing methods fail when instantiated rather than when used"""
+    class LoadOnlyBackend(SessionBackend):
+        def load(self, token: str) -> dict | None:
+            return None
+
+    with pytest.raises(TypeError):
+        LoadOnlyBackend()
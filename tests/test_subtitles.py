@@ -0,0 +1,54 @@
+import json
+import time
+
+from subtitles import Cue, export, format_timestamp, make_cues
+
+
+def make_segments(count: int, words: bool = True):
+    segments = []
+    for i in range(count):
+        start = i * 4.0
+        segment_words = [{'start': start + j * 0.5, 'end': start + j * 0.5 + 0.4, 'word': f' word{j}',
+                          'probability': 0.9} for j in range(8)] if words else None
+        segments.append({'start': start, 'end': start + 3.9, 'text': ' ' + ' '.join(f'word{j}' for j in range(8)),
+                         'words': segment_words})
+    return segments
+
+
+def test_format_timestamp():
+    assert format_timestamp(0) == '00:00:00,000'
+    assert format_timestamp(3661.2346) == '01:01:01,235'
+    assert format_timestamp(59.9996, '.') == '00:01:00.000'
+
+
+def test_srt_and_vtt():
+    segments = make_segments(2, words=False)
+    assert ''.join(export(segments, 'srt')) == (
+        '1\n00:00:00,000 --> 00:00:03,900\nword0 word1 word2 word3 word4 word5 word6 word7\n\n'
+        '2\n00:00:04,000 --> 00:00:07,900\nword0 word1 word2 word3 word4 word5 word6 word7\n\n')
+    assert ''.join(export(segments, 'vtt')).startswith('WEBVTT\n\n00:00:00.000 --> 00:00:03.900\n')
+    words = json.loads(''.join(export(make_segments(2), 'json')))
+    assert len(words) == 16 and words[1] == {'start': 0.5, 'end': 0.9, 'word': 'word1', 'probability': 0.9}
+
+
+def test_resegmentation():
+    """Cues are split from word timestamps to fit two lines, and extended to be readable"""
+    cues = list(make_cues(make_segments(1), max_chars=12))
+    assert [cue.text for cue in cues] == ['word0 word1\nword2 word3', 'word4 word5\nword6 word7']
+    assert cues[0] == Cue(0.0, 1.9, cues[0].text) and cues[1].start == 2.0
+    segments = [{'start': 0, 'end': 1, 'text': 'a' * 30, 'words': None},
+                {'start': 1.5, 'end': 2, 'text': 'b' * 10, 'words': None}]
+    cues = list(make_cues(segments, max_cps=15))
+    # The first cue needs 2 seconds but may only extend up to the next one, the last one has no limit
+    assert cues[0].end == 1.5 and abs(cues[1].end - (1.5 + 10 / 15)) < 1e-9
+
+
+def test_export_benchmark():
+    """Export of long transcripts stays linear, i.e. fast for tens of thousands of segments"""
+    segments = make_segments(20_000)
+    for format, options in [('srt', {}), ('vtt', {}), ('json', {}), ('srt', {'max_chars': 42, 'max_cps': 17})]:
+        start = time.perf_counter()
+        size = sum(len(chunk) for chunk in export(segments, format, **options))
+        elapsed = time.perf_counter() - start
+        print(f'{format} {options}: {len(segments)} segments, {size} characters in {elapsed:.3f} s')
+        assert elapsed < 5
@@ -0,0 +1,36 @@
+import json
+
+from transcript import Transcript, build_transcript, dumps
+
+
+def make_segments(count: int):
+    return [{'id': i, 'seek': 0, 'start': i * 2.0, 'end': i * 2.0 + 1.5, 'text': f'Segment {i} é',
+             'tokens': list(range(i % 3)), 'avg_logprob': -0.5, 'compression_ratio': 1.2, 'no_speech_prob': 0.1,
+             'temperature': 0.0,
+             'words': [{'start': i * 2.0 + j, 'end': i * 2.0 + j + 0.5, 'word': f' w{j}', 'probability': 0.5}
+                       for j in range(2)]}
+            for i in range(count)]
+
+
+def test_round_trip():
+    """Pages rebuild segments exactly as appended, also after serialization"""
+    segments = make_segments(5)
+    transcript = build_transcript(segments)
+    assert len(transcript) == 5 and transcript.tokens == 4
+    assert transcript.page() == segments
+    assert transcript.page(3, 10) == segments[3:]
+    assert list(transcript) == segments
+    restored, meta = Transcript.from_bytes(transcript.to_bytes({'lang': 'en'}))
+    assert restored.page(1, 2) == segments[1:3] and meta == {'lang': 'en'}
+    assert json.loads(dumps(transcript.page(0, 1))) == segments[:1]
+
+
+def test_head():
+    transcript = build_transcript(make_segments(5)).head(5)
+    assert [segment['id'] for segment in transcript.page()] == [0, 1, 2]
+    assert transcript.tokens == 3
+
+
+def test_no_words():
+    segments = [{**segment, 'words': None} for segment in make_segments(2)]
+    assert build_transcript(segments).page() == segments
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import pytest
+
+from workers import WorkerPool, PoolSaturated, SessionBusy, session_guard
+
+
+def test_pool_saturation():
+    """Jobs beyond workers plus queue slots must be rejected"""
+    pool = WorkerPool('test', max_workers=1, max_queue=1)
+
+    async def flow():
+        jobs = [asyncio.ensure_future(pool.run(time.sleep, 0.1)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(PoolSaturated):
+            await pool.run(time.sleep, 0)
+        await asyncio.gather(*jobs)
+
+    asyncio.run(flow())
+    assert pool.stats()['rejected'] == 1 and pool.stats()['pending'] == 0
+    pool.shutdown()
+
+
+def test_session_serialization():
+    """Jobs on the same session key never overlap, and excess waiters are turned away"""
+    pool = WorkerPool('test', max_workers=4, max_queue=4)
+    running = []
+    overlaps = []
+
+    def job():
+        running.append(1)
+        if len(running) > 1:
+            overlaps.append(1)
+        time.sleep(0.05)
+        running.pop()
+
+    async def flow():
+        jobs = [asyncio.ensure_future(pool.run(job, key='token')) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(SessionBusy):
+            await pool.run(job, key='token')
+        await asyncio.gather(*jobs)
+
+    asyncio.run(flow())
+    assert not overlaps
+    pool.shutdown()
+
+
+def test_deferred_release():
+    """Callbacks deferred on session keys wait for every job holding them, and run at once on free keys"""
+    pool = WorkerPool('test', max_workers=2, max_queue=2)
+    released = []
+
+    async def flow():
+        agent = asyncio.ensure_future(pool.run(time.sleep, 0.05, key=('token', 'agent')))
+        media = asyncio.ensure_future(pool.run(time.sleep, 0.1, key=('token', 'media')))
+        await asyncio.sleep(0.01)
+        session_guard.defer([('token', 'agent'), ('token', 'media')], lambda: released.append('token'))
+        session_guard.defer([('other', 'agent')], lambda: released.append('other'))
+        assert released == ['other']
+        await agent
+        await asyncio.sleep(0.01)
+        assert released == ['other']
+        await media
+        await asyncio.sleep(0.01)
+
+    asyncio.run(flow())
+    assert released == ['other', 'token']
+    pool.shutdown()
@@ -0,0 +1,220 @@
+"""
+Compact columnar storage of decoded transcripts
+
+    - Segments and words are kept as NumPy columns, with all texts in one string indexed by offsets,
+      instead of Python objects for every segment, word and token
+    - Pages of segments are turned back into plain dicts only when serialized
+    - Serialization uses orjson when installed, falling back to the standard json module
+
+Usage: Append decoded segments to a TranscriptBuilder, build() it, then page() or dumps() for responses,
+and to_bytes()/from_bytes() for storage.
+"""
+
+import io
+import json
+from typing import Iterable, Iterator
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Segment fields stored as one column each, with their dtypes
+SEGMENT_COLUMNS = {
+    'seek': np.int64,
+    'start': np.float64,
+    'end': np.float64,
+    'avg_logprob': np.float64,
+    'compression_ratio': np.float64,
+    'no_speech_prob': np.float64,
+    'temperature': np.float64,
+}
+WORD_COLUMNS = {
+    'word_start': np.float64,
+    'word_end': np.float64,
+    'word_probability': np.float64,
+}
+
+
+def get(item, name: str, default=None):
+    """Read a field of a segment or word, which are dicts with the whisper engine and objects otherwise."""
+    value = item.get(name, default) if isinstance(item, dict) else getattr(item, name, default)
+    return default if value is None else value
+
+
+def dumps(value) -> bytes:
+    """Encode value as JSON, with NumPy arrays and scalars supported."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(value, ensure_ascii=False, default=lambda item: item.tolist()).encode()
+
+
+class Transcript:
+    """Immutable columnar transcript, iterable as segment dicts in the format of the whisper engine"""
+
+    def __init__(self, columns: dict[str, np.ndarray], text: str, word_text: str, has_words: bool):
+        """ Instantiate from columns, see TranscriptBuilder for their layout
+
+            Parameters
+            columns (dict): Segment columns, word columns, and offsets of texts, tokens and words per segment
+            text (str): Texts of all segments concatenated
+            word_text (str): Texts of all words concatenated
+            has_words (bool): Whether words were decoded, to tell no words from empty word lists
+        """
+        self.columns = columns
+        self.text = text
+        self.word_text = word_text
+        self.has_words = has_words
+
+    def __len__(self):
+        return len(self.columns['start'])
+
+    def __iter__(self) -> Iterator[dict]:
+        # Rebuild in pages so iteration never holds more than a page of dicts
+        for offset in range(0, len(self), 1000):
+            yield from self.page(offset, 1000)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values()) + len(self.text) + len(self.word_text)
+
+    @property
+    def tokens(self) -> int:
+        return len(self.columns['tokens'])
+
+    def page(self, offset: int = 0, limit: int | None = None) -> list[dict]:
+        """Return segments from offset, at most limit of them, as dicts with words and tokens."""
+        stop = len(self) if limit is None else min(len(self), offset + limit)
+        if offset >= stop:
+            return []
+        columns = self.columns
+        values = {name: columns[name][offset:stop].tolist() for name in SEGMENT_COLUMNS}
+        text_offsets = columns['text_offsets'][offset:stop + 1].tolist()
+        token_offsets = columns['token_offsets'][offset:stop + 1].tolist()
+        word_offsets = columns['word_offsets'][offset:stop + 1].tolist()
+        # Slice words and tokens of the whole page at once, then split them by segment
+        tokens = columns['tokens'][token_offsets[0]:token_offsets[-1]].tolist()
+        first_word, last_word = word_offsets[0], word_offsets[-1]
+        words = {name: columns[name][first_word:last_word].tolist() for name in WORD_COLUMNS}
+        word_text_offsets = columns['word_text_offsets'][first_word:last_word + 1].tolist()
+        segments = []
+        for i in range(stop - offset):
+            segment = {'id': offset + i}
+            for name in SEGMENT_COLUMNS:
+                segment[name] = values[name][i]
+            segment['text'] = self.text[text_offsets[i]:text_offsets[i + 1]]
+            segment['tokens'] = tokens[token_offsets[i] - token_offsets[0]:token_offsets[i + 1] - token_offsets[0]]
+            if self.has_words:
+                segment['words'] = [
+                    {'start': words['word_start'][j], 'end': words['word_end'][j],
+                     'word': self.word_text[word_text_offsets[j]:word_text_offsets[j + 1]],
+                     'probability': words['word_probability'][j]}
+                    for j in range(word_offsets[i] - first_word, word_offsets[i + 1] - first_word)]
+            else:
+                segment['words'] = None
+            segments.append(segment)
+        return segments
+
+    def head(self, seconds: float) -> 'Transcript':
+        """Return the segments starting within the first seconds, which are sorted by start time."""
+        count = int(np.searchsorted(self.columns['start'], seconds, side='left'))
+        return self.slice(count)
+
+    def slice(self, count: int) -> 'Transcript':
+        """Return the first count segments with their words, texts and tokens."""
+        columns = self.columns
+        text_end = int(columns['text_offsets'][count])
+        token_end = int(columns['token_offsets'][count])
+        word_end = int(columns['word_offsets'][count])
+        word_text_end = int(columns['word_text_offsets'][word_end])
+        sliced = {}
+        for name, column in columns.items():
+            if name in SEGMENT_COLUMNS:
+                sliced[name] = column[:count]
+            elif name in WORD_COLUMNS:
+                sliced[name] = column[:word_end]
+            elif name == 'tokens':
+                sliced[name] = column[:token_end]
+            elif name == 'word_text_offsets':
+                sliced[name] = column[:word_end + 1]
+            else:
+                sliced[name] = column[:count + 1]
+        return Transcript(sliced, self.text[:text_end], self.word_text[:word_text_end], self.has_words)
+
+    def to_bytes(self, meta: dict | None = None) -> bytes:
+        """Serialize columns and texts, with optional metadata, as uncompressed NumPy archive."""
+        buffer = io.BytesIO()
+        extra = {'text': np.frombuffer(self.text.encode(), np.uint8),
+                 'word_text': np.frombuffer(self.word_text.encode(), np.uint8),
+                 'has_words': np.array(self.has_words),
+                 'meta': np.frombuffer(dumps(meta or {}), np.uint8)}
+        np.savez(buffer, **self.columns, **extra)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> ('Transcript', dict):
+        """Deserialize what to_bytes() produced, returning the transcript and its metadata."""
+        with np.load(io.BytesIO(data)) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+        text = arrays.pop('text').tobytes().decode()
+        word_text = arrays.pop('word_text').tobytes().decode()
+        has_words = bool(arrays.pop('has_words'))
+        meta = json.loads(arrays.pop('meta').tobytes())
+        return cls(arrays, text, word_text, has_words), meta
+
+
+class TranscriptBuilder:
+    """Accumulates segments as they are decoded, keeping only their values, not the segment objects"""
+
+    def __init__(self):
+        self.values: dict[str, list] = {name: [] for name in SEGMENT_COLUMNS}
+        self.word_values: dict[str, list] = {name: [] for name in WORD_COLUMNS}
+        self.texts: list[str] = []
+        self.word_texts: list[str] = []
+        self.tokens: list[int] = []
+        self.text_offsets = [0]
+        self.token_offsets = [0]
+        self.word_offsets = [0]
+        self.word_text_offsets = [0]
+        self.has_words = False
+
+    def append(self, segment):
+        for name in SEGMENT_COLUMNS:
+            self.values[name].append(get(segment, name, 0))
+        text = get(segment, 'text', '')
+        self.texts.append(text)
+        self.text_offsets.append(self.text_offsets[-1] + len(text))
+        self.tokens += get(segment, 'tokens', [])
+        self.token_offsets.append(len(self.tokens))
+        words = get(segment, 'words')
+        if words is not None:
+            self.has_words = True
+            for word in words:
+                self.word_values['word_start'].append(get(word, 'start', 0))
+                self.word_values['word_end'].append(get(word, 'end', 0))
+                self.word_values['word_probability'].append(get(word, 'probability', 0))
+                word_text = get(word, 'word', '')
+                self.word_texts.append(word_text)
+                self.word_text_offsets.append(self.word_text_offsets[-1] + len(word_text))
+        self.word_offsets.append(len(self.word_texts))
+
+    def extend(self, segments: Iterable):
+        for segment in segments:
+            self.append(segment)
+        return self
+
+    def build(self) -> Transcript:
+        columns = {name: np.array(values, dtype=SEGMENT_COLUMNS[name]) for name, values in self.values.items()}
+        columns.update({name: np.array(values, dtype=WORD_COLUMNS[name]) for name, values in self.word_values.items()})
+        columns['tokens'] = np.array(self.tokens, dtype=np.int32)
+        columns['text_offsets'] = np.array(self.text_offsets, dtype=np.int64)
+        columns['token_offsets'] = np.array(self.token_offsets, dtype=np.int64)
+        columns['word_offsets'] = np.array(self.word_offsets, dtype=np.int64)
+        columns['word_text_offsets'] = np.array(self.word_text_offsets, dtype=np.int64)
+        return Transcript(columns, ''.join(self.texts), ''.join(self.word_texts), self.has_words)
+
+
+def build_transcript(segments: Iterable) -> Transcript:
+    return TranscriptBuilder().extend(segments).build()
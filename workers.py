@@ -0,0 +1,234 @@
+"""
+Execution layer to run blocking work off the API event loop
+
+    - Separate bounded pools for LLM queries, ASR transcription and file parsing, sized from environment
+    - Reject new work when a pool queue is full instead of piling up requests
+    - Serialize work per session resource so concurrent requests never race on the same Agent or Media
+
+Usage: Await pool.run(...) from async endpoints, passing a session key where state is mutated.
+"""
+
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Hashable
+
+
+class PoolSaturated(Exception):
+    """Raised when a pool has no free worker nor queue slot; maps to HTTP 503."""
+
+    def __init__(self, pool: str):
+        super().__init__(f'Server busy processing {pool} requests. Please retry shortly')
+        self.pool = pool
+
+
+class SessionBusy(Exception):
+    """Raised when too many requests are already waiting on the same session; maps to HTTP 429."""
+
+    def __init__(self):
+        super().__init__('Too many pending requests in this session. Please wait for previous ones')
+
+
+# Maximum number of requests allowed to wait for a busy session resource
+SESSION_MAX_PENDING = int(os.environ.get('SESSION_MAX_PENDING', 2))
+
+
+class SessionGuard:
+    """Per-key asyncio locks, created on demand and dropped once no request holds or waits on them."""
+
+    def __init__(self, max_pending: int = SESSION_MAX_PENDING):
+        self.max_pending = max_pending
+        self.locks: dict[Hashable, list] = {}  # key -> [lock, number of holders and waiters]
+        # Callbacks waiting for keys to be free, by the key they wait on first
+        self.deferred: dict[Hashable, list[tuple[list, Callable]]] = {}
+        # Keys are acquired and released on the event loop, but may be checked from worker threads
+        self.mutex = threading.Lock()
+
+    def defer(self, keys: list, callback: Callable):
+        """ Call back once no request holds or waits on any of the keys, at once if none does
+
+            Parameters
+            keys (list): Keys to wait for, e.g. all resources of a session
+            callback (callable): Called without arguments, on the event loop thread if deferred
+        """
+        with self.mutex:
+            held = next((key for key in keys if key in self.locks), None)
+            if held is not None:
+                self.deferred.setdefault(held, []).append((keys, callback))
+                return
+        callback()
+
+    async def acquire(self, key):
+        with self.mutex:
+            entry = self.locks.setdefault(key, [asyncio.Lock(), 0])
+            lock = entry[0]
+            if lock.locked() and entry[1] > self.max_pending:
+                raise SessionBusy()
+            entry[1] += 1
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._leave(key)
+            raise
+
+    def release(self, key):
+        entry = self.locks.get(key)
+        if entry:
+            entry[0].release()
+            self._leave(key)
+
+    def _leave(self, key):
+        with self.mutex:
+            entry = self.locks[key]
+            entry[1] -= 1
+            if entry[1]:
+                return
+            del self.locks[key]
+            deferred = self.deferred.pop(key, [])
+        # Other keys may still be held, in which case callbacks wait for them in turn
+        for keys, callback in deferred:
+            try:
+                self.defer(keys, callback)
+            except Exception as e:
+                print('Deferred session callback error', repr(e))
+
+
+session_guard = SessionGuard()
+
+
+class WorkerPool:
+    """Bounded executor with a queue depth limit
+
+    At most max_workers jobs run concurrently and max_queue more may wait; anything beyond is rejected.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, processes: bool = False):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.processes = processes
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self._executor: Executor | None = None
+
+    @property
+    def executor(self) -> Executor:
+        # Created on first use so importing the module never forks processes
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=process_context()) if self.processes \
+                else ThreadPoolExecutor(self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def warm(self):
+        """Start worker processes ahead of the first jobs, which would otherwise wait for them."""
+        if self.processes:
+            for _ in range(self.max_workers):
+                self.executor.submit(os.getpid)
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """Submit a job, raising PoolSaturated when queue is full."""
+        with self.lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PoolSaturated(self.name)
+            self.pending += 1
+        try:
+            if self.processes:
+                future = self.executor.submit(fn, *args, **kwargs)
+            else:
+                # Carry request context over, e.g. to collect span timings from worker threads
+                future = self.executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _future):
+        with self.lock:
+            self.pending -= 1
+            self.completed += 1
+
+    async def start(self, fn: Callable, *args, key: Hashable = None, **kwargs) -> asyncio.Future:
+        """ Submit blocking function to the pool, once the session resource is free
+
+            Parameters
+            fn (callable): Function to run, must be picklable for process pools
+            key (hashable): Session resource to serialize on, e.g. (token, 'agent')
+
+            Returns
+            Awaitable future of the function result
+
+            Raises
+            SessionBusy: Too many requests waiting on the same key
+            PoolSaturated: Pool queue is full
+        """
+        if key is None:
+            return asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+        await session_guard.acquire(key)
+        try:
+            future = self.submit(fn, *args, **kwargs)
+        except BaseException:
+            session_guard.release(key)
+            raise
+        # Hold the session until the job really finishes, even if the awaiting request is cancelled
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(session_guard.release, key))
+        return asyncio.wrap_future(future)
+
+    async def run(self, fn: Callable, *args, key: Hashable = None, **kwargs):
+        """Run blocking function in the pool and await its result; see start for details."""
+        return await (await self.start(fn, *args, key=key, **kwargs))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'workers': self.max_workers,
+                'queue': self.max_queue,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def process_context():
+    """Start worker processes from a fork server where available, as forking the threaded server may deadlock."""
+    try:
+        return multiprocessing.get_context('forkserver')
+    except ValueError:
+        return multiprocessing.get_context('spawn')
+
+
+def env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+# LLM round trips are IO bound so may run many threads
+llm_pool = WorkerPool('llm', env_int('LLM_WORKERS', 4), env_int('LLM_QUEUE', 16))
+# ASR models are held in process memory so run in threads, bounded by compute capacity
+asr_pool = WorkerPool('asr', env_int('ASR_WORKERS', 1), env_int('ASR_QUEUE', 4))
+# File parsing is CPU bound so uses processes, in which case inputs are passed as file paths, threads if disabled
+parse_pool = WorkerPool('parse', env_int('PARSE_WORKERS', 2), env_int('PARSE_QUEUE', 8),
+                        processes=os.environ.get('PARSE_PROCESSES', 'true').lower() in ['1', 'true', 'yes'])
+
+pools = [llm_pool, asr_pool, parse_pool]
+
+
+def get_pool_stats():
+    return {pool.name: pool.stats() for pool in pools}
+
+
+def shutdown_pools():
+    for pool in pools:
+        pool.shutdown()
+